@@ -1,868 +1,981 @@
-from flask import Flask, render_template, request, jsonify, session
-import random
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, session, url_for
+from flask.json.provider import DefaultJSONProvider
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import gzip
 import json
 import os
-import time
-import collections
 import itertools
+import functools
+import hmac
+import time
+
+from game_registry import GameRegistry
+from game_store import VersionConflict, open_store
+from hand_tables import HAND_CACHE, TILE_IDS
+from mahjong import AI_STRENGTHS, WIRE_FORMATS, MahjongGame, tile_id_to_dict
+from doudizhu import DoudizhuGame
+import metrics
+import monte_carlo
+import profiling
+import replay
+import rooms
+import tracing
+
+try:
+    import brotli
+except ImportError:  # 没有安装 brotli 时只用 gzip 压缩
+    brotli = None
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+# 游戏保存在磁盘上时需要固定的密钥，否则服务重启后会话（游戏ID）失效
+app.secret_key = os.environ.get("MAHJONG_SECRET_KEY") or os.urandom(24)
+app.config["MAX_GAMES"] = int(os.environ.get("MAHJONG_MAX_GAMES", 1000))  # 同时存在的最大游戏数
+app.config["GAME_IDLE_TTL"] = int(os.environ.get("MAHJONG_GAME_IDLE_TTL", 1800))  # 游戏空闲多少秒后被清理
+app.config["EVENT_HEARTBEAT"] = float(os.environ.get("MAHJONG_EVENT_HEARTBEAT", 15))  # 推送连接空闲时发送心跳的间隔（秒）
+app.config["AI_WORKERS"] = int(os.environ.get("MAHJONG_AI_WORKERS", 4))  # 后台执行AI回合的线程数
+app.config["AI_STRENGTH"] = os.environ.get("MAHJONG_AI_STRENGTH", "basic")  # 默认AI强度：basic 或 monte_carlo
+app.config["AI_BUDGET_MS"] = int(os.environ.get("MAHJONG_AI_BUDGET_MS", 50))  # monte_carlo 模式下AI每次决策的时间上限（毫秒）
+app.config["TURN_BUDGET_MS"] = int(os.environ.get("MAHJONG_TURN_BUDGET_MS", 300))  # 每个请求中AI行动的时间上限（毫秒），超过后在后台继续，0 表示不限
+app.config["AI_PROCESSES"] = int(os.environ.get("MAHJONG_AI_PROCESSES", monte_carlo.DEFAULT_WORKERS))  # 模拟用的进程数，0 表示不用进程池
+app.config["HAND_CACHE_SIZE"] = int(os.environ.get("MAHJONG_HAND_CACHE_SIZE", 1 << 16))  # 手牌评估缓存的最大条目数（所有游戏共用）
+app.config["ENGINE_METRICS"] = os.environ.get("MAHJONG_ENGINE_METRICS", "scrape")  # 引擎各阶段计时：scrape（被抓取后才计时）、always 或 off
+app.config["GAME_STORE"] = os.environ.get("MAHJONG_GAME_STORE", "memory")  # 休眠游戏的存储：memory、sqlite:路径、file:目录 或 none
+app.config["DOUDIZHU_ENDGAME_CARDS"] = int(os.environ.get("DOUDIZHU_ENDGAME_CARDS", 20))  # 斗地主三家剩余牌数不超过多少张时AI求解残局，0 表示不求解
+app.config["DOUDIZHU_SOLVER_MS"] = int(os.environ.get("DOUDIZHU_SOLVER_MS", 50))  # 斗地主残局求解每步的时间上限（毫秒）
+app.config["HIBERNATE_AFTER"] = float(os.environ.get("MAHJONG_HIBERNATE_AFTER", 120))  # 游戏空闲多少秒后休眠
+app.config["SHARED_GAMES"] = os.environ.get("MAHJONG_SHARED_GAMES", "0") == "1"  # 多个进程共用游戏存储（存储是游戏的唯一来源）
+app.config["CLAIM_TIMEOUT"] = float(os.environ.get("MAHJONG_CLAIM_TIMEOUT", 10))  # 多人房间中决定是否鸣牌的时限（秒），超时视为过，0 表示不限
+app.config["TURN_TIMEOUT"] = float(os.environ.get("MAHJONG_TURN_TIMEOUT", 30))  # 多人房间中摸牌、出牌的时限（秒），超时由服务端代打，0 表示不限
+app.config["SHARED_POLL_MS"] = int(os.environ.get("MAHJONG_SHARED_POLL_MS", 500))  # 共享存储时推送连接检查其他进程修改的间隔（毫秒）
+app.config["COMPRESS_MIN_BYTES"] = int(os.environ.get("MAHJONG_COMPRESS_MIN_BYTES", 1024))  # 超过这个大小的响应压缩（gzip / brotli），0 表示不压缩
+app.config["DEBUG_TOKEN"] = os.environ.get("MAHJONG_DEBUG_TOKEN", "")  # 调试接口（/debug/*）和强制分析请求头需要的口令，空字符串表示关闭
+app.config["PROFILE_DIR"] = os.environ.get("MAHJONG_PROFILE_DIR", "")  # 采样分析结果的目录，空字符串表示不分析
+app.config["PROFILE_RATE"] = float(os.environ.get("MAHJONG_PROFILE_RATE", 0.01))  # 按比例分析的请求比例，0 表示只分析带调试请求头的请求
+app.config["PROFILE_KEEP"] = int(os.environ.get("MAHJONG_PROFILE_KEEP", 200))  # 最多保留的分析结果数
+app.config["TRACE"] = os.environ.get("MAHJONG_TRACE", "off")  # 单局时间线：off、opt-in（由 /debug/trace 开启）或 all
+app.config["TRACE_EVENTS"] = int(os.environ.get("MAHJONG_TRACE_EVENTS", tracing.DEFAULT_CAPACITY))  # 每局时间线最多保留的阶段数
+
+TRACE_MODES = ("off", "opt-in", "all")
+if app.config["TRACE"] not in TRACE_MODES:
+    raise ValueError(f"未知的时间线模式: {app.config['TRACE']}")
+# monte_carlo 的AI每次决策都要用满 AI_BUDGET_MS，一个请求中AI连续行动时不限制总时间会长时间占用请求线程
+if app.config["AI_STRENGTH"] == "monte_carlo" and not app.config["TURN_BUDGET_MS"]:
+    raise ValueError("monte_carlo AI（MAHJONG_AI_STRENGTH）需要设置 MAHJONG_TURN_BUDGET_MS")
+# 每个进程随机生成的密钥不同，其他进程无法识别会话中的游戏ID
+if app.config["SHARED_GAMES"] and not os.environ.get("MAHJONG_SECRET_KEY"):
+    raise ValueError("共享游戏（MAHJONG_SHARED_GAMES）需要设置 MAHJONG_SECRET_KEY")
+
+
+# 所有进行中的游戏，按会话中的游戏ID区分
+# 共享模式下每次修改都按版本号写入存储，多个 worker（或多台机器）可以处理同一局游戏的请求
+# 恢复或同步时补上的AI回合同样受 TURN_BUDGET_MS 限制，剩下的在后台执行
+games = GameRegistry(max_games=app.config["MAX_GAMES"], idle_ttl=app.config["GAME_IDLE_TTL"],
+                     store=open_store(app.config["GAME_STORE"], app.config["GAME_IDLE_TTL"]),
+                     hibernate_after=app.config["HIBERNATE_AFTER"], shared=app.config["SHARED_GAMES"],
+                     poll_interval=app.config["SHARED_POLL_MS"] / 1000,
+                     turn_budget=app.config["TURN_BUDGET_MS"] / 1000 or None,
+                     on_pending=lambda game_id: ai_executor.submit(advance_game, game_id))
+# 退出时休眠所有游戏，存储在磁盘上时重启后可以继续
+atexit.register(games.hibernate_all)
+
+# 共享存储时，操作期间其他进程先修改了这局游戏（版本冲突），重新读取后再执行一次，最多这么多次
+CONFLICT_RETRIES = 3
+
+# 斗地主游戏，会话中用单独的游戏ID（不休眠）
+doudizhu_games = GameRegistry(max_games=app.config["MAX_GAMES"], idle_ttl=app.config["GAME_IDLE_TTL"])
+
+HAND_CACHE.resize(app.config["HAND_CACHE_SIZE"])
+metrics.set_engine_timing(app.config["ENGINE_METRICS"])
+monte_carlo.configure(app.config["AI_PROCESSES"])
+
+# 异步模式下在后台执行AI回合，结果通过 /events 推送
+ai_executor = ThreadPoolExecutor(max_workers=app.config["AI_WORKERS"], thread_name_prefix="mahjong-ai")
+
+# 多人房间的操作时限，到期后在后台线程中代打（见 play_timeout）
+turn_timer = rooms.TurnTimer(lambda room_id, version, seat: ai_executor.submit(play_timeout, room_id, version, seat))
+
+
+# ---- 运行指标（GET /metrics） ----
+
+REQUEST_LATENCY = metrics.histogram("mahjong_request_duration_seconds", "Request latency by route", ("route",))
+REQUESTS = metrics.counter("mahjong_requests_total", "Requests by route and status code", ("route", "status"))
+
+# 不计时的路由：推送连接一直不结束，/metrics 本身不计
+UNTIMED_ENDPOINTS = {"game_events", "metrics_endpoint", "static"}
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    metrics.expire_engine_timing()
+
+
+@app.after_request
+def count_request(response):
+    if request.endpoint not in UNTIMED_ENDPOINTS:
+        REQUESTS.inc(request.endpoint or "unknown", str(response.status_code))
+    return response
+
+
+# ---- 线路格式和压缩 ----
+
+# 请求紧凑格式的方式：查询参数 wire=compact（推送连接只能用这种），或者 Accept 请求头中带有 COMPACT_MIMETYPE
+COMPACT_MIMETYPE = "application/vnd.mahjong.compact+json"
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/plain"}
+
+
+# 当前请求要求的线路格式（见 mahjong.WIRE_FORMATS）
+def wire_format():
+    if request.args.get("wire") == "compact" or COMPACT_MIMETYPE in request.headers.get("Accept", ""):
+        return "compact"
+    return "verbose"
+
+
+# 客户端支持时压缩较大的响应：优先 brotli（安装了的话），其次 gzip；推送连接和文件下载不压缩
+@app.after_request
+def compress_response(response):
+    min_bytes = app.config["COMPRESS_MIN_BYTES"]
+    if (not min_bytes or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES or "Content-Encoding" in response.headers):
+        return response
+
+    # 是否压缩取决于 Accept-Encoding，线上格式取决于 Accept
+    response.vary.add("Accept-Encoding")
+    response.vary.add("Accept")
+    accepted = request.headers.get("Accept-Encoding", "")
+    if (brotli is None or "br" not in accepted) and "gzip" not in accepted:
+        return response
+    data = response.get_data()
+    if len(data) < min_bytes:
+        return response
+
+    if brotli is not None and "br" in accepted:
+        response.set_data(brotli.compress(data, quality=4))
+        response.headers["Content-Encoding"] = "br"
+    else:
+        response.set_data(gzip.compress(data, compresslevel=5))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
 
-# 麻将牌定义
-class Tile:
-    def __init__(self, suit, value):
-        self.suit = suit  # 牌的类型：筒、条、万、风、箭
-        self.value = value  # 牌的数值
 
-    def __str__(self):
-        return f"{self.suit}_{self.value}"
+# 请求结束时记录耗时（包括出错的请求）
+@app.teardown_request
+def record_request_latency(exc):
+    start = g.pop("request_start", None)
+    if start is not None and request.endpoint not in UNTIMED_ENDPOINTS:
+        REQUEST_LATENCY.observe(time.perf_counter() - start, request.endpoint or "unknown")
 
-    def to_dict(self):
-        return {
-            'suit': self.suit,
-            'value': self.value,
-            'id': f"{self.suit}_{self.value}"
-        }
 
-# 游戏类
-class MahjongGame:
-    def __init__(self):
-        self.tiles = []  # 牌堆
-        self.players = []  # 玩家
-        self.current_player = 0  # 当前玩家索引
-        self.game_state = "waiting"  # 游戏状态
-        self.last_discarded = None  # 最后一张弃牌
-        self.last_action = None  # 最后一个动作
-        self.waiting_for_action = False  # 是否等待玩家操作（碰、杠、胡）
-        self.possible_actions = {}  # 可能的操作
-        self.wall_count = 0  # 开杠次数，用于岭上开花
-        self.last_drawn_tile = None  # 最后摸到的牌
-        self.initialize_game()
-
-    def initialize_game(self):
-        # 创建牌堆
-        self.create_tiles()
-        # 洗牌
-        self.shuffle_tiles()
-        # 创建四个玩家
-        self.players = [
-            {
-                "name": "玩家",
-                "type": "human",
-                "hand": [],
-                "discarded": [],
-                "ready": False,
-                "melds": [],  # 已经组合的牌（碰、杠）
-                "score": 0,   # 玩家分数
-                "winning_hand": None,  # 胡牌时的牌型
-                "is_waiting": False    # 是否听牌
-            },
-            {
-                "name": "东家",
-                "type": "ai",
-                "hand": [],
-                "discarded": [],
-                "ready": False,
-                "melds": [],
-                "score": 0,
-                "winning_hand": None,
-                "is_waiting": False
-            },
-            {
-                "name": "南家",
-                "type": "ai",
-                "hand": [],
-                "discarded": [],
-                "ready": False,
-                "melds": [],
-                "score": 0,
-                "winning_hand": None,
-                "is_waiting": False
-            },
-            {
-                "name": "西家",
-                "type": "ai",
-                "hand": [],
-                "discarded": [],
-                "ready": False,
-                "melds": [],
-                "score": 0,
-                "winning_hand": None,
-                "is_waiting": False
-            }
-        ]
-        # 发牌
-        self.deal_tiles()
-        # 设置游戏状态
-        self.game_state = "playing"
-        self.current_player = 0
-        self.waiting_for_action = False
-        self.possible_actions = {}
-        self.wall_count = 0
-        self.last_drawn_tile = None
-
-    def create_tiles(self):
-        self.tiles = []
-        # 筒、条、万，各9种，每种4张
-        for suit in ["筒", "条", "万"]:
-            for value in range(1, 10):
-                for _ in range(4):
-                    self.tiles.append(Tile(suit, value))
-
-        # 风牌：东、南、西、北，每种4张
-        for value in ["东", "南", "西", "北"]:
-            for _ in range(4):
-                self.tiles.append(Tile("风", value))
-
-        # 箭牌：中、发、白，每种4张
-        for value in ["中", "发", "白"]:
-            for _ in range(4):
-                self.tiles.append(Tile("箭", value))
-
-    def shuffle_tiles(self):
-        random.shuffle(self.tiles)
-
-    def deal_tiles(self):
-        # 每个玩家发13张牌
-        for _ in range(13):
-            for player in self.players:
-                player["hand"].append(self.tiles.pop())
-
-        # 给每个玩家的手牌排序
-        for player in self.players:
-            self.sort_hand(player["hand"])
-
-    def sort_hand(self, hand):
-        # 按照牌的类型和数值排序
-        def sort_key(tile):
-            suit_order = {"筒": 0, "条": 1, "万": 2, "风": 3, "箭": 4}
-
-            if tile.suit in ["风", "箭"]:
-                value_order = {"东": 1, "南": 2, "西": 3, "北": 4, "中": 1, "发": 2, "白": 3}
-                return suit_order[tile.suit], value_order.get(tile.value, 0)
-            else:
-                return suit_order[tile.suit], tile.value
-
-        hand.sort(key=sort_key)
-
-    # 检查是否可以碰牌
-    def can_pong(self, player_idx, discarded_tile):
-        hand = self.players[player_idx]["hand"]
-        count = sum(1 for tile in hand if tile.suit == discarded_tile.suit and tile.value == discarded_tile.value)
-        return count >= 2
-
-    # 检查是否可以杠牌
-    def can_kong(self, player_idx, discarded_tile=None):
-        hand = self.players[player_idx]["hand"]
-
-        # 明杠（其他玩家打出的牌）
-        if discarded_tile:
-            count = sum(1 for tile in hand if tile.suit == discarded_tile.suit and tile.value == discarded_tile.value)
-            return count >= 3
-
-        # 暗杠（自己摸到的牌）
-        counter = collections.Counter([(tile.suit, tile.value) for tile in hand])
-        return 4 in counter.values()
-
-    # 检查是否可以加杠（在碰牌基础上加一张）
-    def can_add_kong(self, player_idx, new_tile):
-        melds = self.players[player_idx]["melds"]
-        for meld in melds:
-            if meld["type"] == "pong":
-                meld_tile = meld["tiles"][0]  # 碰牌组合中的一张牌
-                if meld_tile.suit == new_tile.suit and meld_tile.value == new_tile.value:
-                    return True
-        return False
+# 把 JSON 序列化计入引擎阶段耗时（phase="jsonify"），与AI和规则检查的耗时分开
+class TimedJSONProvider(DefaultJSONProvider):
+    @metrics.timed("jsonify")
+    def response(self, *args, **kwargs):
+        return super().response(*args, **kwargs)
 
-    # 检查是否能胡牌
-    def can_win(self, player_idx, tile=None):
-        player = self.players[player_idx]
-        hand = player["hand"].copy()
 
-        # 如果指定了牌，添加到手牌中检查
-        if tile:
-            hand.append(tile)
+app.json = TimedJSONProvider(app)
 
-        # 计算手牌中每种牌的数量
-        counter = collections.Counter([(t.suit, t.value) for t in hand])
 
-        # 提取已有的碰、杠组合
-        triplets = len([m for m in player["melds"] if m["type"] in ["pong", "kong"]])
+def hand_cache_lookups():
+    values = {}
+    for kind, counts in HAND_CACHE.stats()["kinds"].items():
+        values[(kind, "hit")] = counts["hits"]
+        values[(kind, "miss")] = counts["misses"]
+    return values
 
-        # 检查是否符合胡牌条件（基本的4组+1对将）
-        return self.is_valid_hand(counter, triplets)
 
-    # 验证手牌是否符合胡牌规则
-    def is_valid_hand(self, counter, existing_triplets=0):
-        # 总共需要4组+1对将
-        # 已有的碰杠组合 + 手牌中还需要的组合数 = 4
-        remaining_sets_needed = 4 - existing_triplets
+metrics.gauge("mahjong_live_games", "Games held in memory by this process",
+              lambda: {("mahjong",): len(games), ("doudizhu",): len(doudizhu_games)}, ("game",))
+metrics.gauge("mahjong_hibernations_total", "Games hibernated to / restored from the game store",
+              lambda: {("hibernate",): games.hibernated, ("restore",): games.restored}, ("op",), kind="counter")
+metrics.gauge("mahjong_store_conflicts_total", "Writes to the shared game store rejected because another process wrote first",
+              lambda: {(): games.conflicts}, kind="counter")
+metrics.gauge("mahjong_turn_timeouts_total", "Turns played by the server after a room player timed out",
+              lambda: {(): turn_timer.fired}, kind="counter")
+metrics.gauge("mahjong_hand_cache_entries", "Entries in the shared hand evaluation cache",
+              lambda: {(): len(HAND_CACHE)})
+metrics.gauge("mahjong_hand_cache_lookups_total", "Hand evaluation cache lookups",
+              hand_cache_lookups, ("kind", "result"), kind="counter")
 
-        # 尝试找出所有可能的对子（将）
-        pairs = [key for key, count in counter.items() if count >= 2]
 
-        # 对每个可能的对子，检查剩余的牌是否能组成顺子或刻子
-        for pair in pairs:
-            # 创建一个新的计数器副本
-            temp_counter = counter.copy()
-            # 减去一个对子
-            temp_counter[pair] -= 2
+# ---- 调试接口（MAHJONG_DEBUG_TOKEN） ----
 
-            # 如果能用剩余的牌组成所需数量的顺子或刻子
-            if self.can_form_sets(temp_counter, remaining_sets_needed):
-                return True
+# 调试接口只给运维使用：请求头中带 MAHJONG_DEBUG_TOKEN 配置的口令；没有配置口令时调试接口关闭
+DEBUG_TOKEN_HEADER = "X-Mahjong-Debug-Token"
 
-        return False
-
-    # 检查是否能组成指定数量的顺子或刻子
-    def can_form_sets(self, counter, sets_needed):
-        if sets_needed == 0:
-            # 检查是否所有牌都用完了
-            return all(count == 0 for count in counter.values())
-
-        # 尝试找出刻子（三张相同的牌）
-        for key, count in list(counter.items()):
-            if count >= 3:
-                # 减去一个刻子
-                counter_copy = counter.copy()
-                counter_copy[key] -= 3
-
-                # 递归检查剩余的牌
-                if self.can_form_sets(counter_copy, sets_needed - 1):
-                    return True
-
-        # 尝试找出顺子（三张连续的牌）
-        # 注意：顺子只能在筒、条、万中形成
-        for suit in ["筒", "条", "万"]:
-            for value in range(1, 8):  # 最大是7，因为需要连续3张
-                if all((suit, value + i) in counter and counter[(suit, value + i)] > 0 for i in range(3)):
-                    # 减去一个顺子
-                    counter_copy = counter.copy()
-                    for i in range(3):
-                        counter_copy[(suit, value + i)] -= 1
-
-                    # 递归检查剩余的牌
-                    if self.can_form_sets(counter_copy, sets_needed - 1):
-                        return True
 
+def debug_authorized():
+    token = app.config["DEBUG_TOKEN"]
+    if not token:
         return False
+    return hmac.compare_digest(request.headers.get(DEBUG_TOKEN_HEADER, "").encode(), token.encode())
 
-    # 进行碰牌操作
-    def do_pong(self, player_idx):
-        # 从玩家手中移除两张相同的牌
-        hand = self.players[player_idx]["hand"]
-        matching_tiles = [tile for tile in hand
-                          if tile.suit == self.last_discarded.suit and tile.value == self.last_discarded.value]
-
-        # 移除两张牌
-        for i in range(2):
-            hand.remove(matching_tiles[i])
-
-        # 创建碰牌组合
-        pong_meld = {
-            "type": "pong",
-            "tiles": [matching_tiles[0], matching_tiles[1], self.last_discarded],
-            "from_player": self.current_player
-        }
-
-        # 添加到玩家的组合中
-        self.players[player_idx]["melds"].append(pong_meld)
-
-        # 更新游戏状态
-        self.waiting_for_action = False
-        self.current_player = player_idx
-        self.last_discarded = None
-
-        return pong_meld
-
-    # 进行明杠操作（他人打出的牌）
-    def do_kong(self, player_idx):
-        # 从玩家手中移除三张相同的牌
-        hand = self.players[player_idx]["hand"]
-        matching_tiles = [tile for tile in hand
-                          if tile.suit == self.last_discarded.suit and tile.value == self.last_discarded.value]
-
-        # 移除三张牌
-        for i in range(3):
-            hand.remove(matching_tiles[i])
-
-        # 创建杠牌组合
-        kong_meld = {
-            "type": "kong",
-            "tiles": matching_tiles + [self.last_discarded],
-            "from_player": self.current_player,
-            "is_concealed": False  # 明杠
-        }
-
-        # 添加到玩家的组合中
-        self.players[player_idx]["melds"].append(kong_meld)
-
-        # 更新游戏状态
-        self.waiting_for_action = False
-        self.current_player = player_idx
-        self.wall_count += 1
-        self.last_discarded = None
-
-        # 补牌（从牌尾摸一张）
-        self.draw_replacement_tile(player_idx)
 
-        return kong_meld
-
-    # 进行暗杠操作（自己手里的四张）
-    def do_concealed_kong(self, player_idx, tile_key):
-        hand = self.players[player_idx]["hand"]
-        suit, value = tile_key
-
-        # 找出四张相同的牌
-        matching_tiles = [tile for tile in hand
-                          if tile.suit == suit and tile.value == value]
-
-        # 确保有四张
-        if len(matching_tiles) != 4:
-            return None
-
-        # 从手牌中移除
-        for tile in matching_tiles:
-            hand.remove(tile)
+@app.before_request
+def require_debug_token():
+    if not request.path.startswith("/debug/"):
+        return None
+    if not app.config["DEBUG_TOKEN"]:
+        return jsonify({"success": False, "message": "没有开启调试接口（MAHJONG_DEBUG_TOKEN）"}), 404
+    if not debug_authorized():
+        return jsonify({"success": False, "message": "调试口令不正确"}), 403
+    return None
 
-        # 创建暗杠组合
-        kong_meld = {
-            "type": "kong",
-            "tiles": matching_tiles,
-            "from_player": None,
-            "is_concealed": True  # 暗杠
-        }
 
-        # 添加到玩家的组合中
-        self.players[player_idx]["melds"].append(kong_meld)
+# ---- 采样分析（MAHJONG_PROFILE_DIR） ----
 
-        # 补牌
-        self.wall_count += 1
-        self.draw_replacement_tile(player_idx)
+# 按比例采样的路由：麻将的游戏操作；带 PROFILE_HEADER 请求头（和调试口令）的请求不论路由都分析（推送连接除外）
+PROFILED_ENDPOINTS = {"start_game", "draw_tile", "discard_tile", "pong", "kong", "win", "pass_action", "game_state",
+                      "replay_log"}
+UNPROFILED_ENDPOINTS = {"game_events", "static"}
+PROFILE_HEADER = "X-Mahjong-Profile"
 
-        return kong_meld
+profiler = None
+if app.config["PROFILE_DIR"]:
+    profiler = profiling.RequestProfiler(app.config["PROFILE_DIR"], app.config["PROFILE_RATE"], app.config["PROFILE_KEEP"])
 
-    # 进行加杠操作
-    def do_add_kong(self, player_idx, tile_idx):
-        # 获取要加杠的牌
-        tile = self.players[player_idx]["hand"][tile_idx]
 
-        # 查找对应的碰牌组合
-        for meld in self.players[player_idx]["melds"]:
-            if (meld["type"] == "pong" and
-                    meld["tiles"][0].suit == tile.suit and
-                    meld["tiles"][0].value == tile.value):
+def start_profile():
+    if request.headers.get(PROFILE_HEADER) and debug_authorized():
+        if request.endpoint in UNPROFILED_ENDPOINTS:
+            return
+    elif request.endpoint not in PROFILED_ENDPOINTS or not profiler.sampled():
+        return
+    g.profile = profiler.start()
 
-                # 从手牌中移除这张牌
-                self.players[player_idx]["hand"].pop(tile_idx)
 
-                # 将碰牌组合升级为杠
-                meld["type"] = "kong"
-                meld["tiles"].append(tile)
-                meld["is_concealed"] = False
+def finish_profile(exc):
+    token = g.pop("profile", None)
+    if token is not None:
+        profiler.finish(token, request.endpoint, current_game_id())
 
-                # 补牌
-                self.wall_count += 1
-                self.draw_replacement_tile(player_idx)
 
-                return meld
+# 没有配置目录时不注册钩子，请求没有任何额外开销
+if profiler is not None:
+    app.before_request(start_profile)
+    app.teardown_request(finish_profile)
 
-        return None
 
-    # 补牌（杠后摸牌）
-    def draw_replacement_tile(self, player_idx):
-        if not self.tiles:
-            self.game_state = "draw"
-            return None
-
-        # 从牌尾摸一张
-        new_tile = self.tiles.pop()
-        self.players[player_idx]["hand"].append(new_tile)
-        self.sort_hand(self.players[player_idx]["hand"])
-        return new_tile
-
-    # 进行胡牌操作
-    def do_win(self, player_idx):
-        player = self.players[player_idx]
-
-        # 如果是自摸
-        if player_idx == self.current_player:
-            # 计算分数
-            score = 10  # 基础分
-            # 加上自摸额外分
-            score += 5
-            # 如果是杠上开花
-            if self.last_action == "kong":
-                score += 5
-
-            player["score"] += score
-            player["winning_hand"] = "自摸"
-
-        # 如果是点炮
-        else:
-            # 计算分数
-            score = 5  # 基础分
-            player["score"] += score
-            player["winning_hand"] = "点炮"
-
-            # 对点炮者减分
-            self.players[self.current_player]["score"] -= score
-
-        # 更新游戏状态
-        self.game_state = "win"
-        self.waiting_for_action = False
-
-        return {"winner": player_idx, "score": score}
-
-    # 检查玩家可执行的操作
-    def check_player_actions(self, player_idx):
-        actions = {}
-
-        # 如果有其他玩家打出的牌
-        if self.last_discarded and self.current_player != player_idx:
-            # 检查是否可以碰
-            if self.can_pong(player_idx, self.last_discarded):
-                actions["pong"] = True
-
-            # 检查是否可以杠
-            if self.can_kong(player_idx, self.last_discarded):
-                actions["kong"] = True
-
-            # 检查是否可以胡
-            if self.can_win(player_idx, self.last_discarded):
-                actions["win"] = True
-
-        # 如果是玩家自己的回合且刚摸到牌
-        elif self.current_player == player_idx and self.last_drawn_tile:
-            # 检查是否可以暗杠
-            if self.can_kong(player_idx):
-                # 找出可以暗杠的牌
-                hand = self.players[player_idx]["hand"]
-                counter = collections.Counter([(tile.suit, tile.value) for tile in hand])
-                kong_options = [key for key, count in counter.items() if count == 4]
-                if kong_options:
-                    actions["concealed_kong"] = kong_options
-
-            # 检查是否可以加杠
-            for i, tile in enumerate(self.players[player_idx]["hand"]):
-                if self.can_add_kong(player_idx, tile):
-                    if "add_kong" not in actions:
-                        actions["add_kong"] = []
-                    actions["add_kong"].append(i)
-
-            # 检查是否可以自摸
-            if self.can_win(player_idx):
-                actions["self_win"] = True
-
-        return actions
-
-    def draw_tile(self, player_idx):
-        if not self.tiles:
-            self.game_state = "draw"
-            return None
-
-        new_tile = self.tiles.pop()
-        self.players[player_idx]["hand"].append(new_tile)
-        self.sort_hand(self.players[player_idx]["hand"])
-        self.last_drawn_tile = new_tile
-        self.last_action = "draw"
-
-        # 检查玩家可执行的操作
-        if player_idx == 0:  # 如果是人类玩家
-            self.possible_actions = self.check_player_actions(player_idx)
-
-        return new_tile
-
-    def discard_tile(self, player_idx, tile_idx):
-        player = self.players[player_idx]
-        discarded_tile = player["hand"].pop(tile_idx)
-        player["discarded"].append(discarded_tile)
-        self.last_discarded = discarded_tile
-        self.last_drawn_tile = None
-        self.last_action = "discard"
-
-        # 重置可能的操作
-        self.possible_actions = {}
-
-        # 检查其他玩家的可能操作
-        for i, other_player in enumerate(self.players):
-            if i != player_idx:
-                actions = self.check_player_actions(i)
-                if actions:
-                    # 如果是人类玩家有操作
-                    if i == 0 and other_player["type"] == "human":
-                        self.waiting_for_action = True
-                        self.possible_actions = actions
-                    # AI玩家自动执行最优操作
-                    elif other_player["type"] == "ai":
-                        self.handle_ai_action(i, actions)
-
-        return discarded_tile
-
-    def handle_ai_action(self, ai_idx, actions):
-        # AI决策优先级：胡 > 杠 > 碰 > 摸牌出牌
-        if "win" in actions:
-            time.sleep(1)  # 模拟思考
-            self.do_win(ai_idx)
-            return True
-
-        if "kong" in actions:
-            time.sleep(1)
-            self.do_kong(ai_idx)
-            return True
-
-        if "pong" in actions:
-            # 根据策略决定是否碰牌
-            if self.ai_should_pong(ai_idx):
-                time.sleep(1)
-                self.do_pong(ai_idx)
-                # AI出牌
-                self.ai_discard(ai_idx)
-                return True
+# 当前请求对应的游戏ID：优先使用请求头，其次使用会话
+def current_game_id():
+    return request.headers.get("X-Game-Id") or session.get("game_id")
 
-        return False
 
-    def ai_should_pong(self, ai_idx):
-        # 简单策略：70%概率碰牌
-        return random.random() < 0.7
+# 当前请求在游戏中的座位：单人游戏是 0；多人房间按请求头中的邀请码（X-Seat-Token），
+# 或者创建、加入房间时保存在会话中的座位，都没有（或邀请码不对）时返回 None
+def current_seat(game):
+    if game is None or not rooms.is_room(game):
+        return 0
+    token = request.headers.get("X-Seat-Token")
+    if token is not None:
+        return rooms.token_seat(app.secret_key, current_game_id(), token)
+    if session.get("game_id") == current_game_id():
+        return session.get("seat")
+    return None
 
-    def ai_play(self, player_idx):
-        # 检查是否有可执行的动作（针对上一家打出的牌）
-        actions = self.check_player_actions(player_idx)
-        if self.handle_ai_action(player_idx, actions):
-            return
 
-        # 没有特殊操作，正常摸牌
-        drawn_tile = self.draw_tile(player_idx)
-        if not drawn_tile or self.game_state != "playing":
+# 开始新的一局前移除会话中之前的单人游戏
+# 只看会话中保存的游戏ID：请求头中的游戏ID可能是别人的；之前的房间还有其他玩家，不移除
+def remove_session_game():
+    old_game_id = session.get("game_id")
+    if not old_game_id or session.get("seat") is not None:
+        return
+    with games.locked(old_game_id) as game:
+        if game is None or rooms.is_room(game):
             return
+    games.remove(old_game_id)
 
-        time.sleep(0.8)  # 思考时间
-
-        # 再次检查摸牌后的可执行动作
-        actions = self.check_player_actions(player_idx)
 
-        # 处理自摸、暗杠等操作
-        if "self_win" in actions:
-            self.do_win(player_idx)
-            return
-
-        if "concealed_kong" in actions:
-            # 70%概率进行暗杠
-            if random.random() < 0.7:
-                self.do_concealed_kong(player_idx, actions["concealed_kong"][0])
-                # 杠后出牌
-                self.ai_discard(player_idx)
-                return
-
-        if "add_kong" in actions:
-            # 80%概率进行加杠
-            if random.random() < 0.8:
-                self.do_add_kong(player_idx, actions["add_kong"][0])
-                # 杠后出牌
-                self.ai_discard(player_idx)
-                return
-
-        # 正常出牌
-        self.ai_discard(player_idx)
-
-    def ai_discard(self, ai_idx):
-        # 改进的AI出牌策略
-        hand = self.players[ai_idx]["hand"]
-        if not hand:
-            return None
-
-        # 计算每种牌的数量
-        counter = collections.Counter([(tile.suit, tile.value) for tile in hand])
-
-        # 计算每张牌的价值
-        tile_values = {}
-        for i, tile in enumerate(hand):
-            key = (tile.suit, tile.value)
-
-            # 初始值
-            value = 0
-
-            # 成对/成组的牌更有价值
-            if counter[key] == 2 or counter[key] == 3:
-                value += 5 * counter[key]
-
-            # 连续的牌更有价值（仅适用于筒、条、万）
-            if tile.suit in ["筒", "条", "万"]:
-                # 检查相邻的牌
-                for offset in [-2, -1, 1, 2]:
-                    neighbor_key = (tile.suit, tile.value + offset)
-                    if neighbor_key in counter:
-                        # 相邻牌价值更高
-                        if abs(offset) == 1:
-                            value += 3
-                        else:
-                            value += 1
-
-            # 字牌、箭牌单独算价值
-            if tile.suit in ["风", "箭"]:
-                if counter[key] == 1:  # 单张字牌价值低
-                    value -= 2
-                else:  # 多张字牌价值高
-                    value += 3 * counter[key]
-
-            tile_values[i] = value
-
-        # 选择价值最低的牌丢弃
-        discard_idx = min(tile_values, key=tile_values.get)
-
-        return self.discard_tile(ai_idx, discard_idx)
-
-    def next_turn(self):
-        # 如果正在等待玩家操作，不进入下一回合
-        if self.waiting_for_action:
+# 游戏的时间线，没有开启时为 None；all 模式下每局游戏都记录（休眠后恢复的游戏重新开始记录）
+def game_trace(game):
+    if game is None:
+        return None
+    if game.trace is None and app.config["TRACE"] == "all":
+        game.trace = tracing.Trace(app.config["TRACE_EVENTS"])
+    return game.trace
+
+
+# 版本冲突时重新执行整个路由函数（每次都重新读取游戏），多次冲突后返回 409
+def retry_on_conflict(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        for _ in range(CONFLICT_RETRIES):
+            try:
+                return view(*args, **kwargs)
+            except VersionConflict:
+                pass
+        return jsonify({"success": False, "message": "游戏正在被其他请求修改，请稍后重试"}), 409
+    return wrapper
+
+
+# 取出当前请求的游戏并加锁，和当前请求的座位一起作为前两个参数传给路由函数
+# 开启了时间线的游戏把整个请求（包括序列化响应）记为一个阶段，附带请求前后的版本号
+# 多人房间在请求之后按新的状态设置操作时限
+def with_game(view):
+    @functools.wraps(view)
+    @retry_on_conflict
+    def wrapper(*args, **kwargs):
+        game_id = current_game_id()
+        with games.locked(game_id) as game:
+            seat = current_seat(game)
+            if seat is None:
+                return jsonify({"success": False, "message": "没有加入这个房间"}), 403
+            trace = game_trace(game)
+            try:
+                if trace is None:
+                    return view(game, seat, *args, **kwargs)
+                with tracing.recording(trace, request.endpoint, {"version": game.version}) as span_args:
+                    response = view(game, seat, *args, **kwargs)
+                    span_args["end_version"] = game.version
+                    return response
+            finally:
+                if game is not None:
+                    arm_turn_timer(game_id, game)
+    return wrapper
+
+
+# 请求体中带 async 时，操作完成后立即返回，AI的行动在后台执行并通过 /events 推送
+def wants_async():
+    body = request.get_json(silent=True) or {}
+    return bool(body.get("async"))
+
+
+# 执行人类玩家的操作；异步模式下，或者AI的行动超过了 TURN_BUDGET_MS，把剩下的回合交给后台线程
+def run_step(game, seat, action):
+    if wants_async():
+        events = game.step(seat, action, auto_advance=False)
+    else:
+        events = game.step(seat, action, time_limit=app.config["TURN_BUDGET_MS"] / 1000 or None)
+
+    if game.pending_turn:
+        ai_executor.submit(advance_game, current_game_id())
+    return events
+
+
+def advance_game(game_id):
+    for _ in range(CONFLICT_RETRIES):
+        try:
+            with games.locked(game_id) as game:
+                if game:
+                    with tracing.recording(game_trace(game), "advance_game", {"version": game.version}) as span_args:
+                        game.advance()
+                        if span_args is not None:
+                            span_args["end_version"] = game.version
+                    arm_turn_timer(game_id, game)
             return
-
-        # 如果游戏结束，不进入下一回合
-        if self.game_state != "playing":
+        except VersionConflict:
+            # 其他进程先执行了（或者玩家在其他进程中已经行动），重新读取后还有待执行的回合时再执行
+            pass
+
+
+# 多人房间：正在等待人类玩家操作时设置时限（决定是否鸣牌用 CLAIM_TIMEOUT，摸牌、出牌用 TURN_TIMEOUT）
+def arm_turn_timer(game_id, game):
+    if not rooms.is_room(game):
+        return
+    seat = game.awaited_seat
+    timeout = app.config["CLAIM_TIMEOUT"] if game.waiting_for_action else app.config["TURN_TIMEOUT"]
+    if seat is None or not timeout:
+        turn_timer.disarm(game_id)
+    else:
+        turn_timer.arm(game_id, game.version, seat, timeout)
+
+
+# 操作时限到期：游戏还停在设置时限时的状态，就替这个座位把这一步做完（摸牌后接着出牌），再让AI继续
+def play_timeout(game_id, version, seat):
+    for _ in range(CONFLICT_RETRIES):
+        try:
+            with games.locked(game_id) as game:
+                if game is None or game.version != version or game.awaited_seat != seat:
+                    return
+                while game.awaited_seat == seat:
+                    action = game.timeout_action(seat)
+                    if action is None:
+                        break
+                    game.step(seat, action, auto_advance=False)
+                game.advance()
+                arm_turn_timer(game_id, game)
             return
+        except VersionConflict:
+            pass
 
-        self.current_player = (self.current_player + 1) % 4
-
-        # 如果是AI玩家的回合
-        if self.players[self.current_player]["type"] == "ai":
-            self.ai_play(self.current_player)
-            # 如果游戏还在进行，继续到下一个玩家
-            if self.game_state == "playing" and not self.waiting_for_action:
-                self.next_turn()
+@app.route('/')
+def index():
+    # 前端按这张表把紧凑格式中的牌的编号还原成 {suit, value, id}
+    return render_template('mahjong.html', tile_table=[tile_id_to_dict(tile_id) for tile_id in range(len(TILE_IDS))])
 
-    def get_game_state(self, player_idx=0):
+@app.route('/start_game', methods=['POST'])
+def start_game():
+    remove_session_game()
+
+    # 每局游戏可以选择AI强度
+    body = request.get_json(silent=True) or {}
+    ai_strength = body.get("ai_strength") or app.config["AI_STRENGTH"]
+    if ai_strength not in AI_STRENGTHS:
+        return jsonify({"success": False, "message": f"未知的AI强度: {ai_strength}"}), 400
+    if ai_strength == "monte_carlo" and not app.config["TURN_BUDGET_MS"]:
+        return jsonify({"success": False, "message": "没有设置每个请求中AI行动的时间上限，不能使用模拟AI"}), 400
+
+    game = MahjongGame(ai_strength=ai_strength, ai_budget=app.config["AI_BUDGET_MS"] / 1000)
+    if ai_strength == "monte_carlo":
+        # 在后台启动模拟进程，进程启动前AI按普通策略出牌
+        ai_executor.submit(monte_carlo.warm_up)
+    # opt-in 模式下可以在开始时就开启时间线
+    if body.get("trace") and app.config["TRACE"] == "opt-in":
+        game.trace = tracing.Trace(app.config["TRACE_EVENTS"])
+    game_id = games.add(game)
+    session["game_id"] = game_id
+    session.pop("seat", None)
+
+    with tracing.recording(game_trace(game), "start_game"):
+        state = game.get_game_state(0, wire_format())
+        state["game_id"] = game_id
+        return jsonify(state)
+
+
+# 创建多人房间：humans 个人类座位（2-4，创建者坐 0 号位），其余座位是AI
+# 返回其他人类座位的邀请码和加入链接；没有人加入的座位轮到时超时代打
+@app.route('/rooms', methods=['POST'])
+def create_room():
+    body = request.get_json(silent=True) or {}
+    humans = body.get("humans", rooms.MAX_HUMANS)
+    if not isinstance(humans, int) or not 2 <= humans <= rooms.MAX_HUMANS:
+        return jsonify({"success": False, "message": f"人类座位数应为 2-{rooms.MAX_HUMANS}"}), 400
+    ai_strength = body.get("ai_strength") or app.config["AI_STRENGTH"]
+    if ai_strength not in AI_STRENGTHS:
+        return jsonify({"success": False, "message": f"未知的AI强度: {ai_strength}"}), 400
+    if ai_strength == "monte_carlo" and not app.config["TURN_BUDGET_MS"]:
+        return jsonify({"success": False, "message": "没有设置每个请求中AI行动的时间上限，不能使用模拟AI"}), 400
+
+    remove_session_game()
+
+    seat_types = ["human"] * humans + ["ai"] * (4 - humans)
+    game = MahjongGame(seat_types=seat_types, ai_strength=ai_strength, ai_budget=app.config["AI_BUDGET_MS"] / 1000)
+    room_id = games.add(game)
+    session["game_id"] = room_id
+    session["seat"] = 0
+    with games.locked(room_id) as game:
+        arm_turn_timer(room_id, game)
+        state = game.get_game_state(0, wire_format())
+
+    invites = []
+    for seat in range(1, humans):
+        token = rooms.seat_token(app.secret_key, room_id, seat)
+        invites.append({"seat": seat, "token": token, "url": url_for("index", room=room_id, token=token)})
+    state.update({"success": True, "game_id": room_id, "room_id": room_id,
+                  "seat_token": rooms.seat_token(app.secret_key, room_id, 0), "invites": invites})
+    return jsonify(state)
+
+
+# 凭邀请码加入房间，之后这个会话的请求都以这个座位操作
+@app.route('/rooms/<room_id>/join', methods=['POST'])
+@retry_on_conflict
+def join_room(room_id):
+    body = request.get_json(silent=True) or {}
+    seat = rooms.token_seat(app.secret_key, room_id, body.get("token", ""))
+    if seat is None:
+        return jsonify({"success": False, "message": "邀请码不正确"}), 403
+
+    with games.locked(room_id) as game:
+        if game is None or not rooms.is_room(game) or game.seat_types[seat] != "human":
+            return jsonify({"success": False, "message": "房间不存在"}), 404
+        session["game_id"] = room_id
+        session["seat"] = seat
+        state = game.get_game_state(seat, wire_format())
+    state.update({"success": True, "game_id": room_id, "room_id": room_id})
+    return jsonify(state)
+
+
+# 根据客户端上次看到的版本号（since_version）返回增量状态，没有版本号、版本不连续或要求完整状态（full）时返回完整状态
+# events 为这次请求产生的事件，返回完整状态时附带，用于前端播放动画
+def state_payload(game, events=None, player_idx=0):
+    body = request.get_json(silent=True) or {}
+    since = body.get("since_version", request.args.get("since_version", type=int))
+    full = body.get("full") or request.args.get("full")
+    wire = wire_format()
+
+    delta = None if full or since is None else game.get_state_delta(since, player_idx, wire)
+    if delta is not None:
         return {
-            "game_state": self.game_state,
-            "current_player": self.current_player,
-            "player_hand": [tile.to_dict() for tile in self.players[player_idx]["hand"]],
-            "player_discarded": [tile.to_dict() for tile in self.players[player_idx]["discarded"]],
-            "player_melds": [
-                {
-                    "type": meld["type"],
-                    "tiles": [tile.to_dict() for tile in meld["tiles"]],
-                    "from_player": meld["from_player"],
-                    "is_concealed": meld.get("is_concealed", False)
-                } for meld in self.players[player_idx]["melds"]
-            ],
-            "player_score": self.players[player_idx]["score"],
-            "player_winning_hand": self.players[player_idx]["winning_hand"],
-            "opponents": [
-                {
-                    "name": player["name"],
-                    "discarded": [tile.to_dict() for tile in player["discarded"]],
-                    "hand_count": len(player["hand"]),
-                    "melds": [
-                        {
-                            "type": meld["type"],
-                            "tiles": [tile.to_dict() for tile in meld["tiles"]],
-                            "from_player": meld["from_player"],
-                            "is_concealed": meld.get("is_concealed", False)
-                        } for meld in player["melds"]
-                    ],
-                    "score": player["score"],
-                    "winning_hand": player["winning_hand"]
-                } for i, player in enumerate(self.players) if i != player_idx
-            ],
-            "tiles_left": len(self.tiles),
-            "last_discarded": self.last_discarded.to_dict() if self.last_discarded else None,
-            "possible_actions": self.possible_actions if player_idx == 0 else {},
-            "waiting_for_action": self.waiting_for_action
+            "version": delta["version"],
+            "events": delta["events"],
+            "state_patch": delta["patch"]
         }
 
-# 初始化游戏
-game = None
+    if events and wire != "verbose":
+        # step 返回的事件是 verbose 格式，按同样的范围（最后 len(events) 个）重新生成
+        events = game.get_events(game.version - len(events), player_idx, wire)
+    return {
+        "version": game.version,
+        "events": events or [],
+        "game_state": game.get_game_state(player_idx, wire)
+    }
 
-@app.route('/')
-def index():
-    return render_template('mahjong.html')
 
-@app.route('/start_game', methods=['POST'])
-def start_game():
-    global game
-    game = MahjongGame()
-    return jsonify(game.get_game_state())
+# 组合牌（碰、杠）转换成前端使用的格式
+def meld_to_dict(meld):
+    return {
+        "type": meld["type"],
+        "tiles": WIRE_FORMATS[wire_format()][1](meld["tiles"]),
+        "is_concealed": meld.get("is_concealed", False)
+    }
+
+
+# 找到刚刚碰/杠出的组合
+def find_meld(game, player_idx, tile_id):
+    for meld in game.players[player_idx]["melds"]:
+        if meld["tiles"][0].tile_id == tile_id:
+            return meld
+    return None
 
 @app.route('/draw_tile', methods=['POST'])
-def draw_tile():
-    global game
+@with_game
+def draw_tile(game, seat):
     if not game:
         return jsonify({"success": False, "message": "游戏未开始"})
 
     if game.game_state != "playing":
-        return jsonify({"success": False, "message": "游戏已结束", "game_state": game.get_game_state()})
+        return jsonify({"success": False, "message": "游戏已结束", "game_state": game.get_game_state(seat, wire_format())})
 
-    if game.current_player != 0:
+    if game.current_player != seat:
         return jsonify({"success": False, "message": "不是你的回合"})
 
     if game.waiting_for_action:
-        return jsonify({"success": False, "message": "请先执行操作（碰、杠、胡）", "game_state": game.get_game_state()})
+        return jsonify({"success": False, "message": "请先执行操作（碰、杠、胡）", "game_state": game.get_game_state(seat, wire_format())})
 
-    tile = game.draw_tile(0)
+    if ("draw", None) not in game.legal_actions(seat):
+        return jsonify({"success": False, "message": "请先出牌"})
+
+    events = game.step(seat, ("draw", None))
+    tile = game.last_drawn_tile if game.game_state == "playing" else None
     if tile:
         return jsonify({
             "success": True,
-            "tile": tile.to_dict(),
-            "game_state": game.get_game_state(),
-            "possible_actions": game.possible_actions
+            "tile": WIRE_FORMATS[wire_format()][0](tile),
+            **state_payload(game, events, seat)
         })
     else:
-        game.game_state = "draw"
         return jsonify({
             "success": False,
             "message": "没有牌了，游戏结束平局",
-            "game_state": game.get_game_state()
+            "game_state": game.get_game_state(seat, wire_format())
         })
 
 @app.route('/discard_tile', methods=['POST'])
-def discard_tile():
-    global game
+@with_game
+def discard_tile(game, seat):
     if not game:
         return jsonify({"success": False, "message": "游戏未开始"})
 
     if game.game_state != "playing":
-        return jsonify({"success": False, "message": "游戏已结束", "game_state": game.get_game_state()})
+        return jsonify({"success": False, "message": "游戏已结束", "game_state": game.get_game_state(seat, wire_format())})
 
-    if game.current_player != 0:
+    if game.current_player != seat:
         return jsonify({"success": False, "message": "不是你的回合"})
 
-    tile_idx = int(request.json.get('tile_idx'))
-    game.discard_tile(0, tile_idx)
+    action = ("discard", int(request.json.get('tile_idx')))
+    if action not in game.legal_actions(seat):
+        return jsonify({"success": False, "message": "现在不能出这张牌"})
 
-    # 如果没有等待玩家操作，进入下一回合
-    if not game.waiting_for_action:
-        game.next_turn()
+    # 出牌后AI立即行动，直到轮到玩家或需要玩家操作
+    events = run_step(game, seat, action)
 
     return jsonify({
         "success": True,
-        "game_state": game.get_game_state(),
-        "possible_actions": game.possible_actions
+        **state_payload(game, events, seat)
     })
 
 @app.route('/pong', methods=['POST'])
-def pong():
-    global game
+@with_game
+def pong(game, seat):
     if not game or game.game_state != "playing" or not game.waiting_for_action:
         return jsonify({"success": False, "message": "无法进行碰牌操作"})
 
-    if "pong" not in game.possible_actions:
+    if ("pong", None) not in game.legal_actions(seat):
         return jsonify({"success": False, "message": "无法碰牌"})
 
-    meld = game.do_pong(0)
+    tile_id = game.last_discarded.tile_id
+    events = game.step(seat, ("pong", None))
 
     return jsonify({
         "success": True,
-        "meld": {
-            "type": meld["type"],
-            "tiles": [tile.to_dict() for tile in meld["tiles"]]
-        },
-        "game_state": game.get_game_state()
+        "meld": meld_to_dict(find_meld(game, seat, tile_id)),
+        **state_payload(game, events, seat)
     })
 
 @app.route('/kong', methods=['POST'])
-def kong():
-    global game
+@with_game
+def kong(game, seat):
     if not game or game.game_state != "playing":
         return jsonify({"success": False, "message": "无法进行杠牌操作"})
 
-    # 明杠（其他玩家打出的牌）
-    if game.waiting_for_action and "kong" in game.possible_actions:
-        meld = game.do_kong(0)
+    legal_actions = game.legal_actions(seat)
+    action = None
+    tile_id = None
 
-        return jsonify({
-            "success": True,
-            "meld": {
-                "type": meld["type"],
-                "tiles": [tile.to_dict() for tile in meld["tiles"]],
-                "is_concealed": meld["is_concealed"]
-            },
-            "game_state": game.get_game_state()
-        })
+    # 明杠（其他玩家打出的牌）
+    if ("kong", None) in legal_actions:
+        action = ("kong", None)
+        tile_id = game.last_discarded.tile_id
 
     # 暗杠（自己手里的四张）
-    if game.current_player == 0 and "concealed_kong" in game.possible_actions:
-        tile_key = request.json.get('tile_key')
+    elif request.json.get('tile_key'):
         # 将字符串键转换为元组
-        suit, value = tile_key.split(',')
+        suit, value = request.json.get('tile_key').split(',')
         if value.isdigit():
             value = int(value)
-        meld = game.do_concealed_kong(0, (suit, value))
-
-        if meld:
-            return jsonify({
-                "success": True,
-                "meld": {
-                    "type": meld["type"],
-                    "tiles": [tile.to_dict() for tile in meld["tiles"]],
-                    "is_concealed": meld["is_concealed"]
-                },
-                "game_state": game.get_game_state()
-            })
+        tile_id = TILE_IDS.get((suit, value))
+        action = ("concealed_kong", tile_id)
 
     # 加杠
-    if game.current_player == 0 and "add_kong" in game.possible_actions:
+    elif request.json.get('tile_idx') is not None:
         tile_idx = int(request.json.get('tile_idx'))
-        meld = game.do_add_kong(0, tile_idx)
+        action = ("add_kong", tile_idx)
+        if 0 <= tile_idx < len(game.players[seat]["hand"]):
+            tile_id = game.players[seat]["hand"][tile_idx].tile_id
 
-        if meld:
-            return jsonify({
-                "success": True,
-                "meld": {
-                    "type": meld["type"],
-                    "tiles": [tile.to_dict() for tile in meld["tiles"]],
-                    "is_concealed": meld["is_concealed"]
-                },
-                "game_state": game.get_game_state()
-            })
+    if action not in legal_actions:
+        return jsonify({"success": False, "message": "无法杠牌"})
+
+    events = game.step(seat, action)
 
-    return jsonify({"success": False, "message": "无法杠牌"})
+    return jsonify({
+        "success": True,
+        "meld": meld_to_dict(find_meld(game, seat, tile_id)),
+        **state_payload(game, events, seat)
+    })
 
 @app.route('/win', methods=['POST'])
-def win():
-    global game
+@with_game
+def win(game, seat):
     if not game or game.game_state != "playing":
         return jsonify({"success": False, "message": "无法胡牌"})
 
-    # 他人点炮
-    if game.waiting_for_action and "win" in game.possible_actions:
-        result = game.do_win(0)
+    legal_actions = game.legal_actions(seat)
 
-        return jsonify({
-            "success": True,
-            "result": result,
-            "game_state": game.get_game_state()
-        })
-
-    # 自摸
-    if game.current_player == 0 and "self_win" in game.possible_actions:
-        result = game.do_win(0)
-
-        return jsonify({
-            "success": True,
-            "result": result,
-            "game_state": game.get_game_state()
-        })
+    # 他人点炮 / 自摸
+    for action in [("win", None), ("self_win", None)]:
+        if action in legal_actions:
+            events = game.step(seat, action)
+            return jsonify({
+                "success": True,
+                "result": {"winner": seat, "score": events[-1]["score"]},
+                **state_payload(game, events, seat)
+            })
 
     return jsonify({"success": False, "message": "无法胡牌"})
 
 @app.route('/pass_action', methods=['POST'])
-def pass_action():
-    global game
-    if not game or game.game_state != "playing" or not game.waiting_for_action:
+@with_game
+def pass_action(game, seat):
+    if not game or game.game_state != "playing" or ("pass", None) not in game.legal_actions(seat):
         return jsonify({"success": False, "message": "无操作可跳过"})
 
-    # 重置等待状态
-    game.waiting_for_action = False
-    game.possible_actions = {}
+    # 跳过后进入下一回合
+    events = run_step(game, seat, ("pass", None))
+
+    return jsonify({
+        "success": True,
+        **state_payload(game, events, seat)
+    })
 
-    # 进入下一回合
-    game.next_turn()
+# 获取完整状态（客户端状态出错或版本不连续时使用），带 since_version 时返回增量
+@app.route('/game_state', methods=['GET', 'POST'])
+@with_game
+def game_state(game, seat):
+    if not game:
+        return jsonify({"success": False, "message": "游戏未开始"})
 
     return jsonify({
         "success": True,
-        "game_state": game.get_game_state()
+        **state_payload(game, player_idx=seat)
     })
 
+# 牌局记录（种子 + 操作记录），用于重现问题或核对计分；种子决定牌序，所以只在游戏结束后提供
+@app.route('/replay_log')
+@with_game
+def replay_log(game, seat):
+    if not game:
+        return jsonify({"success": False, "message": "游戏未开始"})
+    if game.game_state == "playing":
+        return jsonify({"success": False, "message": "游戏结束后才能导出记录"}), 403
+
+    return jsonify({"success": True, "log": replay.dump_log(game)})
+
+
+# 服务器运行状态：内存中的游戏数、休眠情况和手牌评估缓存的命中情况
+@app.route('/stats')
+def stats():
+    return jsonify({
+        "games": len(games),
+        "hibernation": games.stats(),
+        "turn_timer": {"armed": len(turn_timer), "fired": turn_timer.fired},
+        "hand_cache": HAND_CACHE.stats()
+    })
+
+
+# Prometheus 文本格式的运行指标：每个路由的请求数和耗时分布、引擎各阶段耗时、游戏数和缓存命中
+# 默认在第一次被抓取后才开始记录引擎各阶段耗时（见 MAHJONG_ENGINE_METRICS）
+@app.route('/metrics')
+def metrics_endpoint():
+    metrics.scraped()
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# 当前游戏的时间线（需要 MAHJONG_TRACE 不为 off）
+# GET 下载 Chrome trace 格式的 JSON（可用 chrome://tracing 或 Perfetto 打开）；
+# POST {"enabled": true/false} 开启或关闭（opt-in 模式），{"clear": true} 清空已记录的阶段
+# 时间线只保存在内存中，游戏休眠后清空
+@app.route('/debug/trace', methods=['GET', 'POST'])
+@retry_on_conflict
+def debug_trace():
+    if app.config["TRACE"] == "off":
+        return jsonify({"success": False, "message": "没有开启时间线（MAHJONG_TRACE）"}), 404
+
+    game_id = current_game_id()
+    with games.locked(game_id) as game:
+        if not game:
+            return jsonify({"success": False, "message": "游戏未开始"}), 404
+
+        trace = game_trace(game)
+        if request.method == "POST":
+            body = request.get_json(silent=True) or {}
+            if "enabled" in body and app.config["TRACE"] == "opt-in":
+                if not body["enabled"]:
+                    game.trace = None
+                elif trace is None:
+                    game.trace = tracing.Trace(app.config["TRACE_EVENTS"])
+            elif body.get("clear") and trace is not None:
+                trace.clear()
+            return jsonify({"success": True, "tracing": game.trace is not None,
+                            "spans": len(game.trace) if game.trace is not None else 0})
+
+        if trace is None:
+            return jsonify({"success": False, "message": "这局游戏没有开启时间线"}), 404
+        data = json.dumps(trace.to_chrome())
+
+    return Response(data, mimetype="application/json",
+                    headers={"Content-Disposition": f'attachment; filename="trace-{game_id}.json"'})
+
+
+# 最近的分析结果中耗时最长的 limit 个（需要配置 MAHJONG_PROFILE_DIR）
+@app.route('/debug/profiles')
+def debug_profiles():
+    if profiler is None:
+        return jsonify({"success": False, "message": "没有开启采样分析（MAHJONG_PROFILE_DIR）"}), 404
+
+    limit = request.args.get("limit", 20, type=int)
+    return jsonify({
+        "success": True,
+        "profiled": profiler.profiled,
+        "skipped": profiler.skipped,
+        "profiles": profiler.slowest(limit)
+    })
+
+
+# 下载一个分析结果（pstats 格式），format=text 时返回按累计耗时排序的文本统计
+@app.route('/debug/profiles/<name>')
+def debug_profile_file(name):
+    path = profiler.path(name) if profiler is not None else None
+    if path is None:
+        return jsonify({"success": False, "message": "没有这个分析结果"}), 404
+
+    if request.args.get("format") == "text":
+        return Response(profiler.summary(name, request.args.get("limit", 40, type=int)), mimetype="text/plain")
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True, download_name=name)
+
+
+# 一条 Server-Sent Events 消息，id 为版本号，断线重连时浏览器通过 Last-Event-ID 带回
+def sse_message(data, event_id=None, event=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return "\n".join(lines) + "\n\n"
+
+
+# 持续推送一局游戏的增量状态，直到游戏结束或被移除
+# 等待时释放游戏锁，空闲连接只占用一个等待中的条件变量
+# 有推送连接的游戏不会因为空闲而休眠
+def stream_game(entry, since, heartbeat, wire="verbose", seat=0):
+    with entry.lock:
+        entry.watchers += 1
+        hibernated = entry.game is None
+    try:
+        if hibernated:
+            # 连接建立前游戏刚好休眠：让客户端重新获取状态（同时恢复游戏）后再连接
+            yield sse_message({}, event="reset")
+            return
+        yield from _stream_game(entry, since, heartbeat, wire, seat)
+    finally:
+        with entry.lock:
+            entry.watchers -= 1
+
+
+def _stream_game(entry, since, heartbeat, wire, seat):
+    while True:
+        # 不能在持有锁时 yield，否则客户端读得慢会阻塞这局游戏的所有请求
+        with entry.lock:
+            if entry.game.game_state != "playing" and entry.game.version == since:
+                return
+            changed = games.wait_for_change(entry, since, heartbeat)
+            closed = entry.closed
+            delta = None
+            if changed and not closed:
+                with tracing.recording(entry.game.trace, "game_events", {"version": since}):
+                    delta = entry.game.get_state_delta(since, seat, wire)
+
+        if not changed:
+            yield ": keep-alive\n\n"
+            continue
+        if closed:
+            yield sse_message({}, event="closed")
+            return
+        if delta is None:
+            # 版本不连续，客户端需要重新获取完整状态
+            yield sse_message({}, event="reset")
+            return
+
+        since = delta["version"]
+        yield sse_message({
+            "version": delta["version"],
+            "events": delta["events"],
+            "state_patch": delta["patch"]
+        }, event_id=since)
+
+
+# 推送当前游戏的摸牌、出牌、碰杠和胡牌事件（text/event-stream）
+# 从 since_version（或重连时的 Last-Event-ID）之后开始推送；EventSource 不能设置请求头，紧凑格式用 wire=compact
+@app.route('/events')
+def game_events():
+    entry = games.get(current_game_id())
+    if entry is None:
+        return jsonify({"success": False, "message": "游戏未开始"}), 404
+
+    since = request.headers.get("Last-Event-ID", request.args.get("since_version"))
+    seat = 0
+    with entry.lock:
+        # 刚取到的游戏被休眠时 game 为 None，推送连接会让客户端重新获取状态
+        if entry.game is not None:
+            # 共享存储时内存中的游戏可能落后于客户端（上一个请求由其他进程处理）
+            if games.shared and not games.sync(entry):
+                return jsonify({"success": False, "message": "游戏未开始"}), 404
+            # 多人房间中每个座位只能看到自己的手牌和摸到的牌
+            seat = current_seat(entry.game)
+            if seat is None:
+                return jsonify({"success": False, "message": "没有加入这个房间"}), 403
+            try:
+                since = int(since)
+            except (TypeError, ValueError):
+                since = entry.game.version
+
+            # 游戏已结束且客户端已是最新：返回 204，浏览器不再自动重连
+            if entry.game.game_state != "playing" and entry.game.version == since:
+                return "", 204
+
+    return Response(stream_game(entry, since, app.config["EVENT_HEARTBEAT"], wire_format(), seat),
+                    mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ---- 斗地主 ----
+
+def current_doudizhu_id():
+    return request.headers.get("X-Game-Id") or session.get("doudizhu_game_id")
+
+
+def with_doudizhu_game(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with doudizhu_games.locked(current_doudizhu_id()) as game:
+            if not game:
+                return jsonify({"success": False, "error": "游戏未开始"}), 404
+            return view(game, *args, **kwargs)
+    return wrapper
+
+
+@app.route('/doudizhu')
+def doudizhu_index():
+    return render_template('doudizhu.html')
+
+
+@app.route('/init_game', methods=['POST'])
+def init_doudizhu():
+    # 只移除会话中自己之前的游戏，请求头中的游戏ID可能是别人的
+    old_game_id = session.get("doudizhu_game_id")
+    if old_game_id:
+        doudizhu_games.remove(old_game_id)
+
+    game = DoudizhuGame(endgame_cards=app.config["DOUDIZHU_ENDGAME_CARDS"],
+                        solver_budget=app.config["DOUDIZHU_SOLVER_MS"] / 1000)
+    game_id = doudizhu_games.add(game)
+    session["doudizhu_game_id"] = game_id
+
+    state = game.get_game_state()
+    state["success"] = True
+    state["game_id"] = game_id
+    return jsonify(state)
+
+
+# 叫地主：前端同时替AI座位叫地主，player_id 必须是当前叫地主的玩家
+@app.route('/bid_landlord', methods=['POST'])
+@with_doudizhu_game
+def bid_landlord(game):
+    body = request.get_json(silent=True) or {}
+    try:
+        landlord = game.bid(int(body.get("player_id", -1)), bool(body.get("bid")))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    if landlord is None:
+        return jsonify({"success": True, "current_player": game.current_player})
+    return jsonify({"success": True, **game.get_game_state()})
+
+
+# 出牌：card_indices 为手牌中的位置，空列表表示不出；牌型不合法或管不上时返回 400
+@app.route('/play_cards', methods=['POST'])
+@with_doudizhu_game
+def play_cards(game):
+    body = request.get_json(silent=True) or {}
+    player_idx = body.get("player_id")
+    card_indices = body.get("card_indices") or []
+    if not isinstance(player_idx, int) or not all(isinstance(i, int) for i in card_indices):
+        return jsonify({"success": False, "error": "参数错误"}), 400
+
+    try:
+        play = game.play_cards(player_idx, card_indices)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    state = game.get_game_state()
+    if play is None:
+        # 不出：前端根据 last_played 显示出牌的人，不出时不返回
+        del state["last_played"]
+    return jsonify({
+        "success": True,
+        "game_over": game.game_state == "finished",
+        **state
+    })
+
+
+# 提示：当前玩家能出的牌（手牌位置的列表，接牌时只包括能管上的牌）和AI的选择（suggestion，空列表表示不出）
+# 前端的AI回合按 suggestion 出牌，提示按钮依次选中 plays 中的出法
+@app.route('/hint', methods=['POST'])
+@with_doudizhu_game
+def doudizhu_hint(game):
+    body = request.get_json(silent=True) or {}
+    player_idx = body.get("player_id")
+    if game.game_state != "playing" or player_idx != game.current_player:
+        return jsonify({"success": False, "error": "还没轮到你出牌"}), 400
+
+    return jsonify({
+        "success": True,
+        "plays": [game.indices_for_key(player_idx, key) for _, key in game.hint_plays(player_idx)],
+        "suggestion": game.ai_choose_play(player_idx)
+    })
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True, threaded=True)
@@ -0,0 +1,352 @@
+import argparse
+import collections
+import json
+import platform
+import random
+import sys
+import time
+
+from mahjong import MahjongGame
+import doudizhu_plays
+from doudizhu import DoudizhuGame
+import hand_tables
+from hand_tables import HAND_CACHE, NUMBER_SUITS, TILE_KEYS, counter_to_counts, is_winning_counts
+
+try:
+    import hand_batch
+except ImportError:  # 没有安装 numpy 时跳过批量评估的测试
+    hand_batch = None
+
+AI_SEATS = ["ai", "ai", "ai", "ai"]
+
+
+# 随机组成一副胡牌牌型（existing_melds 组已经碰/杠出去）
+def make_winning_counter(rng, existing_melds=0, suits=None):
+    suits = suits or NUMBER_SUITS
+    while True:
+        counter = collections.Counter()
+        for _ in range(4 - existing_melds):
+            suit = rng.choice(suits)
+            if rng.random() < 0.5:
+                value = rng.randint(1, 7)
+                for i in range(3):
+                    counter[(suit, value + i)] += 1
+            else:
+                counter[(suit, rng.randint(1, 9))] += 3
+        counter[(rng.choice(suits), rng.randint(1, 9))] += 2
+        if max(counter.values()) <= 4:
+            return counter
+
+
+# 七对子形状：7个不同的对子（大多数不能按4组+1对将胡牌）
+def make_pairs_counter(rng, suits=None):
+    keys = [key for key in TILE_KEYS if not suits or key[0] in suits]
+    return collections.Counter({key: 2 for key in rng.sample(keys, 7)})
+
+
+# 一副完整的136张牌
+def all_tiles():
+    game = MahjongGame()
+    game.create_tiles()
+    return [(t.suit, t.value) for t in game.tiles]
+
+
+ALL_TILES = all_tiles()
+
+
+# 从一副完整的牌中随机抽取手牌
+def make_random_counter(rng, existing_melds=0, suits=None):
+    tiles = ALL_TILES
+    if suits:
+        tiles = [t for t in tiles if t[0] in suits]
+    return collections.Counter(rng.sample(tiles, 14 - existing_melds * 3))
+
+
+# 胡牌判定的测试手牌：普通胡牌、清一色、七对子形状和随机手牌
+def make_win_cases(seed, count):
+    rng = random.Random(seed)
+    cases = []
+    for i in range(count):
+        melds = rng.randint(0, 2)
+        kind = i % 5
+        if kind == 0:
+            cases.append((make_winning_counter(rng, melds), melds))
+        elif kind == 1:
+            # 清一色：所有牌都是同一花色，递归搜索最慢的情况
+            cases.append((make_winning_counter(rng, melds, [rng.choice(NUMBER_SUITS)]), melds))
+        elif kind == 2:
+            cases.append((make_random_counter(rng, melds, [rng.choice(NUMBER_SUITS)]), melds))
+        elif kind == 3:
+            cases.append((make_pairs_counter(rng, [rng.choice(NUMBER_SUITS)] if i % 2 else None), 0))
+        else:
+            cases.append((make_random_counter(rng, melds), melds))
+    return cases
+
+
+# 按种子生成刚摸完牌（14张）的牌局
+def make_drawn_games(seed, count):
+    games = []
+    for i in range(count):
+        game = MahjongGame(seed=seed + i, seat_types=AI_SEATS)
+        game.draw_tile(0)
+        games.append(game)
+    return games
+
+
+# 按种子随机打到牌局后期（剩余牌数不超过 tiles_left）
+def make_late_games(seed, count, tiles_left=20):
+    games = []
+    rng = random.Random(seed)
+    while len(games) < count:
+        game = MahjongGame(seed=rng.randrange(1 << 30), seat_types=["human"] * 4)
+        while game.game_state == "playing" and len(game.tiles) > tiles_left:
+            seat = next(i for i in range(4) if game.legal_actions(i))
+            game.step(seat, rng.choice(game.legal_actions(seat)))
+        if game.game_state == "playing":
+            games.append(game)
+    return games
+
+
+# 多次运行取最快的一次，返回每次操作的平均耗时
+def measure(name, func, cases, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for case in cases:
+            func(case)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "name": name,
+        "ops": len(cases),
+        "repeat": repeat,
+        "best_seconds": best,
+        "us_per_op": best * 1e6 / len(cases),
+        "ops_per_second": len(cases) / best
+    }
+
+
+def bench_win_check(seed, scale):
+    cases = make_win_cases(seed, 2000 * scale)
+
+    game = MahjongGame()
+    count_cases = [(counter_to_counts(counter), melds) for counter, melds in cases]
+    results = [
+        measure("win_check_table", lambda case: is_winning_counts(*case), count_cases, 5),
+        measure("win_check_recursive", lambda case: game.is_valid_hand(*case), cases, 1)
+    ]
+
+    # 最难的清一色手牌和七对子形状单独统计
+    flush = [case for i, case in enumerate(count_cases) if i % 5 in (1, 2)]
+    results.append(measure("win_check_table_full_flush", lambda case: is_winning_counts(*case), flush, 5))
+    pairs = [case for i, case in enumerate(count_cases) if i % 5 == 3]
+    results.append(measure("win_check_table_pairs", lambda case: is_winning_counts(*case), pairs, 5))
+    return results
+
+
+def bench_discard(seed, scale):
+    games = make_drawn_games(seed, 500 * scale)
+    return [measure("ai_choose_discard", lambda game: game.ai_choose_discard(0), games, 5)]
+
+
+def bench_shanten(seed, scale):
+    # 每手牌打出每一种牌之后的向听数，与AI选牌时的调用方式相同
+    cases = []
+    for game in make_drawn_games(seed, 500 * scale):
+        counts = game.players[0]["counts"]
+        for tile_id, count in enumerate(counts):
+            if count:
+                after = list(counts)
+                after[tile_id] -= 1
+                cases.append(after)
+
+    def clear_caches():
+        HAND_CACHE.clear()
+        for func in (hand_tables._suit_blocks, hand_tables._suit_blocks_with_pair,
+                     hand_tables._suit_frontiers, hand_tables._combine):
+            func.cache_clear()
+
+    # 不使用整手牌的缓存，只保留每个花色的拆法缓存
+    def cold(case):
+        hand_tables._shanten(case, 0)
+
+    clear_caches()
+    results = [measure("shanten_per_discard_cold", cold, cases, 1)]
+    results.append(measure("shanten_per_discard_warm", hand_tables.shanten, cases, 5))
+    return results
+
+
+# 每局玩家0"打一张、摸一张"的所有组合（与单手牌评估的一致性见 tests/test_hand_tables.py）
+def make_batch_cases(seed, count):
+    cases = []
+    for game in make_drawn_games(seed, count):
+        pairs, counts = hand_batch.discard_draw_counts(game.players[0]["counts"])
+        cases.append((game, pairs, counts))
+    return cases
+
+
+def bench_batch(seed, scale):
+    if hand_batch is None:
+        print("batch: 需要 numpy，跳过")
+        return []
+
+    cases = make_batch_cases(seed, 20 * scale)
+    hands = [(list(row), 0) for _, _, counts in cases for row in counts]
+
+    # 按手牌数计算平均耗时，与逐手牌调用比较
+    def per_hand(result):
+        total = sum(len(counts) for _, _, counts in cases)
+        result["ops"] = total
+        result["us_per_op"] = result["best_seconds"] * 1e6 / total
+        result["ops_per_second"] = total / result["best_seconds"]
+        return result
+
+    def batch(case):
+        hand_batch.batch_evaluate(case[2])
+
+    def scalar(case):
+        is_winning_counts(*case)
+        hand_tables._shanten(*case)
+
+    return [
+        per_hand(measure("batch_evaluate_per_hand", batch, cases, 5)),
+        measure("scalar_evaluate_per_hand", scalar, hands, 1)
+    ]
+
+
+def bench_claim_check(seed, scale):
+    games = make_drawn_games(seed, 500 * scale)
+    for game in games:
+        game.last_discarded = game.last_drawn_tile
+        game.last_drawn_tile = None
+
+    # 一张弃牌打出后，检查其他三家能否碰、杠、胡
+    def check(game):
+        for i in (1, 2, 3):
+            game.check_player_actions(i)
+
+    return [measure("claim_check_after_discard", check, games, 5)]
+
+
+def bench_serialization(seed, scale):
+    games = make_late_games(seed, 100 * scale)
+    return [
+        measure("get_game_state", lambda game: game.get_game_state(0), games, 5),
+        measure("get_game_state_json", lambda game: json.dumps(game.get_game_state(0)), games, 5)
+    ]
+
+
+def bench_full_games(seed, scale):
+    game = MahjongGame(seat_types=AI_SEATS)
+    seeds = list(range(seed, seed + 200 * scale))
+    HAND_CACHE.clear()
+    result = measure("ai_full_game", game.reset, seeds, 3)
+    # 第一轮之后同样的牌局全部命中缓存，命中率只作参考
+    result["hand_cache"] = HAND_CACHE.stats()
+    return [result]
+
+
+# 斗地主手牌：随机的17张和20张（地主），加上出法最多的几种手牌（很多对子加炸弹、连续的三张带单牌）
+DOUDIZHU_WORST_HANDS = [
+    [4, 4, 2, 2, 2, 2, 2, 2, 0, 0, 0, 0, 0, 0, 0],
+    [3, 3, 3, 3, 0, 1, 1, 1, 1, 1, 1, 0, 0, 1, 1],
+    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 0, 0, 0, 0, 0],
+    [4, 0, 4, 0, 4, 0, 2, 2, 2, 0, 0, 0, 0, 1, 1],
+]
+
+
+def make_doudizhu_hands(seed, count):
+    rng = random.Random(seed)
+    deck = [rank for rank in range(doudizhu_plays.SMALL_JOKER) for _ in range(4)]
+    deck += [doudizhu_plays.SMALL_JOKER, doudizhu_plays.BIG_JOKER]
+    hands = []
+    for i in range(count):
+        counts = [0] * doudizhu_plays.RANK_COUNT
+        for rank in rng.sample(deck, 20 if i % 3 == 0 else 17):
+            counts[rank] += 1
+        hands.append(counts)
+    return hands
+
+
+def bench_doudizhu(seed, scale):
+    hands = make_doudizhu_hands(seed, 300 * scale)
+
+    plays = [key for counts in hands[:50] for _, key in doudizhu_plays.generate_plays(counts)]
+    prevs = [doudizhu_plays.classify_key(key) for key in plays[::37]]
+    hand_keys = [doudizhu_plays.encode_counts(counts) for counts in hands]
+
+    def beating(hand_key):
+        for prev in prevs[:20]:
+            doudizhu_plays.legal_plays(hand_key, prev)
+
+    games = []
+    for i in range(200 * scale):
+        game = DoudizhuGame(seed=seed + i)
+        game.bid(0, True)
+        games.append(game)
+
+    results = [
+        measure("ddz_classify", doudizhu_plays.classify_key, plays, 5),
+        measure("ddz_generate_plays", doudizhu_plays.generate_plays, hands, 3),
+        measure("ddz_generate_worst_case", doudizhu_plays.generate_plays, DOUDIZHU_WORST_HANDS * 25, 3),
+    ]
+    doudizhu_plays.play_index.cache_clear()
+    results.append(measure("ddz_play_index_cold", doudizhu_plays.play_index, hand_keys, 1))
+    results.append(measure("ddz_beating_20_plays_warm", beating, hand_keys, 3))
+    results.append(measure("ddz_ai_choose_play", lambda game: game.ai_choose_play(game.current_player), games, 3))
+    return results
+
+
+BENCHMARKS = collections.OrderedDict([
+    ("win_check", bench_win_check),
+    ("discard", bench_discard),
+    ("shanten", bench_shanten),
+    ("batch", bench_batch),
+    ("claim_check", bench_claim_check),
+    ("serialization", bench_serialization),
+    ("full_games", bench_full_games),
+    ("doudizhu", bench_doudizhu),
+])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="麻将热点路径基准测试")
+    parser.add_argument("--seed", type=int, default=2024, help="生成手牌和牌墙的随机种子")
+    parser.add_argument("--scale", type=int, default=1, help="测试规模倍数")
+    parser.add_argument("--only", action="append", choices=list(BENCHMARKS), help="只运行指定的测试")
+    parser.add_argument("--output", help="把结果写入JSON文件，便于比较不同版本")
+    parser.add_argument("--compare", help="与之前保存的JSON结果对比")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = {result["name"]: result for result in json.load(f)["results"]}
+
+    results = []
+    for name, bench in BENCHMARKS.items():
+        if args.only and name not in args.only:
+            continue
+        for result in bench(args.seed, args.scale):
+            line = f"{result['name']:<30} {result['us_per_op']:10.2f} us/op {result['ops_per_second']:12.0f} ops/s"
+            if result["name"] in baseline:
+                # 大于1表示比基线快
+                line += f" {baseline[result['name']]['us_per_op'] / result['us_per_op']:8.2f}x"
+            print(line)
+            results.append(result)
+
+    if args.output:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "scale": args.scale,
+            "results": results
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
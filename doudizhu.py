@@ -0,0 +1,292 @@
+import random
+
+from doudizhu_plays import (RANK_COUNT, RANK_NAMES, TWO, SMALL_JOKER, BIG_JOKER, BOMB, ROCKET, TRIPLE, PAIR, SINGLE,
+                            beats, classify, decode_key, encode_counts, encode_ranks, legal_plays, play_name)
+from doudizhu_solver import DEFAULT_NODE_LIMIT, DEFAULT_TIME_LIMIT, NO_PLAYER, EndgameSolver, SearchAborted
+from mahjong import new_seed
+
+SUITS = ("♠", "♥", "♣", "♦")
+
+# 三家剩下的牌加起来不超过这个数时，AI用残局求解找必胜的出法
+ENDGAME_CARDS = 20
+
+
+# 扑克牌定义
+class Card:
+    __slots__ = ("suit", "value", "rank", "card_id")
+
+    def __init__(self, card_id):
+        self.card_id = card_id  # 整数编号 0-53，也是排序顺序：点数 * 4 + 花色，小王 52，大王 53
+        if card_id >= 52:
+            self.rank = SMALL_JOKER if card_id == 52 else BIG_JOKER
+            self.suit = "Small" if card_id == 52 else "Big"
+            self.value = "Joker"
+        else:
+            self.rank = card_id // 4  # 点数 0-12（3 到 2）
+            self.suit = SUITS[card_id % 4]
+            self.value = RANK_NAMES[self.rank]
+
+    def __str__(self):
+        return RANK_NAMES[self.rank] if self.value == "Joker" else f"{self.suit}{self.value}"
+
+    def to_dict(self):
+        return {
+            'suit': self.suit,
+            'value': self.value,
+            'id': self.card_id
+        }
+
+
+def card_sort_key(card):
+    return card.card_id
+
+
+# 斗地主游戏类（不依赖Flask）：三个玩家，每人17张，3张底牌归地主
+class DoudizhuGame:
+    def __init__(self, seed=None, seat_types=None, endgame_cards=ENDGAME_CARDS,
+                 solver_budget=DEFAULT_TIME_LIMIT, solver_nodes=DEFAULT_NODE_LIMIT):
+        self.seed = new_seed() if seed is None else seed  # 随机种子，决定牌序
+        self.rng = random.Random(self.seed)
+        self.seat_types = list(seat_types or ["human", "ai", "ai"])
+        self.endgame_cards = endgame_cards  # 残局求解的张数上限，0 表示不求解
+        self.solver_budget = solver_budget  # 每次求解的时间上限（秒）
+        self.solver_nodes = solver_nodes  # 每次求解的节点数上限
+        self.solver = None  # 残局求解器，地主确定后创建，置换表在这局游戏中一直复用
+        self.players = []
+        self.landlord_cards = []  # 底牌
+        self.landlord = None  # 地主的座位
+        self.current_player = 0
+        self.game_state = "waiting"  # waiting / bidding / playing / finished
+        self.bids = []  # 叫地主记录 [(座位, 是否叫), ...]
+        self.last_play = None  # 这一轮要管的牌：{"player", "play", "cards"}，None 表示还没有人出牌
+        self.history = []  # 出牌记录 [(座位, 牌型或 None 表示不出, 牌), ...]
+        self.winner = None
+        self.initialize_game()
+
+    def initialize_game(self):
+        deck = [Card(card_id) for card_id in range(54)]
+        self.rng.shuffle(deck)
+
+        self.players = [
+            {
+                "name": f"玩家{i + 1}",
+                "type": self.seat_types[i],
+                "hand": [],
+                "counts": [0] * RANK_COUNT,  # 手牌中每个点数的张数
+                "role": None  # landlord / farmer
+            }
+            for i in range(3)
+        ]
+        for i, player in enumerate(self.players):
+            self.give_cards(i, deck[i * 17:(i + 1) * 17])
+        self.landlord_cards = deck[51:]
+
+        self.landlord = None
+        self.current_player = 0  # 从玩家1开始叫地主
+        self.game_state = "bidding"
+        self.bids = []
+        self.last_play = None
+        self.history = []
+        self.winner = None
+
+    def give_cards(self, player_idx, cards):
+        player = self.players[player_idx]
+        player["hand"].extend(cards)
+        player["hand"].sort(key=card_sort_key)
+        for card in cards:
+            player["counts"][card.rank] += 1
+
+    # 叫地主：第一个叫的玩家成为地主，三家都不叫时由第一个玩家当地主；返回地主的座位，还没确定时返回 None
+    def bid(self, player_idx, bid):
+        if self.game_state != "bidding":
+            raise ValueError("现在不是叫地主阶段")
+        if player_idx != self.current_player:
+            raise ValueError("还没轮到你叫地主")
+
+        self.bids.append((player_idx, bool(bid)))
+        if bid:
+            self.set_landlord(player_idx)
+        elif len(self.bids) == len(self.players):
+            self.set_landlord(self.bids[0][0])
+        else:
+            self.current_player = (player_idx + 1) % len(self.players)
+        return self.landlord
+
+    def set_landlord(self, player_idx):
+        self.landlord = player_idx
+        self.give_cards(player_idx, self.landlord_cards)
+        for i, player in enumerate(self.players):
+            player["role"] = "landlord" if i == player_idx else "farmer"
+        self.current_player = player_idx
+        self.game_state = "playing"
+        self.solver = EndgameSolver(player_idx, self.solver_nodes, self.solver_budget)
+
+    # 当前玩家是否自由出牌（新的一轮，不能不出）
+    def is_leading(self, player_idx=None):
+        player_idx = self.current_player if player_idx is None else player_idx
+        return self.last_play is None or self.last_play["player"] == player_idx
+
+    # 出牌，card_indices 为手牌中的位置，空列表表示不出；不合法时抛出 ValueError
+    # 返回出牌的牌型 (牌型, 主牌点数, 组数)，不出时返回 None
+    def play_cards(self, player_idx, card_indices):
+        if self.game_state != "playing":
+            raise ValueError("现在不是出牌阶段")
+        if player_idx != self.current_player:
+            raise ValueError("还没轮到你出牌")
+
+        hand = self.players[player_idx]["hand"]
+        leading = self.is_leading(player_idx)
+
+        if not card_indices:
+            if leading:
+                raise ValueError("新的一轮必须出牌")
+            self.history.append((player_idx, None, []))
+            self.current_player = (player_idx + 1) % len(self.players)
+            return None
+
+        indices = sorted(set(card_indices))
+        if len(indices) != len(card_indices) or indices[0] < 0 or indices[-1] >= len(hand):
+            raise ValueError("选择的牌不在手牌中")
+
+        cards = [hand[i] for i in indices]
+        play = classify(card.rank for card in cards)
+        if play is None:
+            raise ValueError("不是合法的牌型")
+        if not leading and not beats(play, self.last_play["play"]):
+            raise ValueError(f"{play_name(play)}管不上上家的{play_name(self.last_play['play'])}")
+
+        self.remove_cards(player_idx, indices)
+        self.last_play = {"player": player_idx, "play": play, "cards": cards}
+        self.history.append((player_idx, play, cards))
+
+        if not hand:
+            self.winner = player_idx
+            self.game_state = "finished"
+        else:
+            self.current_player = (player_idx + 1) % len(self.players)
+        return play
+
+    def remove_cards(self, player_idx, indices):
+        player = self.players[player_idx]
+        for i in reversed(indices):
+            card = player["hand"].pop(i)
+            player["counts"][card.rank] -= 1
+
+    def hand_key(self, player_idx):
+        return encode_counts(self.players[player_idx]["counts"])
+
+    # 一组牌（张数编码）在手牌中的位置：每个点数取最前面的几张
+    def indices_for_key(self, player_idx, key):
+        need = decode_key(key)
+        indices = []
+        for i, card in enumerate(self.players[player_idx]["hand"]):
+            if need[card.rank]:
+                need[card.rank] -= 1
+                indices.append(i)
+        return indices
+
+    # 能出的牌 [(牌型, 编码), ...]：接牌时为能管上的牌（同牌型从小到大，然后是炸弹、王炸），
+    # 新的一轮时为所有出法，按主牌点数从小到大、张数从多到少排列
+    def hint_plays(self, player_idx):
+        if self.is_leading(player_idx):
+            return sorted(legal_plays(self.hand_key(player_idx)), key=lambda item: (item[0][1], -play_size(item[1])))
+        return legal_plays(self.hand_key(player_idx), self.last_play["play"])
+
+    def is_teammate(self, a, b):
+        return a != self.landlord and b != self.landlord
+
+    # AI出牌，返回手牌位置，空列表表示不出
+    # 能一次出完就出完；自由出牌时出主牌点数最小、张数最多的牌；接牌时用最小的同牌型管上，
+    # 不管队友的牌，对手剩的牌不多时才用炸弹；尽量不拆炸弹，不用2和王做带牌
+    def ai_choose_play(self, player_idx):
+        counts = self.players[player_idx]["counts"]
+        hand_key = encode_counts(counts)
+        candidates = self.hint_plays(player_idx)
+        if not candidates:
+            return []
+
+        for play, key in candidates:
+            if key == hand_key:
+                return self.indices_for_key(player_idx, key)
+
+        move = self.endgame_move(player_idx)
+        if move is not None:
+            return self.indices_for_key(player_idx, move)
+
+        others = [item for item in candidates if item[0][0] not in (BOMB, ROCKET)]
+        normal = [item for item in others if not wastes_cards(counts, *item)]
+
+        if self.is_leading(player_idx):
+            play, key = (normal or others or candidates)[0]
+            return self.indices_for_key(player_idx, key)
+
+        last = self.last_play["player"]
+        if self.is_teammate(player_idx, last):
+            return []
+        if normal:
+            return self.indices_for_key(player_idx, normal[0][1])
+        if len(self.players[last]["hand"]) <= 4:
+            return self.indices_for_key(player_idx, (others or candidates)[0][1])
+        return []
+
+    # 残局时用求解器找必胜的出法：返回出的牌的编码，0 表示不出；不是残局、没有必胜的出法或超过搜索上限时返回 None
+    def endgame_move(self, player_idx):
+        if self.solver is None or sum(len(player["hand"]) for player in self.players) > self.endgame_cards:
+            return None
+
+        hands = [self.hand_key(i) for i in range(len(self.players))]
+        if self.is_leading(player_idx):
+            last_player, last_key = NO_PLAYER, 0
+        else:
+            last_player = self.last_play["player"]
+            last_key = encode_ranks(card.rank for card in self.last_play["cards"])
+        try:
+            return self.solver.best_move(hands, player_idx, last_player, last_key)
+        except SearchAborted:
+            return None
+
+    # 获胜的一方：地主或农民
+    def winning_side(self):
+        if self.winner is None:
+            return None
+        return "地主" if self.winner == self.landlord else "农民"
+
+    # 各家手牌：viewer 只能看到自己的牌，其他人的牌只给出张数（空字典占位）；游戏结束后全部公开
+    def get_player_hands(self, viewer=0):
+        return [
+            [card.to_dict() for card in player["hand"]]
+            if i == viewer or self.game_state == "finished"
+            else [{} for _ in player["hand"]]
+            for i, player in enumerate(self.players)
+        ]
+
+    def get_game_state(self, viewer=0):
+        return {
+            "game_state": self.game_state,
+            "current_player": self.current_player,
+            "landlord": self.landlord,
+            "player_hands": self.get_player_hands(viewer),
+            # 底牌在地主确定后公开
+            "landlord_cards": [card.to_dict() for card in self.landlord_cards] if self.landlord is not None else [],
+            "last_player": self.last_play["player"] if self.last_play else None,
+            "last_played": [card.to_dict() for card in self.last_play["cards"]] if self.last_play else [],
+            "last_play_type": play_name(self.last_play["play"]) if self.last_play else None,
+            "winner": self.winning_side()
+        }
+
+
+def play_size(key):
+    return sum(decode_key(key))
+
+
+# 出这组牌是否浪费：拆开炸弹，或者用2和王做带牌
+def wastes_cards(counts, play, key):
+    kind, main_rank, _ = play
+    for rank, count in enumerate(decode_key(key)):
+        if not count:
+            continue
+        if counts[rank] == 4 and count < 4:
+            return True
+        if rank >= TWO and rank != main_rank and kind not in (SINGLE, PAIR, TRIPLE, ROCKET):
+            return True
+    return False
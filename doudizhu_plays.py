@@ -0,0 +1,273 @@
+import bisect
+import functools
+import itertools
+
+# 斗地主牌型：一手牌表示成15个点数的张数（3 4 5 6 7 8 9 10 J Q K A 2 小王 大王）
+# 每个点数的张数占3位，整手牌编码成一个整数；预先生成所有合法牌型的编码表，判断牌型只需查一次表
+
+RANK_NAMES = ("3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K", "A", "2", "小王", "大王")
+RANK_COUNT = len(RANK_NAMES)
+TWO = 12
+SMALL_JOKER = 13
+BIG_JOKER = 14
+CHAIN_END = TWO  # 顺子、连对、飞机只能用 3 到 A
+
+RANK_BITS = 3
+
+# 牌型
+SINGLE = "single"
+PAIR = "pair"
+TRIPLE = "triple"
+TRIPLE_SINGLE = "triple_single"
+TRIPLE_PAIR = "triple_pair"
+STRAIGHT = "straight"
+PAIR_STRAIGHT = "pair_straight"
+AIRPLANE = "airplane"
+AIRPLANE_SINGLE = "airplane_single"
+AIRPLANE_PAIR = "airplane_pair"
+FOUR_TWO_SINGLE = "four_two_single"
+FOUR_TWO_PAIR = "four_two_pair"
+BOMB = "bomb"
+ROCKET = "rocket"
+
+PLAY_NAMES = {
+    SINGLE: "单张",
+    PAIR: "对子",
+    TRIPLE: "三张",
+    TRIPLE_SINGLE: "三带一",
+    TRIPLE_PAIR: "三带一对",
+    STRAIGHT: "顺子",
+    PAIR_STRAIGHT: "连对",
+    AIRPLANE: "飞机",
+    AIRPLANE_SINGLE: "飞机带单张",
+    AIRPLANE_PAIR: "飞机带对子",
+    FOUR_TWO_SINGLE: "四带二",
+    FOUR_TWO_PAIR: "四带两对",
+    BOMB: "炸弹",
+    ROCKET: "王炸"
+}
+
+# 顺子类牌型每组的张数和最少组数
+CHAIN_RULES = {STRAIGHT: (1, 5), PAIR_STRAIGHT: (2, 3), AIRPLANE: (3, 2)}
+MAX_PLAY_SIZE = 20
+
+
+def encode_counts(counts):
+    key = 0
+    for rank, count in enumerate(counts):
+        key |= count << (RANK_BITS * rank)
+    return key
+
+
+# 一组牌（点数列表）的编码：每张牌加 1 << 3*点数，每个点数最多4张，不会进位
+def encode_ranks(ranks):
+    key = 0
+    for rank in ranks:
+        key += 1 << (RANK_BITS * rank)
+    return key
+
+
+def decode_key(key):
+    return [(key >> (RANK_BITS * rank)) & 7 for rank in range(RANK_COUNT)]
+
+
+# 生成所有合法牌型，返回 {编码: (牌型, 主牌点数, 组数)}
+# 主牌点数：顺子类为最小的点数，带牌的牌型为三张/四张的点数；组数：顺子类的长度，其他牌型为1
+def _build_play_table():
+    table = {}
+
+    def add(parts, play):
+        key = 0
+        for rank, count in parts:
+            key += count << (RANK_BITS * rank)
+        # 同一组牌只有一种解释（生成时带的牌不与主牌同点数，不会重复）
+        table.setdefault(key, play)
+
+    for rank in range(RANK_COUNT):
+        add([(rank, 1)], (SINGLE, rank, 1))
+    for rank in range(SMALL_JOKER):
+        add([(rank, 2)], (PAIR, rank, 1))
+        add([(rank, 3)], (TRIPLE, rank, 1))
+        add([(rank, 4)], (BOMB, rank, 1))
+    add([(SMALL_JOKER, 1), (BIG_JOKER, 1)], (ROCKET, SMALL_JOKER, 1))
+
+    # 三带一、三带一对
+    for rank in range(SMALL_JOKER):
+        for kicker in range(RANK_COUNT):
+            if kicker != rank:
+                add([(rank, 3), (kicker, 1)], (TRIPLE_SINGLE, rank, 1))
+                if kicker < SMALL_JOKER:
+                    add([(rank, 3), (kicker, 2)], (TRIPLE_PAIR, rank, 1))
+
+    # 四带二（两张单牌，可以是同点数的一对）、四带两对
+    for rank in range(SMALL_JOKER):
+        others = [r for r in range(RANK_COUNT) if r != rank]
+        for a, b in itertools.combinations_with_replacement(others, 2):
+            if a == b and a >= SMALL_JOKER:
+                continue
+            if (a, b) == (SMALL_JOKER, BIG_JOKER):
+                continue
+            add([(rank, 4), (a, 1), (b, 1)] if a != b else [(rank, 4), (a, 2)], (FOUR_TWO_SINGLE, rank, 1))
+        for a, b in itertools.combinations([r for r in others if r < SMALL_JOKER], 2):
+            add([(rank, 4), (a, 2), (b, 2)], (FOUR_TWO_PAIR, rank, 1))
+
+    # 顺子、连对、飞机
+    for kind, (width, min_length) in CHAIN_RULES.items():
+        for length in range(min_length, CHAIN_END + 1):
+            if width * length > MAX_PLAY_SIZE:
+                break
+            for start in range(CHAIN_END - length + 1):
+                add([(rank, width) for rank in range(start, start + length)], (kind, start, length))
+
+    # 飞机带翅膀：每组三张带一张单牌（点数各不相同，不能同时带两个王）或一对
+    for length in range(2, CHAIN_END + 1):
+        for start in range(CHAIN_END - length + 1):
+            chain = [(rank, 3) for rank in range(start, start + length)]
+            others = [r for r in range(RANK_COUNT) if not start <= r < start + length]
+            if 4 * length <= MAX_PLAY_SIZE:
+                for kickers in itertools.combinations(others, length):
+                    if SMALL_JOKER in kickers and BIG_JOKER in kickers:
+                        continue
+                    add(chain + [(r, 1) for r in kickers], (AIRPLANE_SINGLE, start, length))
+            if 5 * length <= MAX_PLAY_SIZE:
+                for kickers in itertools.combinations([r for r in others if r < SMALL_JOKER], length):
+                    add(chain + [(r, 2) for r in kickers], (AIRPLANE_PAIR, start, length))
+
+    return table
+
+
+PLAY_TABLE = _build_play_table()
+
+
+# 判断牌型，不合法时返回 None
+def classify_key(key):
+    return PLAY_TABLE.get(key)
+
+
+def classify(ranks):
+    return PLAY_TABLE.get(encode_ranks(ranks))
+
+
+# play 能否管上 prev（prev 为 None 表示自由出牌）
+def beats(play, prev):
+    if prev is None:
+        return True
+    kind, rank, length = play
+    prev_kind = prev[0]
+    if kind == ROCKET:
+        return True
+    if prev_kind == ROCKET:
+        return False
+    if kind == BOMB:
+        return prev_kind != BOMB or rank > prev[1]
+    return kind == prev_kind and length == prev[2] and rank > prev[1]
+
+
+def play_name(play):
+    return PLAY_NAMES[play[0]]
+
+
+# ---- 出牌生成 ----
+# 从一手牌的张数直接生成所有合法出法（与编码表的规则一致），返回 [(牌型, 编码), ...]
+# 编码为出的这组牌的张数编码，可以用 decode_key 还原
+
+def _chains(counts, width, min_length):
+    for start in range(CHAIN_END):
+        length = 0
+        while start + length < CHAIN_END and counts[start + length] >= width and width * (length + 1) <= MAX_PLAY_SIZE:
+            length += 1
+            if length >= min_length:
+                yield start, length
+
+
+def generate_plays(counts):
+    plays = []
+
+    def add(parts, play):
+        key = 0
+        for rank, count in parts:
+            key += count << (RANK_BITS * rank)
+        plays.append((play, key))
+
+    singles = [r for r in range(RANK_COUNT) if counts[r]]
+    pairs = [r for r in range(SMALL_JOKER) if counts[r] >= 2]
+
+    for rank in singles:
+        add([(rank, 1)], (SINGLE, rank, 1))
+    for rank in pairs:
+        add([(rank, 2)], (PAIR, rank, 1))
+        if counts[rank] < 3:
+            continue
+        add([(rank, 3)], (TRIPLE, rank, 1))
+        for kicker in singles:
+            if kicker != rank:
+                add([(rank, 3), (kicker, 1)], (TRIPLE_SINGLE, rank, 1))
+        for kicker in pairs:
+            if kicker != rank:
+                add([(rank, 3), (kicker, 2)], (TRIPLE_PAIR, rank, 1))
+        if counts[rank] < 4:
+            continue
+        add([(rank, 4)], (BOMB, rank, 1))
+        others = [r for r in singles if r != rank]
+        for a, b in itertools.combinations_with_replacement(others, 2):
+            if a == b:
+                if counts[a] >= 2 and a < SMALL_JOKER:
+                    add([(rank, 4), (a, 2)], (FOUR_TWO_SINGLE, rank, 1))
+            elif (a, b) != (SMALL_JOKER, BIG_JOKER):
+                add([(rank, 4), (a, 1), (b, 1)], (FOUR_TWO_SINGLE, rank, 1))
+        for a, b in itertools.combinations([r for r in pairs if r != rank], 2):
+            add([(rank, 4), (a, 2), (b, 2)], (FOUR_TWO_PAIR, rank, 1))
+    if counts[SMALL_JOKER] and counts[BIG_JOKER]:
+        add([(SMALL_JOKER, 1), (BIG_JOKER, 1)], (ROCKET, SMALL_JOKER, 1))
+
+    for kind, (width, min_length) in CHAIN_RULES.items():
+        for start, length in _chains(counts, width, min_length):
+            add([(rank, width) for rank in range(start, start + length)], (kind, start, length))
+
+    for start, length in _chains(counts, 3, 2):
+        chain = [(rank, 3) for rank in range(start, start + length)]
+        if 4 * length <= MAX_PLAY_SIZE:
+            others = [r for r in singles if not start <= r < start + length]
+            for kickers in itertools.combinations(others, length):
+                if SMALL_JOKER in kickers and BIG_JOKER in kickers:
+                    continue
+                add(chain + [(r, 1) for r in kickers], (AIRPLANE_SINGLE, start, length))
+        if 5 * length <= MAX_PLAY_SIZE:
+            others = [r for r in pairs if not start <= r < start + length]
+            for kickers in itertools.combinations(others, length):
+                add(chain + [(r, 2) for r in kickers], (AIRPLANE_PAIR, start, length))
+
+    return plays
+
+
+# 一手牌的出法索引：{(牌型, 组数): (主牌点数列表, [(牌型, 编码), ...])}，每组按主牌点数从小到大排列
+# 按整手牌的编码缓存，同一手牌只生成一次（AI每一步和提示按钮都会用到）
+@functools.lru_cache(maxsize=4096)
+def play_index(hand_key):
+    groups = {}
+    for play, key in generate_plays(decode_key(hand_key)):
+        groups.setdefault((play[0], play[2]), []).append((play, key))
+
+    index = {}
+    for group, plays in groups.items():
+        plays.sort(key=lambda item: (item[0][1], item[1]))
+        index[group] = ([play[1] for play, _ in plays], plays)
+    return index
+
+
+# 能管上 prev 的所有出法（prev 为 None 时为所有出法）：先是同牌型从小到大，然后是炸弹从小到大，最后是王炸
+def legal_plays(hand_key, prev=None):
+    index = play_index(hand_key)
+    if prev is None:
+        return [item for _, plays in index.values() for item in plays]
+
+    kind, rank, length = prev
+    result = []
+    if kind not in (BOMB, ROCKET):
+        ranks, plays = index.get((kind, length), ((), ()))
+        result.extend(plays[bisect.bisect_right(ranks, rank):])
+    if kind != ROCKET:
+        ranks, plays = index.get((BOMB, 1), ((), ()))
+        result.extend(plays[bisect.bisect_right(ranks, rank):] if kind == BOMB else plays)
+        result.extend(index.get((ROCKET, 1), ((), ()))[1])
+    return result
@@ -0,0 +1,106 @@
+import time
+
+from doudizhu_plays import RANK_BITS, RANK_COUNT, classify_key, decode_key, legal_plays
+
+# 斗地主残局求解：三家剩下的牌加起来不多时，按明牌（服务器知道所有人的牌）搜索到终局
+# 结果只有"地主赢"和"农民赢"两种，用 alpha-beta 剪枝的极小化极大搜索：地主找一步能赢的出法，农民找一步能让地主输的出法，
+# 找到就不再搜索其他出法。搜索过的局面存入置换表，同一局游戏之后的每一步都可以复用
+
+HAND_BITS = RANK_BITS * RANK_COUNT  # 一手牌编码的位数
+NO_PLAYER = 3  # 自由出牌时没有"上家出的牌"
+
+# 默认的搜索上限：节点数和时间（秒），超过后放弃，由调用方改用普通策略
+DEFAULT_NODE_LIMIT = 200000
+DEFAULT_TIME_LIMIT = 0.05
+# 置换表的最大条目数，超过后清空
+MAX_TABLE_SIZE = 1 << 18
+
+
+class SearchAborted(Exception):
+    pass
+
+
+def hand_size(key):
+    return sum(decode_key(key))
+
+
+# 局面编码：三家的手牌、当前玩家、上一手牌的出牌人和牌（自由出牌时为 NO_PLAYER 和 0）
+def encode_state(hands, current, last_player, last_key):
+    return (hands[0] | hands[1] << HAND_BITS | hands[2] << (2 * HAND_BITS)
+            | current << (3 * HAND_BITS) | last_player << (3 * HAND_BITS + 2) | last_key << (3 * HAND_BITS + 4))
+
+
+class EndgameSolver:
+    def __init__(self, landlord, node_limit=DEFAULT_NODE_LIMIT, time_limit=DEFAULT_TIME_LIMIT):
+        self.landlord = landlord
+        self.node_limit = node_limit
+        self.time_limit = time_limit
+        self.table = {}  # 局面编码 -> 地主能否赢
+        self.nodes = 0
+        self.deadline = 0
+
+    # 为当前玩家找一步必胜的出法：返回出的牌的编码，0 表示不出；没有必胜的出法时返回 None，超过搜索上限时抛出 SearchAborted
+    # hands 为三家手牌的编码；last_player 为 NO_PLAYER 或上一手牌的出牌人
+    def best_move(self, hands, current, last_player=NO_PLAYER, last_key=0):
+        if len(self.table) > MAX_TABLE_SIZE:
+            self.table.clear()
+        self.nodes = 0
+        self.deadline = time.perf_counter() + self.time_limit
+
+        want = current == self.landlord
+        for move in self.moves(hands, current, last_player, last_key):
+            if self.after_move(hands, current, last_player, last_key, move) == want:
+                return move
+        return None
+
+    # 当前玩家所有的出法（编码），0 表示不出：一次出完的排在最前面，然后按张数从多到少，不出放在最后（上家是队友时放在最前面）
+    def moves(self, hands, current, last_player, last_key):
+        hand = hands[current]
+        if last_player == NO_PLAYER:
+            plays = legal_plays(hand)
+        else:
+            plays = legal_plays(hand, classify_key(last_key))
+
+        moves = sorted((key for _, key in plays), key=lambda key: (key != hand, -hand_size(key)))
+        if last_player != NO_PLAYER:
+            teammate = current != self.landlord and last_player != self.landlord
+            if teammate and (not moves or moves[0] != hand):
+                moves.insert(0, 0)
+            else:
+                moves.append(0)
+        return moves
+
+    # 出了 move 之后地主能否赢
+    def after_move(self, hands, current, last_player, last_key, move):
+        following = (current + 1) % 3
+        if move == 0:
+            # 两家都不要时，出牌的人自由出牌
+            if following == last_player:
+                return self.landlord_wins(hands, following, NO_PLAYER, 0)
+            return self.landlord_wins(hands, following, last_player, last_key)
+
+        hands = list(hands)
+        hands[current] -= move
+        if not hands[current]:
+            return current == self.landlord
+        return self.landlord_wins(hands, following, current, move)
+
+    def landlord_wins(self, hands, current, last_player, last_key):
+        state = encode_state(hands, current, last_player, last_key)
+        result = self.table.get(state)
+        if result is not None:
+            return result
+
+        self.nodes += 1
+        if self.nodes > self.node_limit or (self.nodes & 255 == 0 and time.perf_counter() > self.deadline):
+            raise SearchAborted()
+
+        want = current == self.landlord
+        result = not want
+        for move in self.moves(hands, current, last_player, last_key):
+            if self.after_move(hands, current, last_player, last_key, move) == want:
+                result = want
+                break
+
+        self.table[state] = result
+        return result
@@ -0,0 +1,400 @@
+import collections
+import contextlib
+import threading
+import time
+import uuid
+
+import game_store
+
+
+# 登记在册的一局游戏
+class GameEntry:
+    __slots__ = ("game_id", "game", "lock", "changed", "closed", "watchers", "last_access",
+                 "revision", "saved_actions", "synced")
+
+    def __init__(self, game_id, game):
+        self.game_id = game_id
+        self.game = game
+        self.lock = threading.RLock()  # 同一局游戏的请求串行执行
+        self.changed = threading.Condition(self.lock)  # 游戏可能有新事件时通知推送连接
+        self.closed = False  # 已从登记中移除（或已休眠）
+        self.watchers = 0  # 正在推送这局游戏的连接数，有连接时不休眠
+        self.last_access = time.monotonic()
+        # 共享存储时使用：存储中的版本号（None 表示需要重新读取）、保存时操作记录的长度，
+        # 以及游戏是否是从存储中读出的（最后一次修改来自其他进程）
+        self.revision = None
+        self.saved_actions = 0
+        self.synced = False
+
+    # 等待版本号变化或游戏被移除，超时返回 False；调用前必须持有 lock
+    def wait_for_change(self, version, timeout):
+        return self.changed.wait_for(lambda: self.closed or self.game.version != version, timeout)
+
+
+# 按会话/游戏ID保存多局游戏，超过上限按最久未使用淘汰，空闲超时的游戏也会被清理
+# 配置了存储（store）时，空闲 hibernate_after 秒或超过上限的游戏序列化后存入存储并释放内存（休眠），
+# 下次访问时自动恢复；存储在磁盘上时游戏在服务重启后也能恢复
+# 登记锁只保护内存中的登记表：在锁内选出要休眠或清理的游戏并移出登记表，序列化和存储的读写都在释放登记锁之后进行，
+# 存储中过期游戏的清理由后台线程定时执行，请求不会因为其他游戏的磁盘读写而等待登记锁
+# shared 为 True 时存储是游戏的唯一来源，多个进程（或多台机器）可以共用一个存储处理同一局游戏：
+# 每次加锁时先按版本号检查内存中的游戏是否是最新的（不是最新的重新读取），修改后按版本号写回（乐观锁），
+# 期间其他进程先写入了时抛出 game_store.VersionConflict，调用方重新执行整个操作；内存中的游戏只是缓存
+# 恢复或同步时补上还没执行的AI回合，最多执行 turn_budget 秒（None 表示不限），
+# 剩下的回合调用 on_pending(游戏ID) 交给调用方（例如在后台线程中继续），设置 turn_budget 时需要同时提供
+class GameRegistry:
+    # 清理存储中过期游戏的间隔（秒）
+    PURGE_INTERVAL = 60
+
+    def __init__(self, max_games=1000, idle_ttl=1800, store=None, hibernate_after=None, shared=False,
+                 poll_interval=0.5, turn_budget=None, on_pending=None):
+        if shared and store is None:
+            raise ValueError("共享游戏需要配置存储")
+        self.max_games = max_games
+        self.idle_ttl = idle_ttl
+        self.store = store
+        self.hibernate_after = hibernate_after if store is not None else None
+        self.shared = shared
+        self.poll_interval = poll_interval  # 共享存储时推送连接检查其他进程修改的间隔（秒）
+        self.turn_budget = turn_budget
+        self.on_pending = on_pending
+        self.conflicts = 0  # 累计版本冲突次数
+        self.entries = collections.OrderedDict()  # 内存中的游戏，按最近访问排序，最久未使用的在最前面
+        self.hibernating = {}  # 已移出登记表、正在写入存储的游戏（写入期间持有游戏锁）
+        self.lock = threading.Lock()
+        self.hibernated = 0  # 累计休眠次数
+        self.restored = 0  # 累计恢复次数
+        self.purger = None  # 定时清理存储中过期游戏的后台线程，第一次使用时启动
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, game_id):
+        return game_id in self.entries
+
+    @staticmethod
+    def new_game_id():
+        return uuid.uuid4().hex
+
+    # 登记一局新游戏，返回游戏ID
+    def add(self, game, game_id=None):
+        game_id = game_id or self.new_game_id()
+        # 存储读写都在登记锁之外完成：先移除同名的旧游戏，再写入新游戏
+        self.remove(game_id)
+        entry = GameEntry(game_id, game)
+        if self.shared:
+            self._commit(entry)
+        pending = []
+        with self.lock:
+            self._close(self.entries.pop(game_id, None))
+            self._evict(time.monotonic(), pending)
+            self._make_room(pending)
+            self.entries[game_id] = entry
+        self._finish(pending)
+        return game_id
+
+    def get(self, game_id):
+        if not game_id:
+            return None
+        while True:
+            now = time.monotonic()
+            pending = []
+            try:
+                with self.lock:
+                    self._evict(now, pending)
+                    entry = self.entries.get(game_id)
+                    if entry is not None:
+                        if now - entry.last_access > self.idle_ttl:
+                            self._expire(self.entries.pop(game_id), pending)
+                            return None
+                        entry.last_access = now
+                        self.entries.move_to_end(game_id)
+                        return entry
+                    saving = self.hibernating.get(game_id)
+            finally:
+                self._finish(pending)
+            if saving is None:
+                break
+            # 正在写入存储：等写入完成（或失败后放回内存）再重新获取
+            with saving.lock:
+                pass
+        if self.store is None:
+            return None
+        return self._restore(game_id)
+
+    def remove(self, game_id):
+        with self.lock:
+            entry = self.entries.pop(game_id, None)
+            saving = self.hibernating.get(game_id)
+        if self.store is not None:
+            if saving is not None:
+                # 等正在进行的休眠写入完成，否则删除之后又会被写回存储
+                with saving.lock:
+                    pass
+            self.store.delete(game_id)
+        if entry is not None:
+            self._close(entry)
+            # 让推送连接立即结束
+            with entry.lock:
+                entry.changed.notify_all()
+        return entry
+
+    # 标记为已移除；被淘汰的游戏不在这里通知（持有登记锁时不获取游戏锁），推送连接在下一次心跳时结束
+    @staticmethod
+    def _close(entry):
+        if entry is not None:
+            entry.closed = True
+
+    # 空闲超时：游戏不再恢复（存储中的游戏由 _finish 删除）
+    # 共享存储时其他进程可能还在使用这局游戏，只释放内存，存储中的游戏由 purge 按最后修改时间清理
+    def _expire(self, entry, pending):
+        self._close(entry)
+        if self.store is not None and not self.shared:
+            pending.append(("delete", entry.game_id))
+
+    # 清理所有空闲超时的游戏
+    def evict_expired(self):
+        pending = []
+        with self.lock:
+            evicted = self._evict(time.monotonic(), pending)
+        self._finish(pending)
+        return evicted
+
+    # 从最久未使用的游戏开始，清理空闲超时的游戏，休眠空闲超过 hibernate_after 的游戏
+    # 调用前必须持有登记锁；存储的读写加入 pending，释放登记锁后由 _finish 执行
+    def _evict(self, now, pending):
+        if self.store is not None and self.purger is None:
+            self.purger = threading.Thread(target=self._purge_loop, name="mahjong-store-purge", daemon=True)
+            self.purger.start()
+
+        evicted = 0
+        for _ in range(len(self.entries)):
+            entry = next(iter(self.entries.values()))
+            idle = now - entry.last_access
+            if idle > self.idle_ttl:
+                self._expire(self.entries.popitem(last=False)[1], pending)
+            elif self.hibernate_after is not None and idle > self.hibernate_after:
+                if not self._hibernate(entry, pending):
+                    # 正在使用，下次再试
+                    self.entries.move_to_end(entry.game_id)
+                    continue
+            else:
+                break
+            evicted += 1
+        return evicted
+
+    # 每隔 PURGE_INTERVAL 秒清理存储中空闲超时的游戏（全表扫描或遍历目录，不在请求中执行）
+    def _purge_loop(self):
+        while True:
+            time.sleep(self.PURGE_INTERVAL)
+            try:
+                self.store.purge(self.idle_ttl)
+            except Exception:
+                # 存储暂时不可用，下次再试
+                pass
+
+    # 内存中的游戏达到上限时，休眠（没有存储时移除）最久未使用的游戏
+    def _make_room(self, pending):
+        while len(self.entries) >= self.max_games:
+            if self.store is not None and any(self._hibernate(entry, pending) for entry in list(self.entries.values())):
+                continue
+            self._close(self.entries.popitem(last=False)[1])
+
+    # 选出要休眠的游戏：从内存中移除，保持游戏锁直到 _finish 序列化并存入存储；游戏正被请求或推送连接使用时返回 False
+    # 调用前必须持有登记锁；不等待游戏锁，避免与持有游戏锁的请求互相等待
+    def _hibernate(self, entry, pending):
+        if entry.watchers or not game_store.can_encode(entry.game):
+            return False
+        if not entry.lock.acquire(blocking=False):
+            return False
+        del self.entries[entry.game_id]
+        # 已经取到这个条目、正在等待游戏锁的请求会重新获取（见 locked）
+        entry.closed = True
+        self.hibernating[entry.game_id] = entry
+        pending.append(("save", entry))
+        return True
+
+    # 在登记锁之外执行 _evict 等选出的存储读写：删除过期的游戏，序列化并保存要休眠的游戏
+    # 其中一个失败时仍然执行完其他的（每个要休眠的游戏都持有游戏锁），最后抛出第一个异常
+    def _finish(self, pending):
+        error = None
+        for op, item in pending:
+            try:
+                if op == "delete":
+                    self.store.delete(item)
+                else:
+                    self._save(item)
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    # 休眠的第二步（持有游戏锁）；共享存储时每次修改都已写入存储，只释放内存
+    # 保存失败时游戏放回内存，不会丢失
+    def _save(self, entry):
+        saved = False
+        try:
+            if not self.shared:
+                self.store.save(entry.game_id, game_store.encode_game(entry.game))
+            entry.game = None
+            saved = True
+        finally:
+            with self.lock:
+                del self.hibernating[entry.game_id]
+                if saved:
+                    self.hibernated += 1
+                else:
+                    entry.closed = False
+                    self.entries[entry.game_id] = entry
+            entry.lock.release()
+
+    # 从存储中读出游戏，返回 (游戏, 版本号)；不存在、数据损坏或来自不兼容的版本时返回 None（当作游戏不存在）
+    def _load(self, game_id):
+        return self._decode(self.store.load_versioned(game_id))
+
+    @staticmethod
+    def _decode(item):
+        if item is None:
+            return None
+        blob, revision = item
+        try:
+            return game_store.decode_game(blob), revision
+        except Exception:
+            return None
+
+    # 从存储中恢复游戏；重放在登记锁之外进行，两个请求同时恢复时只保留先登记的一个
+    def _restore(self, game_id):
+        loaded = self._load(game_id)
+        if loaded is None:
+            return None
+        game, revision = loaded
+        if not self.shared:
+            # 休眠前后台的AI回合还没执行（例如服务重启），恢复时补上
+            # 共享存储时在加锁后补上（见 locked），保证修改能写回存储
+            game.advance(time_limit=self.turn_budget)
+
+        pending = []
+        with self.lock:
+            entry = self.entries.get(game_id)
+            if entry is None:
+                self._make_room(pending)
+                entry = self.entries[game_id] = GameEntry(game_id, game)
+                entry.revision = revision
+                entry.saved_actions = len(game.action_log)
+                entry.synced = True
+                self.restored += 1
+            entry.last_access = time.monotonic()
+            self.entries.move_to_end(game_id)
+        self._finish(pending)
+        if not self.shared and entry.game is game and game.pending_turn:
+            self._continue(game_id)
+        return entry
+
+    def _continue(self, game_id):
+        if self.on_pending is not None:
+            self.on_pending(game_id)
+
+    # 共享存储时，让内存中的游戏与存储中的一致（调用前必须持有游戏锁）
+    # 游戏已从存储中删除（例如在其他进程开始了新的一局）时标记为已移除并返回 False
+    def sync(self, entry):
+        item = self.store.load_versioned(entry.game_id)
+        if item is not None and item[1] == entry.revision:
+            return True
+        loaded = self._decode(item)
+        if loaded is None:
+            with self.lock:
+                if self.entries.get(entry.game_id) is entry:
+                    del self.entries[entry.game_id]
+            entry.closed = True
+            entry.changed.notify_all()
+            return False
+
+        game, entry.revision = loaded
+        # 时间线只保存在内存中，换成新读出的游戏时保留
+        game.trace = entry.game.trace if entry.game is not None else None
+        entry.game = game
+        entry.saved_actions = len(game.action_log)
+        entry.synced = True
+        entry.changed.notify_all()
+        return True
+
+    # 共享存储时，游戏有了新的操作就按版本号写回存储（调用前必须持有游戏锁）
+    # 期间其他进程先写入了时，内存中的游戏作废（下次加锁时重新读取），抛出 VersionConflict
+    def _commit(self, entry):
+        if entry.revision is not None and len(entry.game.action_log) == entry.saved_actions:
+            return
+        try:
+            entry.revision = self.store.save_versioned(
+                entry.game_id, game_store.encode_game(entry.game), entry.revision or 0)
+        except game_store.VersionConflict:
+            entry.revision = None
+            self.conflicts += 1
+            raise
+        entry.saved_actions = len(entry.game.action_log)
+        entry.synced = False
+
+    # 等待游戏的版本号变化或游戏被移除，超时返回 False；调用前必须持有游戏锁
+    # 共享存储时其他进程的修改不会通知，每隔 poll_interval 秒检查一次存储
+    def wait_for_change(self, entry, version, timeout):
+        if not self.shared:
+            return entry.wait_for_change(version, timeout)
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if entry.wait_for_change(version, max(min(self.poll_interval, remaining), 0)):
+                return True
+            if not self.sync(entry) or entry.game.version != version:
+                return True
+            if remaining <= self.poll_interval:
+                return False
+
+    # 休眠内存中的所有游戏（服务退出前调用），返回休眠的数量
+    def hibernate_all(self):
+        if self.store is None or self.shared:
+            return 0
+        pending = []
+        with self.lock:
+            count = sum(self._hibernate(entry, pending) for entry in list(self.entries.values()))
+        self._finish(pending)
+        return count
+
+    def stats(self):
+        return {
+            "live": len(self.entries),
+            "hibernated": self.hibernated,
+            "restored": self.restored,
+            "stored": len(self.store) if self.store is not None else 0,
+            "shared": self.shared,
+            "conflicts": self.conflicts
+        }
+
+    # 取出游戏并加锁，游戏不存在时返回 None；释放前通知等待这局游戏事件的连接
+    # 取到的条目在加锁前被休眠时，重新获取恢复后的条目
+    # 共享存储时，加锁后先与存储同步，正常退出时写回修改（版本冲突时抛出 VersionConflict）
+    @contextlib.contextmanager
+    def locked(self, game_id):
+        while True:
+            entry = self.get(game_id)
+            if entry is None:
+                yield None
+                return
+            with entry.lock:
+                if entry.closed and entry.game is None:
+                    continue
+                caught_up = False
+                if self.shared:
+                    if not self.sync(entry):
+                        continue
+                    if entry.synced and entry.game.pending_turn:
+                        # 其他进程留下的AI回合（例如那个进程在后台执行前退出了）由这里补上；
+                        # 那个进程同时在执行时，后写回的一方版本冲突后重新执行
+                        entry.game.advance(time_limit=self.turn_budget)
+                        caught_up = True
+                try:
+                    yield entry.game
+                    if self.shared:
+                        self._commit(entry)
+                finally:
+                    entry.changed.notify_all()
+                if caught_up and entry.game.pending_turn:
+                    self._continue(game_id)
+                return
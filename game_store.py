@@ -0,0 +1,395 @@
+import contextlib
+import os
+import random
+import sqlite3
+import struct
+import threading
+import time
+
+import replay
+from mahjong import TURN_ACT, TURN_CLAIMS, TURN_DISCARD, TURN_DRAW
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，文件存储只能由一个进程使用
+    fcntl = None
+
+try:
+    import redis
+except ImportError:  # 只有使用 Redis 存储时需要
+    redis = None
+
+# 休眠的游戏：很小的头部 + 待执行的回合任务（每个1字节）+ 操作记录（每步2字节：操作和座位、牌的编号）
+# 恢复时按种子重新发牌并重放操作，一局约1毫秒；一局游戏通常只有一两百字节
+# 操作记录中没有AI放弃鸣牌，所以回合任务（其中有已经放弃的座位）和当前玩家另外保存，恢复后与保存时完全一致
+BLOB_MAGIC = b"MJ"
+BLOB_VERSION = 2
+# 标记, 版本, 标志, 种子, AI座位（按位）, 时间预算（毫秒）, 模拟次数上限（0 表示不限）, 当前玩家, 回合任务数
+BLOB_HEADER = struct.Struct("<2sBBQBHHBB")
+# 第1版没有当前玩家和回合任务，恢复时按操作记录推出（MahjongGame.restore_turn_queue）
+BLOB_HEADER_V1 = struct.Struct("<2sBBQBHH")
+
+# 标志的最低位以前记录是否还有待执行的回合，恢复时由回合任务得出，不再写入（旧数据中可能有，读取时忽略）
+FLAG_MONTE_CARLO = 2
+FLAG_WAITING = 4  # 正在等待人类玩家决定是否鸣牌（第一个回合任务就是这张弃牌）
+
+# 回合任务的编码：种类（2位）、座位（2位）、已经放弃鸣牌的座位（4位）
+TURN_KINDS = (TURN_DRAW, TURN_ACT, TURN_DISCARD, TURN_CLAIMS)
+TURN_KIND_CODES = {kind: code for code, kind in enumerate(TURN_KINDS)}
+
+
+# 种子不是64位以内的非负整数的游戏无法休眠
+def can_encode(game):
+    return isinstance(game.seed, int) and 0 <= game.seed < 1 << 64
+
+
+def encode_game(game):
+    if not can_encode(game):
+        raise ValueError(f"无法保存种子为 {game.seed!r} 的游戏")
+
+    flags = 0
+    if game.ai_strength == "monte_carlo":
+        flags |= FLAG_MONTE_CARLO
+    if game.waiting_for_action:
+        flags |= FLAG_WAITING
+    ai_seats = sum(1 << i for i, seat_type in enumerate(game.seat_types) if seat_type == "ai")
+    turns = bytes(TURN_KIND_CODES[kind] << 6 | seat << 4 | passed for kind, seat, passed in game.turn_queue)
+
+    header = BLOB_HEADER.pack(BLOB_MAGIC, BLOB_VERSION, flags, game.seed, ai_seats,
+                              min(round(game.ai_budget * 1000), 0xFFFF), min(game.ai_rollouts or 0, 0xFFFF),
+                              game.current_player, len(turns))
+    return header + turns + bytes(game.action_log)
+
+
+def decode_game(blob):
+    magic, version = blob[:2], blob[2] if len(blob) > 2 else None
+    if magic != BLOB_MAGIC or version not in (1, BLOB_VERSION):
+        raise ValueError("无法识别的游戏数据")
+
+    if version == 1:
+        magic, version, flags, seed, ai_seats, budget_ms, rollouts = BLOB_HEADER_V1.unpack_from(blob)
+        turns = None
+        action_log = blob[BLOB_HEADER_V1.size:]
+    else:
+        magic, version, flags, seed, ai_seats, budget_ms, rollouts, current_player, turn_count = \
+            BLOB_HEADER.unpack_from(blob)
+        turns = blob[BLOB_HEADER.size:BLOB_HEADER.size + turn_count]
+        action_log = blob[BLOB_HEADER.size + turn_count:]
+
+    seat_types = ["ai" if ai_seats >> i & 1 else "human" for i in range(4)]
+    game = replay.replay_actions(seed, seat_types, action_log)
+
+    # 重放时AI座位不行动，恢复原来的设置
+    game.seat_types = seat_types
+    for player, seat_type in zip(game.players, seat_types):
+        player["type"] = seat_type
+    game.ai_strength = "monte_carlo" if flags & FLAG_MONTE_CARLO else "basic"
+    game.ai_budget = budget_ms / 1000
+    game.ai_rollouts = rollouts or None
+    if turns is None:
+        game.restore_turn_queue()
+    elif game.game_state == "playing":
+        game.current_player = current_player
+        game.turn_queue.extend((TURN_KINDS[code >> 6], code >> 4 & 3, code & 15) for code in turns)
+        if flags & FLAG_WAITING:
+            # 重新询问人类玩家：已经放弃的座位记在任务中，不会重新决定，结果与保存时相同
+            game.run_task(game.turn_queue.popleft())
+    # AI的随机数按种子和进度重新生成：恢复后AI的随机决策与不休眠时可能不同，但操作记录照样可以重放
+    game.rng = random.Random(seed << 16 | len(action_log) // 2 & 0xFFFF)
+    return game
+
+
+# ---- 存储 ----
+# 每种存储都提供 save / load / delete / purge(max_age)，保存的是 encode_game 的结果
+# 多个进程共用一个存储时（见 GameRegistry 的 shared）还提供带版本号的读写：
+# load_versioned 返回 (数据, 版本号)，save_versioned 只在存储中的版本号仍是 expected 时写入（0 表示还不存在），
+# 返回新的版本号，否则抛出 VersionConflict；每次写入版本号加一
+
+
+# 保存时存储中的游戏已被其他进程修改（或删除）
+class VersionConflict(Exception):
+    pass
+
+
+# 保存在当前进程的内存中（进程重启后丢失）
+class MemoryStore:
+    def __init__(self):
+        self.blobs = {}  # 游戏ID -> (数据, 保存时间, 版本号)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.blobs)
+
+    def save(self, game_id, blob):
+        with self.lock:
+            item = self.blobs.get(game_id)
+            self.blobs[game_id] = (bytes(blob), time.time(), item[2] + 1 if item else 1)
+
+    def load(self, game_id):
+        item = self.load_versioned(game_id)
+        return item[0] if item else None
+
+    def load_versioned(self, game_id):
+        with self.lock:
+            item = self.blobs.get(game_id)
+        return (item[0], item[2]) if item else None
+
+    def save_versioned(self, game_id, blob, expected):
+        with self.lock:
+            item = self.blobs.get(game_id)
+            if (item[2] if item else 0) != expected:
+                raise VersionConflict(game_id)
+            self.blobs[game_id] = (bytes(blob), time.time(), expected + 1)
+        return expected + 1
+
+    def delete(self, game_id):
+        with self.lock:
+            self.blobs.pop(game_id, None)
+
+    # 删除超过 max_age 秒没有更新的游戏
+    def purge(self, max_age):
+        cutoff = time.time() - max_age
+        with self.lock:
+            expired = [game_id for game_id, (_, saved, _) in self.blobs.items() if saved < cutoff]
+            for game_id in expired:
+                del self.blobs[game_id]
+        return len(expired)
+
+
+# 保存在本地 SQLite 数据库中，进程重启后仍然可以恢复；同一台机器上的多个进程可以共用
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # 其他进程正在写入时最多等待 timeout 秒
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS games (game_id TEXT PRIMARY KEY, blob BLOB NOT NULL, "
+                          "updated REAL NOT NULL, revision INTEGER NOT NULL DEFAULT 1)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS games_updated ON games (updated)")
+        # 旧版本创建的数据库没有版本号
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(games)")]
+        if "revision" not in columns:
+            self.conn.execute("ALTER TABLE games ADD COLUMN revision INTEGER NOT NULL DEFAULT 1")
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def save(self, game_id, blob):
+        with self.lock:
+            self.conn.execute("INSERT INTO games (game_id, blob, updated) VALUES (?, ?, ?) ON CONFLICT (game_id) "
+                              "DO UPDATE SET blob = excluded.blob, updated = excluded.updated, revision = revision + 1",
+                              (game_id, bytes(blob), time.time()))
+
+    def load(self, game_id):
+        item = self.load_versioned(game_id)
+        return item[0] if item else None
+
+    def load_versioned(self, game_id):
+        with self.lock:
+            row = self.conn.execute("SELECT blob, revision FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    # 比较和写入在同一条语句中完成，多个进程同时写入时只有一个成功
+    def save_versioned(self, game_id, blob, expected):
+        with self.lock:
+            if expected == 0:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO games (game_id, blob, updated, revision) VALUES (?, ?, ?, 1)",
+                    (game_id, bytes(blob), time.time()))
+            else:
+                cursor = self.conn.execute(
+                    "UPDATE games SET blob = ?, updated = ?, revision = revision + 1 WHERE game_id = ? AND revision = ?",
+                    (bytes(blob), time.time(), game_id, expected))
+        if cursor.rowcount != 1:
+            raise VersionConflict(game_id)
+        return expected + 1
+
+    def delete(self, game_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+
+    def purge(self, max_age):
+        with self.lock:
+            return self.conn.execute("DELETE FROM games WHERE updated < ?", (time.time() - max_age,)).rowcount
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# 每局游戏一个文件，写入时先写临时文件再改名，进程中途退出也不会留下不完整的数据
+# 文件开头是版本号；修改文件时持有目录中的锁文件（fcntl.flock），同一台机器上的多个进程可以共用
+class FileStore:
+    SUFFIX = ".mjg"
+    LOCK_NAME = ".lock"
+    # 标记, 版本号；旧版本写入的文件没有这个头部，当作版本 1
+    FILE_HEADER = struct.Struct("<4sQ")
+    FILE_MAGIC = b"MJRV"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return sum(1 for name in os.listdir(self.directory) if name.endswith(self.SUFFIX))
+
+    def _path(self, game_id):
+        # 游戏ID会成为文件名，只允许字母和数字
+        if not game_id.isalnum():
+            raise ValueError(f"非法的游戏ID: {game_id!r}")
+        return os.path.join(self.directory, game_id + self.SUFFIX)
+
+    # 修改文件时持有：同一进程内的线程用线程锁，不同进程用锁文件
+    @contextlib.contextmanager
+    def _locked(self):
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, self.LOCK_NAME), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if data[:len(self.FILE_MAGIC)] != self.FILE_MAGIC:
+            return data, 1
+        _, revision = self.FILE_HEADER.unpack_from(data)
+        return data[self.FILE_HEADER.size:], revision
+
+    def _write(self, path, blob, revision):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.FILE_HEADER.pack(self.FILE_MAGIC, revision))
+            f.write(blob)
+        os.replace(tmp_path, path)
+
+    def save(self, game_id, blob):
+        path = self._path(game_id)
+        with self._locked():
+            item = self._read(path)
+            self._write(path, blob, item[1] + 1 if item else 1)
+
+    def load(self, game_id):
+        item = self.load_versioned(game_id)
+        return item[0] if item else None
+
+    # 改名是原子操作，读取时不需要加锁
+    def load_versioned(self, game_id):
+        return self._read(self._path(game_id))
+
+    def save_versioned(self, game_id, blob, expected):
+        path = self._path(game_id)
+        with self._locked():
+            item = self._read(path)
+            if (item[1] if item else 0) != expected:
+                raise VersionConflict(game_id)
+            self._write(path, blob, expected + 1)
+        return expected + 1
+
+    def delete(self, game_id):
+        path = self._path(game_id)
+        with self._locked():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def purge(self, max_age):
+        cutoff = time.time() - max_age
+        purged = 0
+        with self._locked():
+            for name in os.listdir(self.directory):
+                if not name.endswith(self.SUFFIX):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        purged += 1
+                except FileNotFoundError:
+                    pass
+        return purged
+
+
+# 保存在 Redis 中（需要安装 redis），多台机器上的进程可以共用
+# 每局游戏是一个哈希（数据和版本号），比较和写入用 Lua 脚本在服务端一次完成；
+# 超过 max_age 秒没有更新的游戏由 Redis 自动删除，purge 不需要做什么
+class RedisStore:
+    KEY_PREFIX = "mahjong:game:"
+
+    # KEYS[1]: 游戏; ARGV: 期望的版本号（-1 表示不比较）, 数据, 过期时间（秒，0 表示不过期）
+    SAVE_SCRIPT = """
+local revision = tonumber(redis.call('HGET', KEYS[1], 'revision') or '0')
+if tonumber(ARGV[1]) >= 0 and revision ~= tonumber(ARGV[1]) then
+    return -1
+end
+redis.call('HSET', KEYS[1], 'blob', ARGV[2], 'revision', revision + 1)
+if tonumber(ARGV[3]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return revision + 1
+"""
+
+    def __init__(self, url, max_age=None):
+        if redis is None:
+            raise ValueError("使用 Redis 存储需要安装 redis（pip install redis）")
+        self.client = redis.Redis.from_url(url)
+        self.max_age = int(max_age or 0)
+        self.save_script = self.client.register_script(self.SAVE_SCRIPT)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.KEY_PREFIX + "*", count=1000))
+
+    def _key(self, game_id):
+        return self.KEY_PREFIX + game_id
+
+    def save(self, game_id, blob):
+        self.save_script(keys=[self._key(game_id)], args=[-1, bytes(blob), self.max_age])
+
+    def load(self, game_id):
+        item = self.load_versioned(game_id)
+        return item[0] if item else None
+
+    def load_versioned(self, game_id):
+        blob, revision = self.client.hmget(self._key(game_id), "blob", "revision")
+        return (bytes(blob), int(revision)) if blob is not None else None
+
+    def save_versioned(self, game_id, blob, expected):
+        revision = self.save_script(keys=[self._key(game_id)], args=[expected, bytes(blob), self.max_age])
+        if revision < 0:
+            raise VersionConflict(game_id)
+        return revision
+
+    def delete(self, game_id):
+        self.client.delete(self._key(game_id))
+
+    def purge(self, max_age):
+        return 0
+
+
+# 按配置创建存储："memory"、"sqlite:路径"、"file:目录"、"redis://主机:端口/库"，空字符串或 "none" 表示不休眠
+# max_age 为游戏的保留时间（秒），Redis 存储按这个时间设置过期
+def open_store(spec, max_age=None):
+    if not spec or spec == "none":
+        return None
+    if spec == "memory":
+        return MemoryStore()
+    if spec.startswith(("redis://", "rediss://")):
+        return RedisStore(spec, max_age)
+    kind, _, location = spec.partition(":")
+    if kind == "sqlite" and location:
+        return SQLiteStore(location)
+    if kind == "file" and location:
+        return FileStore(location)
+    raise ValueError(f"未知的游戏存储: {spec}")
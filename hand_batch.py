@@ -0,0 +1,152 @@
+import numpy as np
+
+from hand_tables import COMPLETE_KEYS, PAIR_KEYS, HONOR_START, TILE_KINDS, decode_suit, _suit_frontiers
+
+# 批量评估手牌：输入 (N, 34) 的张数数组，一次得到 N 手牌的胡牌标志和向听数
+# 与 hand_tables 中的单手牌版本使用同样的牌型表和花色拆法，结果完全一致
+
+# 每个花色编码成9位十进制数时各位的权重
+SUIT_WEIGHTS = 10 ** np.arange(8, -1, -1, dtype=np.int64)
+COMPLETE_ARRAY = np.array(sorted(COMPLETE_KEYS), dtype=np.int64)
+PAIR_ARRAY = np.array(sorted(PAIR_KEYS), dtype=np.int64)
+
+
+def as_counts_array(counts):
+    counts = np.asarray(counts, dtype=np.int64)
+    if counts.ndim == 1:
+        counts = counts[np.newaxis, :]
+    if counts.shape[1] != TILE_KINDS:
+        raise ValueError(f"张数数组的形状应为 (N, {TILE_KINDS})，实际为 {counts.shape}")
+    return counts
+
+
+# 每手牌三个数牌花色的编码，形状 (N, 3)
+def suit_keys(counts):
+    return np.stack([counts[:, start:start + 9] @ SUIT_WEIGHTS for start in (0, 9, 18)], axis=1)
+
+
+# keys 中的每个值是否在排好序的表中
+def _in_table(keys, table):
+    idx = np.searchsorted(table, keys)
+    idx[idx == len(table)] = 0
+    return table[idx] == keys
+
+
+def _melds_array(existing_melds, n):
+    return np.broadcast_to(np.asarray(existing_melds, dtype=np.int64), (n,))
+
+
+# 胡牌标志（4组+1对将），existing_melds 可以是整数或长度为 N 的数组
+def batch_is_winning(counts, existing_melds=0):
+    counts = as_counts_array(counts)
+    melds = _melds_array(existing_melds, len(counts))
+
+    # 张数必须正好是 3*面子数 + 2
+    ok = counts.sum(axis=1) == (4 - melds) * 3 + 2
+
+    # 数牌：每个花色查表
+    keys = suit_keys(counts)
+    complete = _in_table(keys, COMPLETE_ARRAY)
+    with_pair = _in_table(keys, PAIR_ARRAY)
+    ok &= (complete | with_pair).all(axis=1)
+    pairs = with_pair.sum(axis=1)
+
+    # 字牌：只能是刻子（3张）或将（2张）
+    honors = counts[:, HONOR_START:]
+    ok &= ((honors == 0) | (honors == 2) | (honors == 3)).all(axis=1)
+    pairs += (honors == 2).sum(axis=1)
+
+    return ok & (pairs == 1)
+
+
+# 合并时所有 m1 + m2 <= 4 的组合，按 m1 + m2 排序，MERGE_STARTS 为每个 m1 + m2 的起始位置
+MERGE_LEFT, MERGE_RIGHT = np.array(sorted(
+    ((m1, m2) for m1 in range(5) for m2 in range(5 - m1)), key=lambda pair: pair[0] + pair[1])).T
+MERGE_STARTS = np.array([0, 1, 3, 6, 10])
+
+
+# 合并两组牌的数组（第 m 项为恰好 m 组面子时最多的搭子数，-1 表示做不到），所有行一起计算
+def _merge(left, right):
+    left = left[:, MERGE_LEFT]
+    right = right[:, MERGE_RIGHT]
+    total = np.where((left >= 0) & (right >= 0), np.minimum(left + right, 4), -1)
+    return np.maximum.reduceat(total, MERGE_STARTS, axis=1)
+
+
+def _combine(left, right):
+    plain = _merge(left[0], right[0])
+    with_pair = np.maximum(_merge(left[1], right[0]), _merge(left[0], right[1]))
+    return plain, with_pair
+
+
+# 一个花色的 (不含将, 含将) 数组：同样的花色牌型只用单手牌版本计算一次
+def _suit_group(keys):
+    unique, inverse = np.unique(keys, return_inverse=True)
+    table = np.array([_suit_frontiers(tuple(decode_suit(int(key)))) for key in unique], dtype=np.int64)
+    table = table.reshape(len(unique), 2, 5)
+    rows = table[inverse.reshape(-1)]
+    return rows[:, 0], rows[:, 1]
+
+
+# 向听数：0 为听牌，-1 为已经胡牌，与 hand_tables.shanten 相同（同样不考虑每种牌只有4张）
+def batch_shanten(counts, existing_melds=0):
+    counts = as_counts_array(counts)
+    n = len(counts)
+    rows = np.arange(n)
+
+    # 已经碰/杠的组合
+    plain = np.full((n, 5), -1, dtype=np.int64)
+    plain[rows, np.minimum(_melds_array(existing_melds, n), 4)] = 0
+    group = (plain, np.full((n, 5), -1, dtype=np.int64))
+
+    # 数牌每个花色分别查表后合并
+    keys = suit_keys(counts)
+    for suit in range(3):
+        group = _combine(group, _suit_group(keys[:, suit]))
+
+    # 字牌不能组成顺子：3张以上是刻子，2张是搭子或将
+    honors = counts[:, HONOR_START:]
+    honor_melds = np.minimum((honors >= 3).sum(axis=1), 4)
+    honor_pairs = (honors == 2).sum(axis=1)
+    plain = np.full((n, 5), -1, dtype=np.int64)
+    plain[rows, honor_melds] = np.minimum(honor_pairs, 4)
+    with_pair = np.full((n, 5), -1, dtype=np.int64)
+    with_pair[rows, honor_melds] = np.where(honor_pairs > 0, np.minimum(honor_pairs - 1, 4), -1)
+    group = _combine(group, (plain, with_pair))
+
+    # 向听数 = 8 - 2*面子数 - 搭子数 - 将，面子+搭子最多算4组
+    best = np.full(n, 8, dtype=np.int64)
+    for has_pair, frontier in enumerate(group):
+        for m in range(5):
+            t = frontier[:, m]
+            value = 8 - 2 * m - np.minimum(t, 4 - m) - has_pair
+            best = np.where(t >= 0, np.minimum(best, value), best)
+    return best
+
+
+# 胡牌标志和向听数
+def batch_evaluate(counts, existing_melds=0):
+    counts = as_counts_array(counts)
+    return batch_is_winning(counts, existing_melds), batch_shanten(counts, existing_melds)
+
+
+# 从一手 3n+2 张的牌出发，列出"打出一张、再摸一张"的所有组合
+# 返回 (pairs, counts)：pairs 为 (打出的牌, 摸到的牌) 编号，counts 为对应的 (N, 34) 张数数组
+# 摸到的牌不超过每种4张（计算时不知道别人手里有什么）
+def discard_draw_counts(counts):
+    counts = np.asarray(counts, dtype=np.int64)
+    discards = np.flatnonzero(counts)
+
+    pairs = []
+    for discard in discards:
+        after = counts.copy()
+        after[discard] -= 1
+        for draw in np.flatnonzero(after < 4):
+            pairs.append((discard, draw))
+
+    pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    result = np.repeat(counts[np.newaxis, :], len(pairs), axis=0)
+    rows = np.arange(len(pairs))
+    result[rows, pairs[:, 0]] -= 1
+    result[rows, pairs[:, 1]] += 1
+    return pairs, result
@@ -0,0 +1,366 @@
+import collections
+import functools
+import itertools
+import threading
+
+# 数牌花色（可以组成顺子）
+NUMBER_SUITS = ["筒", "条", "万"]
+# 字牌花色（只能组成刻子或将）
+HONOR_SUITS = ["风", "箭"]
+
+# 34种牌的整数编号：0-8 筒，9-17 条，18-26 万，27-30 东南西北，31-33 中发白
+# 编号顺序即手牌的排序顺序
+TILE_KEYS = ([(suit, value) for suit in NUMBER_SUITS for value in range(1, 10)] +
+             [("风", value) for value in ["东", "南", "西", "北"]] +
+             [("箭", value) for value in ["中", "发", "白"]])
+TILE_IDS = {key: tile_id for tile_id, key in enumerate(TILE_KEYS)}
+TILE_KINDS = len(TILE_KEYS)
+# 第一张字牌的编号
+HONOR_START = 27
+
+
+# 把一个花色的9个计数编码成9位十进制数，例如 一二三筒各一张 -> 111000000
+def encode_suit(counts):
+    key = 0
+    for count in counts:
+        key = key * 10 + count
+    return key
+
+
+def decode_suit(key):
+    counts = [0] * 9
+    for i in range(8, -1, -1):
+        key, counts[i] = divmod(key, 10)
+    return counts
+
+
+# 预先生成单一花色内所有"全部成面子"和"一对将+全部成面子"的牌型
+def _build_suit_tables():
+    # 单一花色内所有可能的面子：9种刻子 + 7种顺子
+    melds = []
+    for value in range(9):
+        counts = [0] * 9
+        counts[value] = 3
+        melds.append(counts)
+    for value in range(7):
+        counts = [0] * 9
+        counts[value] = counts[value + 1] = counts[value + 2] = 1
+        melds.append(counts)
+
+    complete = set()
+    # 一副牌最多4组面子
+    for n in range(5):
+        for combo in itertools.combinations_with_replacement(range(len(melds)), n):
+            counts = [0] * 9
+            for idx in combo:
+                for value in range(9):
+                    counts[value] += melds[idx][value]
+            # 每种牌最多4张
+            if max(counts) <= 4:
+                complete.add(encode_suit(counts))
+
+    with_pair = set()
+    for key in complete:
+        counts = decode_suit(key)
+        # 加上将之后不能超过14张
+        if sum(counts) > 12:
+            continue
+        for value in range(9):
+            if counts[value] <= 2:
+                counts[value] += 2
+                with_pair.add(encode_suit(counts))
+                counts[value] -= 2
+
+    return frozenset(complete), frozenset(with_pair)
+
+
+COMPLETE_KEYS, PAIR_KEYS = _build_suit_tables()
+
+
+# 查表判断是否胡牌（4组+1对将），counts 为长度34的张数向量
+def is_winning_counts(counts, existing_melds=0):
+    sets_needed = 4 - existing_melds
+
+    # 张数必须正好是 3*面子数 + 2
+    if sum(counts) != sets_needed * 3 + 2:
+        return False
+
+    pairs = 0
+
+    # 数牌：每个花色编码后查表
+    for start in (0, 9, 18):
+        key = 0
+        for count in counts[start:start + 9]:
+            key = key * 10 + count
+        if key in COMPLETE_KEYS:
+            continue
+        if key in PAIR_KEYS:
+            pairs += 1
+            continue
+        return False
+
+    # 字牌：只能是刻子（3张）或将（2张）
+    for count in counts[HONOR_START:]:
+        if count == 2:
+            pairs += 1
+        elif count and count != 3:
+            return False
+
+    return pairs == 1
+
+
+# 把 (花色, 数值) -> 张数 的计数器转换成张数向量
+def counter_to_counts(counter):
+    counts = [0] * TILE_KINDS
+    for key, count in counter.items():
+        counts[TILE_IDS[key]] += count
+    return counts
+
+
+def is_winning_counter(counter, existing_melds=0):
+    return is_winning_counts(counter_to_counts(counter), existing_melds)
+
+
+# ---- 向听数与听牌 ----
+
+# 单一花色能拆出的 (面子数, 搭子数) 组合，只保留不被其他组合同时超过的那些
+def _pareto(options):
+    return frozenset(
+        (m, t) for m, t in options
+        if not any(m2 >= m and t2 >= t and (m2, t2) != (m, t) for m2, t2 in options)
+    )
+
+
+# 不含将的拆法：面子（刻子、顺子）和搭子（对子、两面/边张、嵌张）
+@functools.lru_cache(maxsize=1 << 16)
+def _suit_blocks(counts):
+    i = next((i for i, count in enumerate(counts) if count), None)
+    if i is None:
+        return frozenset([(0, 0)])
+
+    options = set()
+
+    def take(used, meld, partial):
+        rest = list(counts)
+        for j in used:
+            rest[j] -= 1
+        for m, t in _suit_blocks(tuple(rest)):
+            options.add((m + meld, min(t + partial, 4)))
+
+    # 这张牌不参与任何组合
+    take([i], 0, 0)
+    if counts[i] >= 3:
+        take([i, i, i], 1, 0)
+    if counts[i] >= 2:
+        take([i, i], 0, 1)
+    if i <= 6 and counts[i + 1] and counts[i + 2]:
+        take([i, i + 1, i + 2], 1, 0)
+    if i <= 7 and counts[i + 1]:
+        take([i, i + 1], 0, 1)
+    if i <= 6 and counts[i + 2]:
+        take([i, i + 2], 0, 1)
+
+    return _pareto(options)
+
+
+# 以这个花色中的某个对子作将的拆法，没有对子时为空
+@functools.lru_cache(maxsize=1 << 16)
+def _suit_blocks_with_pair(counts):
+    options = set()
+    for i, count in enumerate(counts):
+        if count >= 2:
+            rest = list(counts)
+            rest[i] -= 2
+            options.update(_suit_blocks(tuple(rest)))
+    return _pareto(options)
+
+
+# 把拆法转换成长度为5的数组：第 m 项为恰好 m 组面子时最多的搭子数，-1 表示做不到
+def _to_frontier(options):
+    frontier = [-1] * 5
+    for m, t in options:
+        if m <= 4 and t > frontier[m]:
+            frontier[m] = t
+    return tuple(frontier)
+
+
+NO_FRONTIER = (-1, -1, -1, -1, -1)
+
+
+# 一个花色的 (不含将, 含将) 两种数组
+@functools.lru_cache(maxsize=1 << 16)
+def _suit_frontiers(counts):
+    return _to_frontier(_suit_blocks(counts)), _to_frontier(_suit_blocks_with_pair(counts))
+
+
+def _merge(left, right):
+    merged = [-1] * 5
+    for m1, t1 in enumerate(left):
+        if t1 < 0:
+            continue
+        for m2 in range(5 - m1):
+            t2 = right[m2]
+            if t2 >= 0 and t1 + t2 > merged[m1 + m2]:
+                merged[m1 + m2] = min(t1 + t2, 4)
+    return tuple(merged)
+
+
+# 合并两组牌：将最多只能有一个，所以含将的结果来自其中一组含将
+# 不同的数组种类很少，缓存命中率很高
+@functools.lru_cache(maxsize=1 << 16)
+def _combine(left, right):
+    plain = _merge(left[0], right[0])
+    with_pair = tuple(max(a, b) for a, b in zip(_merge(left[1], right[0]), _merge(left[0], right[1])))
+    return plain, with_pair
+
+
+def _shanten(counts, existing_melds):
+    # 已经碰/杠的组合
+    melds = [-1] * 5
+    melds[min(existing_melds, 4)] = 0
+    group = (tuple(melds), NO_FRONTIER)
+
+    # 数牌每个花色分别查表后合并
+    for start in (0, 9, 18):
+        group = _combine(group, _suit_frontiers(tuple(counts[start:start + 9])))
+
+    # 字牌不能组成顺子：3张以上是刻子，2张是搭子或将
+    honor_melds = min(sum(1 for count in counts[HONOR_START:] if count >= 3), 4)
+    honor_pairs = sum(1 for count in counts[HONOR_START:] if count == 2)
+    plain = [-1] * 5
+    plain[honor_melds] = min(honor_pairs, 4)
+    with_pair = [-1] * 5
+    if honor_pairs:
+        with_pair[honor_melds] = min(honor_pairs - 1, 4)
+    group = _combine(group, (tuple(plain), tuple(with_pair)))
+
+    # 向听数 = 8 - 2*面子数 - 搭子数 - 将，面子+搭子最多算4组
+    best = 8
+    for has_pair, frontier in enumerate(group):
+        for m, t in enumerate(frontier):
+            if t >= 0:
+                best = min(best, 8 - 2 * m - min(t, 4 - m) - has_pair)
+    return best
+
+
+def _waiting_tiles(counts, existing_melds):
+    # 向听数不考虑4张的限制，比实际的更小，不为0时一定不听牌
+    if shanten(counts, existing_melds) != 0:
+        return ()
+
+    counts = list(counts)
+    waits = []
+    for tile_id in range(TILE_KINDS):
+        if counts[tile_id] >= 4 or not _is_near(counts, tile_id):
+            continue
+        counts[tile_id] += 1
+        if is_winning_counts(counts, existing_melds):
+            waits.append(tile_id)
+        counts[tile_id] -= 1
+    return tuple(waits)
+
+
+# 能让手牌胡牌的牌一定是手里已有的牌，或同花色相差不超过2的数牌
+def _is_near(counts, tile_id):
+    if counts[tile_id]:
+        return True
+    if tile_id >= HONOR_START:
+        return False
+    value = tile_id % 9
+    for offset in (-2, -1, 1, 2):
+        if 0 <= value + offset <= 8 and counts[tile_id + offset]:
+            return True
+    return False
+
+
+# 别人打出后可能碰、杠、胡的牌：听的牌和手里有2张以上的牌
+def _claim_tiles(counts, existing_melds):
+    claim_tiles = set(waiting_tiles(counts, existing_melds))
+    claim_tiles.update(tile_id for tile_id, count in enumerate(counts) if count >= 2)
+    return frozenset(claim_tiles)
+
+
+# ---- 评估结果缓存 ----
+
+# 缓存的结果种类；胡牌判定直接查表比生成键、查缓存还快，不经过缓存
+SHANTEN, WAITS, CLAIM = range(3)
+CACHE_KINDS = ("shanten", "waits", "claim")
+
+_MISSING = object()
+
+
+# 所有牌局共用的手牌评估缓存（向听数、听牌、可鸣牌），总条目数有上限，超出后淘汰最久未使用的
+# 键为34种牌的张数加上已有组合数和结果种类（36字节），与摸牌顺序、座位和牌局无关
+class HandCache:
+    def __init__(self, max_entries=1 << 16):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()  # 多个牌局可能在不同线程中同时计算
+        self.hits = [0] * len(CACHE_KINDS)
+        self.misses = [0] * len(CACHE_KINDS)
+
+    def __len__(self):
+        return len(self.entries)
+
+    # 查找缓存，没有时用 compute(counts, existing_melds) 计算并保存
+    def get(self, kind, counts, existing_melds, compute):
+        key = bytes(counts) + bytes((existing_melds, kind))
+        with self.lock:
+            value = self.entries.get(key, _MISSING)
+            if value is not _MISSING:
+                self.entries.move_to_end(key)
+                self.hits[kind] += 1
+                return value
+            self.misses[kind] += 1
+
+        # 计算时不持有锁（听牌的计算本身也会查询缓存）
+        value = compute(counts, existing_melds)
+        with self.lock:
+            self.entries[key] = value
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    # 调整条目上限，超出的部分立即淘汰
+    def resize(self, max_entries):
+        with self.lock:
+            self.max_entries = max_entries
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = [0] * len(CACHE_KINDS)
+            self.misses = [0] * len(CACHE_KINDS)
+
+    # 每种结果的命中/未命中次数
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "kinds": {
+                    name: {"hits": self.hits[kind], "misses": self.misses[kind]}
+                    for kind, name in enumerate(CACHE_KINDS)
+                }
+            }
+
+
+HAND_CACHE = HandCache()
+
+
+# 向听数：还差几张牌听牌，0 为听牌，-1 为已经胡牌（只计算4组+1对将的牌型）
+# 与通常的向听数算法一样不考虑每种牌只有4张，所以手里已有4张的牌可能被算作听牌，准确的听牌请用 waiting_tiles
+def shanten(counts, existing_melds=0):
+    return HAND_CACHE.get(SHANTEN, counts, existing_melds, _shanten)
+
+
+# 听哪些牌：摸到或别人打出后就能胡的牌的编号
+def waiting_tiles(counts, existing_melds=0):
+    return HAND_CACHE.get(WAITS, counts, existing_melds, _waiting_tiles)
+
+
+# 别人打出哪些牌时可能碰、杠、胡（牌的编号集合），在手牌为 3n+1 张时调用
+def claim_tiles(counts, existing_melds=0):
+    return HAND_CACHE.get(CLAIM, counts, existing_melds, _claim_tiles)
@@ -0,0 +1,1143 @@
+import base64
+import collections
+import random
+import time
+
+import metrics
+import monte_carlo
+from hand_tables import (TILE_IDS, TILE_KEYS, TILE_KINDS, HONOR_START, claim_tiles, is_winning_counts, shanten,
+                         waiting_tiles)
+
+# 麻将牌定义
+class Tile:
+    __slots__ = ("suit", "value", "tile_id")
+
+    def __init__(self, suit, value):
+        self.suit = suit  # 牌的类型：筒、条、万、风、箭
+        self.value = value  # 牌的数值
+        self.tile_id = TILE_IDS[(suit, value)]  # 整数编号 0-33，也是排序顺序
+
+    def __str__(self):
+        return f"{self.suit}_{self.value}"
+
+    def to_dict(self):
+        return {
+            'suit': self.suit,
+            'value': self.value,
+            'id': f"{self.suit}_{self.value}"
+        }
+
+def tile_sort_key(tile):
+    return tile.tile_id
+
+
+# 按编号生成与 Tile.to_dict 相同格式的字典
+def tile_id_to_dict(tile_id):
+    suit, value = TILE_KEYS[tile_id]
+    return {
+        'suit': suit,
+        'value': value,
+        'id': f"{suit}_{value}"
+    }
+
+
+# 发给客户端的格式（线路格式），每种格式是 (一张牌, 一组牌, 一组牌的编号) 的编码函数
+# verbose：每张牌 {suit, value, id}；compact：一张牌为编号 0-33，一组牌为编号字节的 base64 字符串
+# 看不到的牌在两种格式中都是 None
+def _packed_tiles(tiles):
+    return base64.b64encode(bytes(tile.tile_id for tile in tiles)).decode("ascii")
+
+
+def _packed_tile_ids(tile_ids):
+    return base64.b64encode(bytes(tile_ids)).decode("ascii")
+
+
+WIRE_FORMATS = {
+    "verbose": (Tile.to_dict, lambda tiles: [tile.to_dict() for tile in tiles],
+                lambda tile_ids: [tile_id_to_dict(tile_id) for tile_id in tile_ids]),
+    "compact": (lambda tile: tile.tile_id, _packed_tiles, _packed_tile_ids)
+}
+
+
+# 组合牌（碰、杠）的线路格式
+def meld_to_wire(meld, wire="verbose"):
+    return {
+        "type": meld["type"],
+        "tiles": WIRE_FORMATS[wire][1](meld["tiles"]),
+        "from_player": meld["from_player"],
+        "is_concealed": meld.get("is_concealed", False)
+    }
+
+
+# AI强度
+AI_STRENGTHS = ("basic", "monte_carlo")
+
+# 操作记录中每种操作的编号；每条记录2字节：(编号 << 2 | 座位, 牌的编号)，没有牌时为 NO_TILE
+ACTION_CODES = {"draw": 0, "discard": 1, "pong": 2, "kong": 3, "concealed_kong": 4, "add_kong": 5, "win": 6, "pass": 7}
+ACTION_NAMES = {code: name for name, code in ACTION_CODES.items()}
+NO_TILE = 255
+
+# 回合调度的任务 (类型, 座位, 已放弃鸣牌的座位（按位）)，每个任务执行一个操作，再排入下一个任务
+TURN_DRAW = "draw"  # 轮到 seat 摸牌，人类玩家时停下等待
+TURN_ACT = "act"  # AI 摸牌之后：自摸、暗杠、加杠或出牌
+TURN_DISCARD = "discard"  # AI 碰、杠之后出牌
+TURN_CLAIMS = "claims"  # seat 打出的牌，其他座位按优先级决定是否鸣牌
+# 鸣牌的优先级：胡 > 杠 > 碰，同一级按出牌者的下家开始的顺序
+CLAIM_PRIORITY = ("win", "kong", "pong")
+
+
+# 没有指定种子时随机生成一个，记录下来以便重现这局游戏（48位，JSON和JavaScript都能精确表示）
+def new_seed():
+    return random.SystemRandom().getrandbits(48)
+
+
+# 游戏类（不依赖Flask，可以直接用于模拟、测试和AI评估）
+class MahjongGame:
+    def __init__(self, seed=None, seat_types=None, ai_strength="basic", ai_budget=0.05, ai_rollouts=None):
+        if ai_strength not in AI_STRENGTHS:
+            raise ValueError(f"未知的AI强度: {ai_strength}")
+        self.seed = new_seed() if seed is None else seed  # 随机种子，决定牌序和AI的随机决策
+        self.rng = random.Random(self.seed)  # 每局游戏独立的随机数生成器
+        self.seat_types = list(seat_types or ["human", "ai", "ai", "ai"])  # 每个座位是人类还是AI
+        self.ai_strength = ai_strength  # AI强度：basic 为固定的打牌策略，monte_carlo 为模拟选牌
+        self.ai_budget = ai_budget  # monte_carlo 模式下每次决策的时间预算（秒）
+        self.ai_rollouts = ai_rollouts  # monte_carlo 模式下每个候选最多模拟的次数，None 表示只受时间限制
+        self.tiles = []  # 牌堆
+        self.players = []  # 玩家
+        self.current_player = 0  # 当前玩家索引
+        self.game_state = "waiting"  # 游戏状态
+        self.last_discarded = None  # 最后一张弃牌
+        self.last_action = None  # 最后一个动作
+        self.waiting_for_action = False  # 是否等待玩家操作（碰、杠、胡）
+        self.possible_actions = {}  # 可能的操作
+        self.action_seat = None  # possible_actions 属于哪个座位
+        self.wall_count = 0  # 开杠次数，用于岭上开花
+        self.last_drawn_tile = None  # 最后摸到的牌
+        self.turn_queue = collections.deque()  # 待执行的回合任务（见 advance）
+        self.events = []  # 游戏事件（摸牌、出牌、碰、杠、胡），由前端按自己的节奏播放
+        self.action_log = bytearray()  # 只追加的操作记录，与种子一起可以重现整局游戏（见 replay.py）
+        self.trace = None  # 调试用的时间线（tracing.Trace），None 表示不记录
+        self.initialize_game()
+
+    def initialize_game(self):
+        # 创建牌堆
+        self.create_tiles()
+        # 洗牌
+        self.shuffle_tiles()
+        # 创建四个玩家
+        self.players = [
+            {
+                "name": "玩家",
+                "type": self.seat_types[0],
+                "hand": [],
+                "discarded": [],
+                "ready": False,
+                "melds": [],  # 已经组合的牌（碰、杠）
+                "score": 0,   # 玩家分数
+                "winning_hand": None,  # 胡牌时的牌型
+                "is_waiting": False,   # 是否听牌
+                "waiting_tiles": (),   # 听哪些牌（牌的编号）
+                "counts": [0] * TILE_KINDS,  # 手牌中每种牌的张数，随摸牌、出牌、碰杠增量更新
+                "claim_tiles": frozenset()   # 别人打出后可能碰、杠、胡的牌，手牌变化时才重新计算
+            },
+            {
+                "name": "东家",
+                "type": self.seat_types[1],
+                "hand": [],
+                "discarded": [],
+                "ready": False,
+                "melds": [],
+                "score": 0,
+                "winning_hand": None,
+                "is_waiting": False,
+                "waiting_tiles": (),
+                "counts": [0] * TILE_KINDS,
+                "claim_tiles": frozenset()
+            },
+            {
+                "name": "南家",
+                "type": self.seat_types[2],
+                "hand": [],
+                "discarded": [],
+                "ready": False,
+                "melds": [],
+                "score": 0,
+                "winning_hand": None,
+                "is_waiting": False,
+                "waiting_tiles": (),
+                "counts": [0] * TILE_KINDS,
+                "claim_tiles": frozenset()
+            },
+            {
+                "name": "西家",
+                "type": self.seat_types[3],
+                "hand": [],
+                "discarded": [],
+                "ready": False,
+                "melds": [],
+                "score": 0,
+                "winning_hand": None,
+                "is_waiting": False,
+                "waiting_tiles": (),
+                "counts": [0] * TILE_KINDS,
+                "claim_tiles": frozenset()
+            }
+        ]
+        # 发牌
+        self.deal_tiles()
+        # 设置游戏状态
+        self.game_state = "playing"
+        self.current_player = 0
+        self.waiting_for_action = False
+        self.possible_actions = {}
+        self.action_seat = None
+        self.wall_count = 0
+        self.last_drawn_tile = None
+        self.turn_queue = collections.deque()
+        self.events = []
+        self.action_log = bytearray()
+
+    # 追加一条操作记录：摸牌、出牌、碰、杠、胡、过（杠后补牌是杠的结果，不单独记录）
+    def log_action(self, seat, action, tile_id=None):
+        self.action_log.append(ACTION_CODES[action] << 2 | seat)
+        self.action_log.append(NO_TILE if tile_id is None else tile_id)
+
+    # 记录一个游戏事件，附带服务器时间戳
+    def record_event(self, event_type, player_idx, tile=None, **extra):
+        event = {
+            "seq": len(self.events) + 1,
+            "type": event_type,
+            "player": player_idx,
+            "tile": tile,
+            "time": time.time()
+        }
+        event.update(extra)
+        self.events.append(event)
+        return event
+
+    # 状态版本号：每次改变牌局都会记录一个事件，所以事件数就是版本号
+    @property
+    def version(self):
+        return len(self.events)
+
+    # 获取序号 since 之后的事件，其他玩家摸到的牌不公开
+    def get_events(self, since=0, player_idx=0, wire="verbose"):
+        encode_tile = WIRE_FORMATS[wire][0]
+        result = []
+        for event in self.events[since:]:
+            item = dict(event)
+            tile = event["tile"]
+            if tile is None or (event["type"] == "draw" and event["player"] != player_idx):
+                item["tile"] = None
+            else:
+                item["tile"] = encode_tile(tile)
+            item["time"] = round(event["time"], 3)
+            result.append(item)
+        return result
+
+    def create_tiles(self):
+        self.tiles = []
+        # 筒、条、万，各9种，每种4张
+        for suit in ["筒", "条", "万"]:
+            for value in range(1, 10):
+                for _ in range(4):
+                    self.tiles.append(Tile(suit, value))
+
+        # 风牌：东、南、西、北，每种4张
+        for value in ["东", "南", "西", "北"]:
+            for _ in range(4):
+                self.tiles.append(Tile("风", value))
+
+        # 箭牌：中、发、白，每种4张
+        for value in ["中", "发", "白"]:
+            for _ in range(4):
+                self.tiles.append(Tile("箭", value))
+
+    def shuffle_tiles(self):
+        self.rng.shuffle(self.tiles)
+
+    def deal_tiles(self):
+        # 每个玩家发13张牌
+        for _ in range(13):
+            for player in self.players:
+                tile = self.tiles.pop()
+                player["hand"].append(tile)
+                player["counts"][tile.tile_id] += 1
+
+        # 给每个玩家的手牌排序
+        for player in self.players:
+            self.sort_hand(player["hand"])
+
+        for i in range(len(self.players)):
+            self.update_claim_index(i)
+
+    def sort_hand(self, hand):
+        # 按照牌的类型和数值排序（牌的编号就是排序顺序）
+        hand.sort(key=tile_sort_key)
+
+    # 向听数：0 为听牌，-1 为已经胡牌
+    def get_shanten(self, player_idx):
+        player = self.players[player_idx]
+        return shanten(player["counts"], len(player["melds"]))
+
+    # 更新玩家的听牌状态，在手牌为 3n+1 张时调用
+    def update_waiting(self, player_idx):
+        player = self.players[player_idx]
+        player["waiting_tiles"] = waiting_tiles(player["counts"], len(player["melds"]))
+        player["is_waiting"] = bool(player["waiting_tiles"])
+
+    # 重新计算别人打出哪些牌时可以碰、杠、胡，在手牌为 3n+1 张时调用
+    def update_claim_index(self, player_idx):
+        self.update_waiting(player_idx)
+        player = self.players[player_idx]
+        player["claim_tiles"] = claim_tiles(player["counts"], len(player["melds"]))
+
+    # 检查是否可以碰牌
+    def can_pong(self, player_idx, discarded_tile):
+        return self.players[player_idx]["counts"][discarded_tile.tile_id] >= 2
+
+    # 检查是否可以杠牌
+    def can_kong(self, player_idx, discarded_tile=None):
+        counts = self.players[player_idx]["counts"]
+
+        # 明杠（其他玩家打出的牌）
+        if discarded_tile:
+            return counts[discarded_tile.tile_id] >= 3
+
+        # 暗杠（自己摸到的牌）
+        return 4 in counts
+
+    # 检查是否可以加杠（在碰牌基础上加一张）
+    def can_add_kong(self, player_idx, new_tile):
+        melds = self.players[player_idx]["melds"]
+        for meld in melds:
+            if meld["type"] == "pong":
+                meld_tile = meld["tiles"][0]  # 碰牌组合中的一张牌
+                if meld_tile.tile_id == new_tile.tile_id:
+                    return True
+        return False
+
+    # 检查是否能胡牌
+    @metrics.timed("can_win", ("seat",))
+    def can_win(self, player_idx, tile=None):
+        player = self.players[player_idx]
+        counts = player["counts"]
+
+        # 提取已有的碰、杠组合
+        triplets = len([m for m in player["melds"] if m["type"] in ["pong", "kong"]])
+
+        # 如果指定了牌，临时加到张数向量中检查，检查完再减回去
+        if tile:
+            counts[tile.tile_id] += 1
+            try:
+                return is_winning_counts(counts, triplets)
+            finally:
+                counts[tile.tile_id] -= 1
+
+        # 检查是否符合胡牌条件（基本的4组+1对将），按花色查预生成的牌型表（直接查表比查缓存还快，不经过 HAND_CACHE）
+        return is_winning_counts(counts, triplets)
+
+    # 验证手牌是否符合胡牌规则（递归搜索版本，保留作为查表结果的参照）
+    def is_valid_hand(self, counter, existing_triplets=0):
+        # 总共需要4组+1对将
+        # 已有的碰杠组合 + 手牌中还需要的组合数 = 4
+        remaining_sets_needed = 4 - existing_triplets
+
+        # 尝试找出所有可能的对子（将）
+        pairs = [key for key, count in counter.items() if count >= 2]
+
+        # 对每个可能的对子，检查剩余的牌是否能组成顺子或刻子
+        for pair in pairs:
+            # 创建一个新的计数器副本
+            temp_counter = counter.copy()
+            # 减去一个对子
+            temp_counter[pair] -= 2
+
+            # 如果能用剩余的牌组成所需数量的顺子或刻子
+            if self.can_form_sets(temp_counter, remaining_sets_needed):
+                return True
+
+        return False
+
+    # 检查是否能组成指定数量的顺子或刻子
+    def can_form_sets(self, counter, sets_needed):
+        if sets_needed == 0:
+            # 检查是否所有牌都用完了
+            return all(count == 0 for count in counter.values())
+
+        # 尝试找出刻子（三张相同的牌）
+        for key, count in list(counter.items()):
+            if count >= 3:
+                # 减去一个刻子
+                counter_copy = counter.copy()
+                counter_copy[key] -= 3
+
+                # 递归检查剩余的牌
+                if self.can_form_sets(counter_copy, sets_needed - 1):
+                    return True
+
+        # 尝试找出顺子（三张连续的牌）
+        # 注意：顺子只能在筒、条、万中形成
+        for suit in ["筒", "条", "万"]:
+            for value in range(1, 8):  # 最大是7，因为需要连续3张
+                if all((suit, value + i) in counter and counter[(suit, value + i)] > 0 for i in range(3)):
+                    # 减去一个顺子
+                    counter_copy = counter.copy()
+                    for i in range(3):
+                        counter_copy[(suit, value + i)] -= 1
+
+                    # 递归检查剩余的牌
+                    if self.can_form_sets(counter_copy, sets_needed - 1):
+                        return True
+
+        return False
+
+    # 进行碰牌操作
+    def do_pong(self, player_idx):
+        self.log_action(player_idx, "pong")
+
+        # 从玩家手中移除两张相同的牌
+        hand = self.players[player_idx]["hand"]
+        matching_tiles = [tile for tile in hand if tile.tile_id == self.last_discarded.tile_id]
+
+        # 移除两张牌
+        for i in range(2):
+            hand.remove(matching_tiles[i])
+        self.players[player_idx]["counts"][self.last_discarded.tile_id] -= 2
+
+        # 创建碰牌组合
+        pong_meld = {
+            "type": "pong",
+            "tiles": [matching_tiles[0], matching_tiles[1], self.last_discarded],
+            "from_player": self.current_player
+        }
+
+        # 添加到玩家的组合中
+        self.players[player_idx]["melds"].append(pong_meld)
+        self.record_event("pong", player_idx, self.last_discarded, from_player=self.current_player)
+
+        # 更新游戏状态
+        self.waiting_for_action = False
+        self.current_player = player_idx
+        self.last_discarded = None
+
+        return pong_meld
+
+    # 进行明杠操作（他人打出的牌）
+    def do_kong(self, player_idx):
+        self.log_action(player_idx, "kong")
+
+        # 从玩家手中移除三张相同的牌
+        hand = self.players[player_idx]["hand"]
+        matching_tiles = [tile for tile in hand if tile.tile_id == self.last_discarded.tile_id]
+
+        # 移除三张牌
+        for i in range(3):
+            hand.remove(matching_tiles[i])
+        self.players[player_idx]["counts"][self.last_discarded.tile_id] -= 3
+
+        # 创建杠牌组合
+        kong_meld = {
+            "type": "kong",
+            "tiles": matching_tiles + [self.last_discarded],
+            "from_player": self.current_player,
+            "is_concealed": False  # 明杠
+        }
+
+        # 添加到玩家的组合中
+        self.players[player_idx]["melds"].append(kong_meld)
+        self.record_event("kong", player_idx, self.last_discarded, from_player=self.current_player)
+
+        # 更新游戏状态
+        self.waiting_for_action = False
+        self.current_player = player_idx
+        self.wall_count += 1
+        self.last_discarded = None
+
+        # 补牌（从牌尾摸一张）
+        self.draw_replacement_tile(player_idx)
+
+        return kong_meld
+
+    # 进行暗杠操作（自己手里的四张）
+    def do_concealed_kong(self, player_idx, tile_key):
+        hand = self.players[player_idx]["hand"]
+        tile_id = TILE_IDS.get(tuple(tile_key))
+
+        # 确保有四张
+        if tile_id is None or self.players[player_idx]["counts"][tile_id] != 4:
+            return None
+        self.log_action(player_idx, "concealed_kong", tile_id)
+
+        # 找出四张相同的牌
+        matching_tiles = [tile for tile in hand if tile.tile_id == tile_id]
+
+        # 从手牌中移除
+        for tile in matching_tiles:
+            hand.remove(tile)
+        self.players[player_idx]["counts"][tile_id] = 0
+
+        # 创建暗杠组合
+        kong_meld = {
+            "type": "kong",
+            "tiles": matching_tiles,
+            "from_player": None,
+            "is_concealed": True  # 暗杠
+        }
+
+        # 添加到玩家的组合中
+        self.players[player_idx]["melds"].append(kong_meld)
+        self.record_event("concealed_kong", player_idx, matching_tiles[0])
+
+        # 补牌
+        self.wall_count += 1
+        self.draw_replacement_tile(player_idx)
+
+        return kong_meld
+
+    # 进行加杠操作
+    def do_add_kong(self, player_idx, tile_idx):
+        # 获取要加杠的牌
+        tile = self.players[player_idx]["hand"][tile_idx]
+
+        # 查找对应的碰牌组合
+        for meld in self.players[player_idx]["melds"]:
+            if meld["type"] == "pong" and meld["tiles"][0].tile_id == tile.tile_id:
+                self.log_action(player_idx, "add_kong", tile.tile_id)
+
+                # 从手牌中移除这张牌
+                self.players[player_idx]["hand"].pop(tile_idx)
+                self.players[player_idx]["counts"][tile.tile_id] -= 1
+
+                # 将碰牌组合升级为杠
+                meld["type"] = "kong"
+                meld["tiles"].append(tile)
+                meld["is_concealed"] = False
+                self.record_event("add_kong", player_idx, tile)
+
+                # 补牌
+                self.wall_count += 1
+                self.draw_replacement_tile(player_idx)
+
+                return meld
+
+        return None
+
+    # 补牌（杠后摸牌）
+    def draw_replacement_tile(self, player_idx):
+        if not self.tiles:
+            self.game_state = "draw"
+            self.record_event("exhausted", None)
+            return None
+
+        # 从牌尾摸一张
+        new_tile = self.tiles.pop()
+        self.players[player_idx]["hand"].append(new_tile)
+        self.players[player_idx]["counts"][new_tile.tile_id] += 1
+        self.sort_hand(self.players[player_idx]["hand"])
+        self.record_event("draw", player_idx, new_tile, replacement=True)
+        return new_tile
+
+    # 进行胡牌操作
+    def do_win(self, player_idx):
+        self.log_action(player_idx, "win")
+        player = self.players[player_idx]
+
+        # 如果是自摸
+        if player_idx == self.current_player:
+            # 计算分数
+            score = 10  # 基础分
+            # 加上自摸额外分
+            score += 5
+            # 如果是杠上开花
+            if self.last_action == "kong":
+                score += 5
+
+            player["score"] += score
+            player["winning_hand"] = "自摸"
+
+        # 如果是点炮
+        else:
+            # 计算分数
+            score = 5  # 基础分
+            player["score"] += score
+            player["winning_hand"] = "点炮"
+
+            # 对点炮者减分
+            self.players[self.current_player]["score"] -= score
+
+        # 更新游戏状态
+        self.game_state = "win"
+        self.waiting_for_action = False
+        self.record_event("win", player_idx, None, score=score, winning_hand=player["winning_hand"],
+                          from_player=self.current_player)
+
+        return {"winner": player_idx, "score": score}
+
+    # 检查玩家可执行的操作
+    @metrics.timed("check_player_actions", ("seat",))
+    def check_player_actions(self, player_idx):
+        actions = {}
+
+        # 如果有其他玩家打出的牌
+        if self.last_discarded and self.current_player != player_idx:
+            # 不在索引中的牌一定不能碰、杠、胡
+            if self.last_discarded.tile_id not in self.players[player_idx]["claim_tiles"]:
+                return actions
+
+            # 检查是否可以碰
+            if self.can_pong(player_idx, self.last_discarded):
+                actions["pong"] = True
+
+            # 检查是否可以杠
+            if self.can_kong(player_idx, self.last_discarded):
+                actions["kong"] = True
+
+            # 检查是否可以胡
+            if self.can_win(player_idx, self.last_discarded):
+                actions["win"] = True
+
+        # 如果是玩家自己的回合且刚摸到牌
+        elif self.current_player == player_idx and self.last_drawn_tile:
+            # 检查是否可以暗杠
+            if self.can_kong(player_idx):
+                # 找出可以暗杠的牌
+                counts = self.players[player_idx]["counts"]
+                kong_options = [TILE_KEYS[tile_id] for tile_id, count in enumerate(counts) if count == 4]
+                if kong_options:
+                    actions["concealed_kong"] = kong_options
+
+            # 检查是否可以加杠
+            for i, tile in enumerate(self.players[player_idx]["hand"]):
+                if self.can_add_kong(player_idx, tile):
+                    if "add_kong" not in actions:
+                        actions["add_kong"] = []
+                    actions["add_kong"].append(i)
+
+            # 检查是否可以自摸
+            if self.can_win(player_idx):
+                actions["self_win"] = True
+
+        return actions
+
+    def draw_tile(self, player_idx):
+        self.log_action(player_idx, "draw")
+        if not self.tiles:
+            self.game_state = "draw"
+            self.record_event("exhausted", None)
+            return None
+
+        new_tile = self.tiles.pop()
+        self.players[player_idx]["hand"].append(new_tile)
+        self.players[player_idx]["counts"][new_tile.tile_id] += 1
+        self.sort_hand(self.players[player_idx]["hand"])
+        self.last_drawn_tile = new_tile
+        self.last_action = "draw"
+        self.record_event("draw", player_idx, new_tile)
+
+        # 检查玩家可执行的操作
+        if self.players[player_idx]["type"] == "human":  # 如果是人类玩家
+            self.possible_actions = self.check_player_actions(player_idx)
+            self.action_seat = player_idx
+
+        return new_tile
+
+    def discard_tile(self, player_idx, tile_idx):
+        player = self.players[player_idx]
+        discarded_tile = player["hand"].pop(tile_idx)
+        self.log_action(player_idx, "discard", discarded_tile.tile_id)
+        player["counts"][discarded_tile.tile_id] -= 1
+        player["discarded"].append(discarded_tile)
+        self.update_claim_index(player_idx)
+        self.last_discarded = discarded_tile
+        self.last_drawn_tile = None
+        self.last_action = "discard"
+        self.record_event("discard", player_idx, discarded_tile)
+
+        # 重置可能的操作；其他玩家是否鸣牌由回合调度处理（TURN_CLAIMS）
+        self.possible_actions = {}
+        self.action_seat = None
+
+        return discarded_tile
+
+    # AI对别人打出的牌的决定：胡和杠一定执行，碰按策略决定；鸣牌后排入出牌任务，返回是否鸣牌
+    @metrics.timed("handle_ai_action", ("seat",))
+    def handle_ai_action(self, ai_idx, actions):
+        if "win" in actions:
+            self.do_win(ai_idx)
+            return True
+
+        if "kong" in actions:
+            self.do_kong(ai_idx)
+            self.schedule(TURN_DISCARD, ai_idx)
+            return True
+
+        if "pong" in actions and self.ai_should_pong(ai_idx):
+            self.do_pong(ai_idx)
+            self.schedule(TURN_DISCARD, ai_idx)
+            return True
+
+        return False
+
+    def ai_should_pong(self, ai_idx):
+        if self.ai_strength == "monte_carlo":
+            return self.monte_carlo_should_pong(ai_idx)
+
+        # 简单策略：70%概率碰牌
+        return self.rng.random() < 0.7
+
+    # 看不到的牌（牌墙和其他玩家的手牌）：每种4张减去自己的手牌、所有弃牌和组合牌
+    def unseen_tiles(self, player_idx):
+        seen = list(self.players[player_idx]["counts"])
+        for player in self.players:
+            for tile in player["discarded"]:
+                seen[tile.tile_id] += 1
+            for meld in player["melds"]:
+                for tile in meld["tiles"]:
+                    seen[tile.tile_id] += 1
+                # 碰、明杠的那张牌同时留在打出者的弃牌中，不重复计算
+                if meld["from_player"] is not None:
+                    seen[meld["tiles"][0].tile_id] -= 1
+
+        unseen = []
+        for tile_id, count in enumerate(seen):
+            unseen.extend([tile_id] * max(4 - count, 0))
+        return unseen
+
+    # 模拟估计每个候选（打牌或碰牌之后的手牌）的胡牌率，在时间预算内没有结果时返回 None
+    def estimate_win_rates(self, player_idx, options):
+        return monte_carlo.estimate_win_rates(
+            options, self.unseen_tiles(player_idx), len(self.tiles),
+            self.rng.randrange(1 << 30), self.ai_budget, self.ai_rollouts)
+
+    # 候选牌中模拟胡牌率最高的一张（返回手牌中的位置），候选只有一种牌或超时时返回 None
+    def monte_carlo_discard(self, ai_idx, tile_values):
+        hand = self.players[ai_idx]["hand"]
+        counts = self.players[ai_idx]["counts"]
+        melds = len(self.players[ai_idx]["melds"])
+
+        # 每种牌只模拟一次，同一种牌里取价值最低的位置
+        candidates = {}
+        for i, value in tile_values.items():
+            tile_id = hand[i].tile_id
+            if tile_id not in candidates or value < tile_values[candidates[tile_id]]:
+                candidates[tile_id] = i
+        if len(candidates) < 2:
+            return None
+
+        options = []
+        for tile_id in candidates:
+            after = list(counts)
+            after[tile_id] -= 1
+            options.append((after, melds))
+
+        rates = self.estimate_win_rates(ai_idx, options)
+        if rates is None:
+            return None
+
+        # 胡牌率相同时选价值低的
+        best = max(zip(rates, candidates.values()), key=lambda item: (item[0], -tile_values[item[1]]))
+        return best[1]
+
+    # 比较"不碰"和"碰后打出各张牌"的模拟胡牌率
+    def monte_carlo_should_pong(self, ai_idx):
+        counts = self.players[ai_idx]["counts"]
+        melds = len(self.players[ai_idx]["melds"])
+        tile_id = self.last_discarded.tile_id
+
+        after_pong = list(counts)
+        after_pong[tile_id] -= 2
+        options = [(list(counts), melds)]
+        for discard_id, count in enumerate(after_pong):
+            if count:
+                option = list(after_pong)
+                option[discard_id] -= 1
+                options.append((option, melds + 1))
+
+        rates = self.estimate_win_rates(ai_idx, options)
+        if rates is None:
+            return self.rng.random() < 0.7
+        return max(rates[1:]) > rates[0]
+
+    # AI摸牌之后的操作（TURN_ACT）：自摸、暗杠、加杠或出牌
+    @metrics.timed("ai_play", ("seat",))
+    def ai_play(self, player_idx):
+        actions = self.check_player_actions(player_idx)
+
+        # 处理自摸、暗杠等操作
+        if "self_win" in actions:
+            self.do_win(player_idx)
+            return
+
+        if "concealed_kong" in actions:
+            # 70%概率进行暗杠
+            if self.rng.random() < 0.7:
+                self.do_concealed_kong(player_idx, actions["concealed_kong"][0])
+                # 杠后出牌
+                self.schedule(TURN_DISCARD, player_idx)
+                return
+
+        if "add_kong" in actions:
+            # 80%概率进行加杠
+            if self.rng.random() < 0.8:
+                self.do_add_kong(player_idx, actions["add_kong"][0])
+                # 杠后出牌
+                self.schedule(TURN_DISCARD, player_idx)
+                return
+
+        # 正常出牌
+        self.ai_discard(player_idx)
+
+    # AI出牌，之后由其他座位决定是否鸣牌
+    @metrics.timed("ai_discard", ("seat",))
+    def ai_discard(self, ai_idx):
+        discard_idx = self.ai_choose_discard(ai_idx)
+        if discard_idx is None:
+            return None
+
+        tile = self.discard_tile(ai_idx, discard_idx)
+        self.schedule(TURN_CLAIMS, ai_idx)
+        return tile
+
+    # 选择要打出的牌（只计算，不改变牌局）
+    def ai_choose_discard(self, ai_idx):
+        # 改进的AI出牌策略
+        hand = self.players[ai_idx]["hand"]
+        if not hand:
+            return None
+
+        # 每种牌的数量（增量维护的张数向量）
+        counts = self.players[ai_idx]["counts"]
+        melds = len(self.players[ai_idx]["melds"])
+
+        # 先算出打出每种牌之后的向听数，只在向听数最小的牌里挑选
+        shanten_after = {}
+        for tile in hand:
+            if tile.tile_id not in shanten_after:
+                counts[tile.tile_id] -= 1
+                shanten_after[tile.tile_id] = shanten(counts, melds)
+                counts[tile.tile_id] += 1
+        best_shanten = min(shanten_after.values())
+
+        # 计算每张牌的价值
+        tile_values = {}
+        for i, tile in enumerate(hand):
+            if shanten_after[tile.tile_id] != best_shanten:
+                continue
+
+            count = counts[tile.tile_id]
+
+            # 初始值
+            value = 0
+
+            # 成对/成组的牌更有价值
+            if count == 2 or count == 3:
+                value += 5 * count
+
+            # 连续的牌更有价值（仅适用于筒、条、万）
+            if tile.tile_id < HONOR_START:
+                # 检查相邻的牌
+                for offset in [-2, -1, 1, 2]:
+                    if 1 <= tile.value + offset <= 9 and counts[tile.tile_id + offset]:
+                        # 相邻牌价值更高
+                        if abs(offset) == 1:
+                            value += 3
+                        else:
+                            value += 1
+
+            # 字牌、箭牌单独算价值
+            if tile.tile_id >= HONOR_START:
+                if count == 1:  # 单张字牌价值低
+                    value -= 2
+                else:  # 多张字牌价值高
+                    value += 3 * count
+
+            tile_values[i] = value
+
+        # 蒙特卡洛模式：在这些候选中选模拟胡牌率最高的
+        if self.ai_strength == "monte_carlo":
+            choice = self.monte_carlo_discard(ai_idx, tile_values)
+            if choice is not None:
+                return choice
+
+        # 选择价值最低的牌丢弃
+        return min(tile_values, key=tile_values.get)
+
+    # ---- 回合调度 ----
+    # 人类玩家的操作和AI的每个操作都会在 turn_queue 中排入下一个任务（出牌后是鸣牌，没人鸣牌时是下家摸牌……），
+    # advance 每次取出一个任务执行一个操作，直到需要人类玩家操作、游戏结束或达到上限；整个过程没有递归
+
+    def schedule(self, kind, seat, passed=0):
+        self.turn_queue.append((kind, seat, passed))
+
+    # 有待执行的回合任务；等待人类玩家决定是否鸣牌时不算（任务留在队列中，玩家选择"过"之后继续）
+    @property
+    def pending_turn(self):
+        return bool(self.turn_queue) and not self.waiting_for_action
+
+    # 正在等待操作的人类座位（决定是否鸣牌，或者轮到自己摸牌、出牌），没有时为 None
+    @property
+    def awaited_seat(self):
+        if self.game_state != "playing" or self.pending_turn:
+            return None
+        if self.waiting_for_action:
+            return self.action_seat
+        if self.players[self.current_player]["type"] == "human":
+            return self.current_player
+        return None
+
+    # 人类玩家超时时代为选择的操作：能胡就胡，放弃鸣牌；轮到自己时摸牌，再按AI的策略出牌（不杠）
+    def timeout_action(self, seat):
+        actions = self.legal_actions(seat)
+        for action in (("win", None), ("self_win", None), ("draw", None), ("pass", None)):
+            if action in actions:
+                return action
+        action = ("discard", self.ai_choose_discard(seat))
+        if action in actions:
+            return action
+        return next((action for action in actions if action[0] == "discard"), None)
+
+    def run_task(self, task):
+        kind, seat, passed = task
+        if kind == TURN_CLAIMS:
+            self.resolve_claims(seat, passed)
+            return
+
+        self.current_player = seat
+        if self.players[seat]["type"] != "ai":
+            # 轮到人类玩家：等待玩家自己摸牌
+            return
+        if kind == TURN_DRAW:
+            if self.draw_tile(seat) and self.game_state == "playing":
+                self.schedule(TURN_ACT, seat)
+        elif kind == TURN_ACT:
+            self.ai_play(seat)
+        else:
+            self.ai_discard(seat)
+
+    # discarder 打出的牌：其他座位按 CLAIM_PRIORITY 依次决定是否鸣牌，passed 为已经放弃的座位
+    # 轮到人类玩家时停下等待（任务放回队列头部）；AI鸣牌后由它出牌；都不鸣牌时轮到下家摸牌
+    def resolve_claims(self, discarder, passed):
+        claims = []
+        for offset in (1, 2, 3):
+            seat = (discarder + offset) % 4
+            if passed >> seat & 1 or self.players[seat]["type"] not in ("human", "ai"):
+                continue
+            actions = self.check_player_actions(seat)
+            for priority, name in enumerate(CLAIM_PRIORITY):
+                if name in actions:
+                    claims.append((priority, offset, seat, actions))
+                    break
+        claims.sort(key=lambda claim: claim[:2])
+
+        for _, _, seat, actions in claims:
+            if self.players[seat]["type"] == "human":
+                self.waiting_for_action = True
+                self.possible_actions = actions
+                self.action_seat = seat
+                self.turn_queue.appendleft((TURN_CLAIMS, discarder, passed))
+                return
+            if self.handle_ai_action(seat, actions):
+                return
+            passed |= 1 << seat
+
+        self.schedule(TURN_DRAW, (discarder + 1) % 4)
+
+    # 按操作记录推出接下来的回合任务（恢复第1版的休眠数据时使用，重放不会排入任务；新的数据中保存了回合任务）
+    # 只有AI放弃碰牌没有记录，恢复后这张牌会重新决定
+    def restore_turn_queue(self):
+        self.turn_queue.clear()
+        if self.game_state != "playing":
+            return
+
+        log = self.action_log
+        if not log:
+            if self.players[self.current_player]["type"] == "ai":
+                self.schedule(TURN_DRAW, self.current_player)
+            return
+
+        # 最后一张弃牌之后选择"过"的人类玩家
+        passed = 0
+        for i in range(len(log) - 2, -1, -2):
+            seat = log[i] & 3
+            action = ACTION_NAMES[log[i] >> 2]
+            if action != "pass":
+                break
+            passed |= 1 << seat
+
+        if action == "discard":
+            self.schedule(TURN_CLAIMS, seat, passed)
+        elif self.players[seat]["type"] == "ai":
+            self.schedule(TURN_ACT if action == "draw" else TURN_DISCARD, seat)
+
+    # 重新开始一局，seed 相同则牌序和AI决策完全相同，为 None 时随机生成新的种子
+    def reset(self, seed=None):
+        self.seed = new_seed() if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.initialize_game()
+
+        # 庄家是AI时直接开始行动
+        if self.players[self.current_player]["type"] == "ai":
+            self.schedule(TURN_DRAW, self.current_player)
+            self.advance()
+
+        return self.get_events(0, None)
+
+    # 某个座位当前可以执行的操作，每个操作是 (名称, 参数) 元组
+    def legal_actions(self, seat):
+        if self.game_state != "playing":
+            return []
+
+        # 等待人类玩家对弃牌做出选择（胡、杠、碰或过）
+        if self.waiting_for_action:
+            if seat != self.action_seat:
+                return []
+            actions = [(name, None) for name in ("win", "kong", "pong") if name in self.possible_actions]
+            actions.append(("pass", None))
+            return actions
+
+        # 还没轮到下家行动时谁都不能操作
+        if self.pending_turn or seat != self.current_player:
+            return []
+
+        hand = self.players[seat]["hand"]
+
+        # 手牌数为 3n+1 时需要先摸牌
+        if len(hand) % 3 == 1:
+            return [("draw", None)]
+
+        actions = []
+        options = self.check_player_actions(seat)
+        if "self_win" in options:
+            actions.append(("self_win", None))
+        for tile_key in options.get("concealed_kong", []):
+            actions.append(("concealed_kong", TILE_IDS[tile_key]))
+        for tile_idx in options.get("add_kong", []):
+            actions.append(("add_kong", tile_idx))
+        actions.extend(("discard", tile_idx) for tile_idx in range(len(hand)))
+        return actions
+
+    # 执行一个操作，然后让AI玩家继续行动，返回这一步产生的事件
+    # auto_advance 为 False 时只执行这个操作，AI的行动留给之后调用 advance（例如在后台线程中）
+    # time_limit 为这次AI行动的时间上限（秒），超过后剩下的回合留在队列中（pending_turn 为真）
+    def step(self, seat, action, auto_advance=True, time_limit=None):
+        if action not in self.legal_actions(seat):
+            raise ValueError(f"座位 {seat} 不能执行操作 {action}")
+
+        name, arg = action
+        since = len(self.events)
+
+        if name == "draw":
+            self.draw_tile(seat)
+        elif name == "discard":
+            self.discard_tile(seat, arg)
+            self.schedule(TURN_CLAIMS, seat)
+        elif name == "pass":
+            self.waiting_for_action = False
+            self.possible_actions = {}
+            self.action_seat = None
+            self.log_action(seat, "pass")
+            self.record_event("pass", seat)
+            # 继续处理这张牌：其他座位按优先级决定是否鸣牌
+            kind, discarder, passed = self.turn_queue.popleft()
+            self.turn_queue.appendleft((kind, discarder, passed | 1 << seat))
+        else:
+            if self.waiting_for_action:
+                # 鸣牌：这张牌不再给其他座位
+                self.waiting_for_action = False
+                self.turn_queue.clear()
+            self.possible_actions = {}
+            self.action_seat = None
+            if name == "pong":
+                self.do_pong(seat)
+            elif name == "kong":
+                self.do_kong(seat)
+            elif name == "concealed_kong":
+                self.do_concealed_kong(seat, TILE_KEYS[arg])
+            elif name == "add_kong":
+                self.do_add_kong(seat, arg)
+            else:  # win / self_win
+                self.do_win(seat)
+
+        if auto_advance:
+            self.advance(time_limit=time_limit)
+        return self.get_events(since, seat)
+
+    # 依次执行排队的回合任务（AI会一直打到需要人类玩家操作为止），每个任务执行一个操作
+    # max_actions 为最多执行的任务数，time_limit 为时间上限（秒），至少执行一个任务；返回是否还有待执行的回合
+    def advance(self, max_actions=None, time_limit=None):
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+        done = 0
+        while self.pending_turn and self.game_state == "playing":
+            if done and ((max_actions is not None and done >= max_actions)
+                         or (deadline is not None and time.perf_counter() >= deadline)):
+                break
+            self.run_task(self.turn_queue.popleft())
+            done += 1
+
+        if self.game_state != "playing":
+            self.turn_queue.clear()
+        return self.pending_turn
+
+    # 增量状态：版本 since 之后的事件，加上无法从事件推出的字段（自己的手牌、可执行的操作等）
+    # 客户端的版本号不合法（例如开了新的一局）时返回 None，需要发送完整状态
+    # wire 为线路格式（见 WIRE_FORMATS）
+    @metrics.timed("get_state_delta", ("since",))
+    def get_state_delta(self, since, player_idx=0, wire="verbose"):
+        if not isinstance(since, int) or since < 0 or since > self.version:
+            return None
+
+        encode_tile, encode_tiles, encode_tile_ids = WIRE_FORMATS[wire]
+        player = self.players[player_idx]
+        return {
+            "version": self.version,
+            "events": self.get_events(since, player_idx, wire),
+            "patch": {
+                "game_state": self.game_state,
+                "current_player": self.current_player,
+                "player_hand": encode_tiles(player["hand"]),
+                "player_shanten": self.get_shanten(player_idx),
+                "player_is_waiting": player["is_waiting"],
+                "player_waiting_tiles": encode_tile_ids(player["waiting_tiles"]),
+                "tiles_left": len(self.tiles),
+                "last_discarded": encode_tile(self.last_discarded) if self.last_discarded else None,
+                "possible_actions": self.possible_actions if player_idx == self.action_seat else {},
+                "waiting_for_action": self.waiting_for_action and player_idx == self.action_seat,
+                "awaited_seat": self.awaited_seat,
+                "pending_turn": self.pending_turn
+            }
+        }
+
+    @metrics.timed("get_game_state", ("seat",))
+    def get_game_state(self, player_idx=0, wire="verbose"):
+        encode_tile, encode_tiles, encode_tile_ids = WIRE_FORMATS[wire]
+        return {
+            "version": self.version,
+            "player_idx": player_idx,
+            "game_state": self.game_state,
+            "current_player": self.current_player,
+            "player_hand": encode_tiles(self.players[player_idx]["hand"]),
+            "player_discarded": encode_tiles(self.players[player_idx]["discarded"]),
+            "player_melds": [meld_to_wire(meld, wire) for meld in self.players[player_idx]["melds"]],
+            "player_score": self.players[player_idx]["score"],
+            "player_shanten": self.get_shanten(player_idx),
+            "player_is_waiting": self.players[player_idx]["is_waiting"],
+            "player_waiting_tiles": encode_tile_ids(self.players[player_idx]["waiting_tiles"]),
+            "player_winning_hand": self.players[player_idx]["winning_hand"],
+            "opponents": [
+                {
+                    "name": player["name"],
+                    "discarded": encode_tiles(player["discarded"]),
+                    "hand_count": len(player["hand"]),
+                    "melds": [meld_to_wire(meld, wire) for meld in player["melds"]],
+                    "score": player["score"],
+                    "winning_hand": player["winning_hand"]
+                } for i, player in enumerate(self.players) if i != player_idx
+            ],
+            "tiles_left": len(self.tiles),
+            "last_discarded": encode_tile(self.last_discarded) if self.last_discarded else None,
+            "possible_actions": self.possible_actions if player_idx == self.action_seat else {},
+            "waiting_for_action": self.waiting_for_action and player_idx == self.action_seat,
+            "awaited_seat": self.awaited_seat,
+            "pending_turn": self.pending_turn
+        }
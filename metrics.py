@@ -0,0 +1,228 @@
+import bisect
+import functools
+import threading
+import time
+
+import tracing
+
+# 进程内的运行指标：计数器、直方图和抓取时才计算的数值，按 Prometheus 文本格式输出（GET /metrics）
+# 记录一次只是一次二分查找和几次加法；格式化和累加只在被抓取时进行
+# 记录时不加锁（加锁比记录本身慢一倍）：依赖 GIL，极少数情况下两个线程同时记录可能少算一次，对监控没有影响
+
+# 直方图默认的分桶上界（秒）
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # 标签值 -> 计数
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        values = sorted(self.values.items())
+        return [f"{self.name}{_label_text(self.labelnames, labels)} {_number(value)}" for labels, value in values]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}  # 标签值 -> [每个桶的次数（不累加，最后一个为 +Inf）..., 总和]
+        self.lock = threading.Lock()
+
+    # 一组标签值对应的数据，频繁记录时预先取出，省去每次查字典
+    def labels(self, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            with self.lock:
+                series = self.series.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+        return series
+
+    def observe(self, value, *labels):
+        self.observe_series(self.labels(*labels), value)
+
+    def observe_series(self, series, value):
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    # 计时的上下文管理器
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        with self.lock:
+            series = sorted((labels, list(values)) for labels, values in list(self.series.items()))
+        lines = []
+        for labels, values in series:
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                total += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {total}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {_number(values[-1])}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {total}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+# 抓取时才调用 func 计算的数值，func 返回 {标签值: 数值}（没有标签时键为空元组）
+# 数值是其他地方维护的累计次数时 kind 为 counter
+class Gauge:
+    def __init__(self, name, help_text, func, labelnames=(), kind="gauge"):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        return [f"{self.name}{_label_text(self.labelnames, labels)} {_number(value)}"
+                for labels, value in sorted(self.func().items())]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    # 同名的指标只登记一次（模块被重新导入时返回已有的指标）
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def unregister(self, name):
+        with self.lock:
+            self.metrics.pop(name, None)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name, help_text, labelnames=()):
+    return REGISTRY.register(Counter(name, help_text, labelnames))
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help_text, labelnames, buckets))
+
+
+def gauge(name, help_text, func, labelnames=(), kind="gauge"):
+    REGISTRY.unregister(name)
+    return REGISTRY.register(Gauge(name, help_text, func, labelnames, kind))
+
+
+# 游戏引擎各阶段的耗时（包含其中调用的其他阶段，例如 ai_play 包含 ai_discard）
+ENGINE_PHASES = histogram("mahjong_engine_phase_seconds", "Time spent in game engine phases (inclusive)", ("phase",))
+
+# 引擎计时模式：scrape 为最近 ENGINE_TIMING_WINDOW 秒内被抓取过才计时，always 为一直计时，off 为不计时
+# 不计时的时候每次调用只多一次判断
+ENGINE_TIMING_MODES = ("scrape", "always", "off")
+ENGINE_TIMING_WINDOW = 600
+
+_engine_timing_mode = "scrape"
+_engine_timing = False
+_last_scrape = None
+
+
+def set_engine_timing(mode):
+    global _engine_timing_mode, _engine_timing
+    if mode not in ENGINE_TIMING_MODES:
+        raise ValueError(f"未知的计时模式: {mode}")
+    _engine_timing_mode = mode
+    _engine_timing = mode == "always"
+
+
+# 被抓取时调用：scrape 模式下开始（继续）计时
+def scraped():
+    global _engine_timing, _last_scrape
+    _last_scrape = time.monotonic()
+    if _engine_timing_mode == "scrape":
+        _engine_timing = True
+
+
+# 定期调用（例如每个请求开始时）：scrape 模式下超过 ENGINE_TIMING_WINDOW 秒没有被抓取就停止计时
+def expire_engine_timing():
+    global _engine_timing
+    if _engine_timing and _engine_timing_mode == "scrape" and time.monotonic() - _last_scrape > ENGINE_TIMING_WINDOW:
+        _engine_timing = False
+
+
+# 方法装饰器：计时时把每次调用的耗时记入 ENGINE_PHASES，当前线程在记录时间线时（见 tracing.py）同时记入时间线
+# trace_args 为 self 之后的位置参数的名字，记录时间线时作为这个阶段的附加信息（例如座位）
+def timed(phase, trace_args=()):
+    def decorator(func):
+        series = ENGINE_PHASES.labels(phase)
+        observe = ENGINE_PHASES.observe_series
+        clock = time.perf_counter
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _engine_timing and not tracing.active:
+                return func(*args, **kwargs)
+            trace = tracing.current()
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end = clock()
+                if _engine_timing:
+                    observe(series, end - start)
+                if trace is not None:
+                    trace.add(phase, start, end, dict(zip(trace_args, args[1:])) if trace_args else None)
+        return wrapper
+    return decorator
@@ -0,0 +1,146 @@
+import concurrent.futures
+import multiprocessing
+import os
+import random
+import time
+
+from hand_tables import TILE_KINDS, shanten, waiting_tiles
+
+# 蒙特卡洛AI：对每个候选（打哪张牌、碰不碰）随机模拟剩下的牌局，选胡牌率最高的
+# 模拟在进程池中并行执行，每一步的总耗时不超过时间预算
+
+# 工作进程数，0 表示在当前线程中模拟
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+# 工作进程在截止时间前留出的余量（占预算的比例），用于把结果传回主进程
+RESULT_MARGIN = 0.2
+
+_executor = None
+_workers = DEFAULT_WORKERS
+
+
+# 设置进程池大小（在第一次使用前调用），workers=0 时不使用进程池
+def configure(workers):
+    global _workers
+    shutdown()
+    _workers = workers
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+# 用 spawn 启动工作进程：Web 服务器是多线程的，fork 之后子进程可能继承被占用的锁
+def get_executor():
+    global _executor
+    if _executor is None and _workers > 0:
+        _executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=_workers, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+# 预先启动工作进程，避免第一步AI因为进程还没启动而只能用普通策略
+def warm_up():
+    executor = get_executor()
+    if executor is not None:
+        concurrent.futures.wait([executor.submit(time.time) for _ in range(_workers)])
+
+
+# 模拟一次：剩余的牌随机排列成牌墙，对手三家各摸一张直接打出（可以点炮），自己摸牌后按向听数最小打出
+# 在牌墙摸完之前胡牌返回 True。counts 为自己 3n+1 张手牌的张数，unseen 为看不到的牌（编号列表，会被打乱）
+def rollout(counts, melds, unseen, wall_size, rng):
+    hand = list(counts)
+    waits = waiting_tiles(hand, melds)
+    current = shanten(hand, melds)
+    size = len(unseen)
+
+    for pos in range(min(wall_size, size)):
+        # 边摸边洗：从剩下的牌中随机取一张
+        j = rng.randrange(pos, size)
+        unseen[pos], unseen[j] = unseen[j], unseen[pos]
+        tile = unseen[pos]
+
+        if tile in waits:
+            return True
+
+        # 每4张牌中只有1张是自己摸的
+        if pos % 4 != 3:
+            continue
+
+        # 保留摸到的牌能让向听数变小时，打出其他牌中的一张
+        # 14张的向听数不大于打出任何一张后的向听数，不比现在小时直接打出摸到的牌
+        hand[tile] += 1
+        target = shanten(hand, melds)
+        discard = tile
+        if target < current:
+            for tile_id in range(TILE_KINDS):
+                if hand[tile_id] and tile_id != tile:
+                    hand[tile_id] -= 1
+                    value = shanten(hand, melds)
+                    hand[tile_id] += 1
+                    if value == target:
+                        discard, current = tile_id, value
+                        break
+        hand[discard] -= 1
+        if discard != tile:
+            waits = waiting_tiles(hand, melds)
+
+    return False
+
+
+# 在截止时间（time.time()）前轮流模拟每个候选，返回每个候选的 (胡牌次数, 模拟次数)
+# 同一轮中所有候选使用相同的牌墙，比较的是打法而不是运气
+def run_rollouts(options, unseen, wall_size, seed, deadline, max_rollouts=None):
+    rng = random.Random(seed)
+    wins = [0] * len(options)
+    runs = [0] * len(options)
+    total = 0
+
+    while max_rollouts is None or total < max_rollouts:
+        wall_seed = rng.getrandbits(32)
+        for i, (counts, melds) in enumerate(options):
+            if time.time() >= deadline:
+                return wins, runs
+            wins[i] += rollout(counts, melds, list(unseen), wall_size, random.Random(wall_seed))
+            runs[i] += 1
+        total += 1
+
+    return wins, runs
+
+
+# 估计每个候选的胡牌率，options 为 [(张数向量, 已有组合数), ...]
+# budget 为总时间（秒），超时的工作进程结果直接丢弃；一次模拟都没有完成时返回 None
+def estimate_win_rates(options, unseen, wall_size, seed, budget, max_rollouts=None):
+    start = time.time()
+    deadline = start + budget
+    worker_deadline = start + budget * (1 - RESULT_MARGIN)
+    options = [(list(counts), melds) for counts, melds in options]
+
+    executor = get_executor()
+    if executor is None:
+        results = [run_rollouts(options, unseen, wall_size, seed, worker_deadline, max_rollouts)]
+    else:
+        per_worker = None if max_rollouts is None else -(-max_rollouts // _workers)
+        try:
+            futures = [
+                executor.submit(run_rollouts, options, unseen, wall_size, seed + i, worker_deadline, per_worker)
+                for i in range(_workers)
+            ]
+        except concurrent.futures.process.BrokenProcessPool:
+            # 工作进程异常退出：丢弃进程池，下次使用时重新创建
+            shutdown()
+            return None
+
+        done, not_done = concurrent.futures.wait(futures, timeout=max(0, deadline - time.time()))
+        for future in not_done:
+            future.cancel()
+        results = [future.result() for future in done if not future.cancelled() and future.exception() is None]
+
+    wins = [sum(result[0][i] for result in results) for i in range(len(options))]
+    runs = [sum(result[1][i] for result in results) for i in range(len(options))]
+    if not all(runs):
+        return None
+    return [w / n for w, n in zip(wins, runs)]
@@ -0,0 +1,116 @@
+import cProfile
+import hashlib
+import io
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+# 线上请求的采样分析：按比例（或者带调试请求头的请求）用 cProfile 分析整个请求，结果写入本地目录，
+# 文件名中带有时间、路由、游戏ID的散列值和耗时，只保留最近的若干个；可以用 pstats、snakeviz 等工具打开
+# 持有游戏ID就能操作这局游戏，所以文件名和列表中只有散列值（用 game_hash 计算后对照）
+# 同一时间只分析一个请求（Python 3.12 起 cProfile 全进程只能有一个在运行），其他请求照常处理
+
+PROFILE_SUFFIX = ".prof"
+# 时间（毫秒）.路由.游戏ID的散列值.耗时（微秒）us.prof
+_FILE_NAME = re.compile(r"^(\d+)\.(\w+)\.(\w+)\.(\d+)us\.prof$")
+
+
+def _tag(value):
+    value = re.sub(r"\W", "", str(value or ""))[:32]
+    return value or "none"
+
+
+# 游戏ID的散列值（12位十六进制），没有游戏时为 "none"
+def game_hash(game_id):
+    if not game_id:
+        return "none"
+    return hashlib.sha256(str(game_id).encode()).hexdigest()[:12]
+
+
+class RequestProfiler:
+    def __init__(self, directory, sample_rate=0.0, keep=200):
+        self.directory = directory
+        self.sample_rate = sample_rate  # 采样的比例，0 表示只分析带调试请求头的请求
+        self.keep = keep  # 最多保留的文件数，超过后删除最早的
+        self.lock = threading.Lock()  # 正在分析的请求持有
+        self.profiled = 0
+        self.skipped = 0  # 选中了但已经有请求在分析而跳过的次数
+        os.makedirs(directory, exist_ok=True)
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    # 开始分析当前线程，已经有请求在分析时返回 None
+    def start(self):
+        if not self.lock.acquire(blocking=False):
+            self.skipped += 1
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 其他分析工具正在运行
+            self.lock.release()
+            self.skipped += 1
+            return None
+        return profile, time.perf_counter()
+
+    # 结束分析并写入文件，返回文件名
+    def finish(self, token, route, game_id):
+        profile, start = token
+        try:
+            profile.disable()
+            duration = time.perf_counter() - start
+        finally:
+            self.lock.release()
+
+        name = f"{int(time.time() * 1000)}.{_tag(route)}.{game_hash(game_id)}.{round(duration * 1e6)}us{PROFILE_SUFFIX}"
+        profile.dump_stats(os.path.join(self.directory, name))
+        self.profiled += 1
+        self.rotate()
+        return name
+
+    def files(self):
+        result = []
+        for name in os.listdir(self.directory):
+            match = _FILE_NAME.match(name)
+            if match:
+                timestamp, route, game, duration = match.groups()
+                result.append({
+                    "file": name,
+                    "time": int(timestamp) / 1000,
+                    "route": route,
+                    "game_hash": None if game == "none" else game,
+                    "duration_ms": int(duration) / 1000
+                })
+        return result
+
+    # 只保留最近的 keep 个文件
+    def rotate(self):
+        files = sorted(self.files(), key=lambda item: item["time"])
+        for item in files[:max(len(files) - self.keep, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, item["file"]))
+            except FileNotFoundError:
+                pass
+
+    # 保留的文件中耗时最长的 limit 个
+    def slowest(self, limit=20):
+        return sorted(self.files(), key=lambda item: item["duration_ms"], reverse=True)[:limit]
+
+    # 文件的完整路径，文件名不合法或不存在时返回 None
+    def path(self, name):
+        if not _FILE_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.exists(path) else None
+
+    # 文本形式的统计：按累计耗时排序的前 limit 个函数
+    def summary(self, name, limit=40, sort="cumulative"):
+        out = io.StringIO()
+        stats = pstats.Stats(self.path(name), stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
@@ -0,0 +1,127 @@
+import argparse
+import base64
+import json
+import sys
+import time
+
+from hand_tables import TILE_KEYS
+from mahjong import ACTION_NAMES, NO_TILE, MahjongGame
+
+# 牌局记录：种子 + 每个座位的类型 + 操作记录（每步2字节，base64 编码）
+# 重放时按种子重新洗牌，再依次执行记录中的操作，不运行AI，所以与AI强度和耗时无关
+
+LOG_VERSION = 1
+
+# 重放时AI座位的类型：不自动行动，也不等待玩家操作
+REPLAY_SEAT = "replay"
+
+
+# 导出一局游戏的记录
+def dump_log(game):
+    return {
+        "version": LOG_VERSION,
+        "seed": game.seed,
+        "seat_types": list(game.seat_types),
+        "actions": base64.b64encode(bytes(game.action_log)).decode("ascii")
+    }
+
+
+# 解码操作记录，返回 [(座位, 操作名, 牌的编号或 None), ...]
+def decode_actions(log):
+    return decode_action_bytes(base64.b64decode(log["actions"]))
+
+
+def decode_action_bytes(data):
+    actions = []
+    for i in range(0, len(data), 2):
+        code, tile_id = data[i], data[i + 1]
+        actions.append((code & 3, ACTION_NAMES[code >> 2], None if tile_id == NO_TILE else tile_id))
+    return actions
+
+
+def _tile_index(hand, tile_id):
+    return next(i for i, tile in enumerate(hand) if tile.tile_id == tile_id)
+
+
+# 在重放的牌局上执行一条记录
+def apply_action(game, seat, action, tile_id):
+    if action not in ("draw", "discard"):
+        # 与 MahjongGame.step 一样先清除等待的操作（包括摸牌后可以自摸、杠的提示）
+        game.waiting_for_action = False
+        game.possible_actions = {}
+        game.action_seat = None
+
+    if action == "draw":
+        game.current_player = seat
+        game.draw_tile(seat)
+    elif action == "discard":
+        game.discard_tile(seat, _tile_index(game.players[seat]["hand"], tile_id))
+    elif action == "pong":
+        game.do_pong(seat)
+    elif action == "kong":
+        game.do_kong(seat)
+    elif action == "concealed_kong":
+        game.do_concealed_kong(seat, TILE_KEYS[tile_id])
+    elif action == "add_kong":
+        game.do_add_kong(seat, _tile_index(game.players[seat]["hand"], tile_id))
+    elif action == "win":
+        game.do_win(seat)
+    elif action == "pass":
+        game.log_action(seat, "pass")
+        game.record_event("pass", seat)
+    else:
+        raise ValueError(f"未知的操作: {action}")
+
+
+# 重建执行了前 upto 条操作后的牌局（None 表示全部）
+def replay(log, upto=None):
+    if log.get("version") != LOG_VERSION:
+        raise ValueError(f"不支持的记录版本: {log.get('version')}")
+    return replay_actions(log["seed"], log["seat_types"], base64.b64decode(log["actions"]), upto)
+
+
+# 按种子重新发牌，再执行操作记录（原始的字节）
+def replay_actions(seed, seat_types, action_log, upto=None):
+    seat_types = [seat if seat == "human" else REPLAY_SEAT for seat in seat_types]
+    game = MahjongGame(seed=seed, seat_types=seat_types)
+    for seat, action, tile_id in decode_action_bytes(action_log)[:upto]:
+        apply_action(game, seat, action, tile_id)
+    return game
+
+
+# 一局游戏的简要情况：每家的手牌、组合和分数
+def describe(game):
+    lines = [f"状态: {game.game_state}  当前玩家: {game.current_player}  剩余: {len(game.tiles)}  版本: {game.version}"]
+    for i, player in enumerate(game.players):
+        hand = " ".join(str(tile) for tile in player["hand"])
+        melds = " ".join("".join(str(tile) for tile in meld["tiles"]) for meld in player["melds"])
+        lines.append(f"{i} {player['name']} 分数 {player['score']:>3}  手牌: {hand}" + (f"  组合: {melds}" if melds else ""))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="重放麻将牌局记录")
+    parser.add_argument("log", help="牌局记录（JSON文件，- 表示标准输入）")
+    parser.add_argument("--step", type=int, help="只重放前 N 条操作")
+    parser.add_argument("--events", action="store_true", help="输出重放产生的事件")
+    args = parser.parse_args(argv)
+
+    if args.log == "-":
+        log = json.load(sys.stdin)
+    else:
+        with open(args.log, encoding="utf-8") as f:
+            log = json.load(f)
+
+    start = time.perf_counter()
+    game = replay(log, args.step)
+    elapsed = time.perf_counter() - start
+
+    if args.events:
+        for event in game.events:
+            print(json.dumps({key: value for key, value in event.items() if key != "time"}, ensure_ascii=False))
+    print(describe(game))
+    print(f"重放 {len(game.action_log) // 2} 条操作，用时 {elapsed * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import hashlib
+import heapq
+import hmac
+import itertools
+import threading
+import time
+
+# 多人房间：最多四个人类玩家共用一局游戏，其余座位是AI
+# 房间就是游戏登记中的一局游戏（房间ID即游戏ID），休眠、共享存储、推送都与单人游戏相同
+# 座位凭邀请码加入：邀请码是房间ID和座位的签名，服务端不需要另外保存房间的成员
+# 人类玩家在限定时间内没有操作时由服务端代打（见 MahjongGame.timeout_action），所有房间共用一个计时线程
+
+MAX_HUMANS = 4
+
+
+# 有两个以上人类座位的游戏是房间，单人游戏不限时
+def is_room(game):
+    return game.seat_types.count("human") > 1
+
+
+def _key(secret):
+    return secret if isinstance(secret, bytes) else str(secret).encode()
+
+
+# 座位的邀请码："座位.签名"
+def seat_token(secret, room_id, seat):
+    digest = hmac.new(_key(secret), f"{room_id}:{seat}".encode(), hashlib.sha256).hexdigest()[:24]
+    return f"{seat}.{digest}"
+
+
+# 邀请码对应的座位，不合法时返回 None
+def token_seat(secret, room_id, token):
+    seat, _, _ = str(token).partition(".")
+    if not seat.isdigit() or int(seat) >= MAX_HUMANS:
+        return None
+    if not hmac.compare_digest(seat_token(secret, room_id, int(seat)), str(token)):
+        return None
+    return int(seat)
+
+
+# 所有房间的操作时限：每个房间只有最近一次设置的时限有效（按游戏版本号和座位区分），
+# 作废的时限先留在堆中，到时间后丢弃；作废的比有效的多时重建一次堆，堆的大小不超过在线房间数的两倍加一
+# 到期时在计时线程中调用 callback(房间ID, 版本号, 座位)，callback 不能阻塞（例如交给线程池执行）
+class TurnTimer:
+    def __init__(self, callback):
+        self.callback = callback
+        self.heap = []  # (到期时间, 序号, 房间ID, 版本号, 座位)
+        self.armed = {}  # 房间ID -> (版本号, 座位)
+        self.cond = threading.Condition()
+        self.counter = itertools.count()
+        self.thread = None
+        self.fired = 0  # 累计到期（代打）次数
+
+    def __len__(self):
+        return len(self.armed)
+
+    # 设置房间的操作时限；与当前有效的时限相同（同一个版本、同一个座位）时不重复设置
+    def arm(self, room_id, version, seat, timeout):
+        with self.cond:
+            if self.armed.get(room_id) == (version, seat):
+                return
+            self.armed[room_id] = (version, seat)
+            heapq.heappush(self.heap, (time.monotonic() + timeout, next(self.counter), room_id, version, seat))
+            self._compact()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="mahjong-turn-timer", daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    # 不再等待这个房间（游戏结束或正在等待AI）
+    def disarm(self, room_id):
+        with self.cond:
+            self.armed.pop(room_id, None)
+            self._compact()
+
+    # 只保留有效的时限（调用前必须持有 cond）；每次重建前作废的时限至少与有效的一样多，分摊到每次设置是常数时间
+    def _compact(self):
+        if len(self.heap) <= 2 * len(self.armed) + 1:
+            return
+        self.heap = [item for item in self.heap if self.armed.get(item[2]) == (item[3], item[4])]
+        heapq.heapify(self.heap)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    now = time.monotonic()
+                    if self.heap and self.heap[0][0] <= now:
+                        break
+                    self.cond.wait(self.heap[0][0] - now if self.heap else None)
+                _, _, room_id, version, seat = heapq.heappop(self.heap)
+                if self.armed.get(room_id) != (version, seat):
+                    continue
+                del self.armed[room_id]
+                self.fired += 1
+            self.callback(room_id, version, seat)
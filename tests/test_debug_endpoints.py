@@ -0,0 +1,68 @@
+import importlib.util
+import os
+
+import pytest
+
+import app as mahjong_app
+import profiling
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setitem(mahjong_app.app.config, "DEBUG_TOKEN", "s3cret")
+    monkeypatch.setattr(mahjong_app, "profiler", profiling.RequestProfiler(str(tmp_path), 0.0))
+    return mahjong_app.app.test_client()
+
+
+def test_debug_disabled_without_token(client, monkeypatch):
+    monkeypatch.setitem(mahjong_app.app.config, "DEBUG_TOKEN", "")
+    assert client.get("/debug/profiles").status_code == 404
+    assert client.get("/debug/profiles", headers={"X-Mahjong-Debug-Token": ""}).status_code == 404
+
+
+def test_debug_requires_token(client):
+    assert client.get("/debug/profiles").status_code == 403
+    assert client.get("/debug/profiles", headers={"X-Mahjong-Debug-Token": "wrong"}).status_code == 403
+    response = client.get("/debug/profiles", headers={"X-Mahjong-Debug-Token": "s3cret"})
+    assert response.status_code == 200
+    assert response.get_json()["success"]
+
+
+# 配置了 MAHJONG_PROFILE_DIR 的应用（只在导入时注册分析钩子，所以单独导入一份）
+@pytest.fixture
+def profiled_app(monkeypatch, tmp_path):
+    monkeypatch.setenv("MAHJONG_PROFILE_DIR", str(tmp_path))
+    monkeypatch.setenv("MAHJONG_PROFILE_RATE", "0")
+    monkeypatch.setenv("MAHJONG_DEBUG_TOKEN", "s3cret")
+    spec = importlib.util.spec_from_file_location("profiled_app", mahjong_app.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# 强制分析的请求头只有带着调试口令时才生效，文件名中是游戏ID的散列值
+def test_profile_header_needs_token(profiled_app, tmp_path):
+    client = profiled_app.app.test_client()
+    game_id = client.post("/start_game", json={}).get_json()["game_id"]
+    for headers in ({"X-Mahjong-Profile": "1"},
+                    {"X-Mahjong-Profile": "1", "X-Mahjong-Debug-Token": "wrong"}):
+        assert client.get("/game_state", headers=headers).status_code == 200
+    assert os.listdir(tmp_path) == []
+
+    headers = {"X-Mahjong-Profile": "1", "X-Mahjong-Debug-Token": "s3cret"}
+    assert client.get("/game_state", headers=headers).status_code == 200
+    [name] = os.listdir(tmp_path)
+    assert name.split(".")[1:3] == ["game_state", profiling.game_hash(game_id)]
+    assert game_id not in name
+
+
+# 分析结果的文件名和列表中只有游戏ID的散列值
+def test_profile_files_hide_game_id(tmp_path):
+    profiler = profiling.RequestProfiler(str(tmp_path))
+    game_id = "0123456789abcdef0123456789abcdef"
+    name = profiler.finish(profiler.start(), "draw_tile", game_id)
+    assert game_id not in name
+    assert game_id not in "".join(os.listdir(tmp_path))
+    [item] = profiler.files()
+    assert item["game_hash"] == profiling.game_hash(game_id)
+    assert "game_id" not in item
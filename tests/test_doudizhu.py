@@ -0,0 +1,81 @@
+import collections
+
+import pytest
+
+import app as mahjong_app
+from doudizhu import Card, DoudizhuGame
+from doudizhu_plays import BOMB, PAIR, SINGLE, encode_ranks
+from doudizhu_solver import DEFAULT_NODE_LIMIT, EndgameSolver
+
+
+# 开始新的一局只移除会话中自己的游戏，请求头中别人的游戏不移除
+def test_init_game_only_removes_session_game():
+    victim_id = mahjong_app.app.test_client().post("/init_game").get_json()["game_id"]
+    client = mahjong_app.app.test_client()
+    first_id = client.post("/init_game", headers={"X-Game-Id": victim_id}).get_json()["game_id"]
+    assert mahjong_app.doudizhu_games.get(victim_id) is not None
+
+    client.post("/init_game")
+    assert mahjong_app.doudizhu_games.get(first_id) is None
+    assert mahjong_app.doudizhu_games.get(victim_id) is not None
+
+
+# 地主是 0 号位，三家的手牌换成指定的点数（每个点数按花色依次取牌，不含王）
+def playing_game(*hands):
+    game = DoudizhuGame(seed=1, seat_types=["human"] * 3)
+    game.bid(0, True)
+    used = collections.Counter()
+    for player in game.players:
+        player["hand"] = []
+        player["counts"] = [0] * len(player["counts"])
+    for player_idx, ranks in enumerate(hands):
+        cards = []
+        for rank in ranks:
+            cards.append(Card(rank * 4 + used[rank]))
+            used[rank] += 1
+        game.give_cards(player_idx, cards)
+    return game
+
+
+def indices(game, player_idx, ranks):
+    hand = game.players[player_idx]["hand"]
+    chosen = []
+    for rank in ranks:
+        chosen.append(next(i for i, card in enumerate(hand) if card.rank == rank and i not in chosen))
+    return chosen
+
+
+def test_play_cards_rejects_illegal_and_weaker_plays():
+    game = playing_game([0, 1, 5, 5, 9], [2, 4, 4, 6, 6, 6, 6], [3, 7, 8])
+
+    with pytest.raises(ValueError):
+        game.play_cards(0, indices(game, 0, [0, 1]))  # 不是合法的牌型
+    with pytest.raises(ValueError):
+        game.play_cards(0, [])  # 新的一轮必须出牌
+    with pytest.raises(ValueError):
+        game.play_cards(0, [0, 0])
+    assert len(game.players[0]["hand"]) == 5 and game.current_player == 0
+
+    assert game.play_cards(0, indices(game, 0, [5, 5])) == (PAIR, 5, 1)
+    with pytest.raises(ValueError):
+        game.play_cards(1, indices(game, 1, [4, 4]))  # 点数更小
+    with pytest.raises(ValueError):
+        game.play_cards(1, indices(game, 1, [2]))  # 牌型不同
+    assert len(game.players[1]["hand"]) == 7 and game.current_player == 1
+
+    assert game.play_cards(1, indices(game, 1, [6, 6, 6, 6])) == (BOMB, 6, 1)
+    assert game.play_cards(2, []) is None
+    with pytest.raises(ValueError):
+        game.play_cards(0, indices(game, 0, [9]))
+    assert game.play_cards(0, []) is None
+    # 没有人管上，重新自由出牌
+    assert game.play_cards(1, indices(game, 1, [2])) == (SINGLE, 2, 1)
+
+
+# 残局求解找到先出 2 的必胜出法；超过搜索上限时改用普通策略（先出最小的牌）
+@pytest.mark.parametrize("node_limit, expected", [(DEFAULT_NODE_LIMIT, [12]), (0, [0])])
+def test_endgame_move_falls_back_when_aborted(node_limit, expected):
+    game = playing_game([0, 12], [3], [4])
+    game.solver = EndgameSolver(0, node_limit=node_limit)
+    assert game.endgame_move(0) == (encode_ranks(expected) if node_limit else None)
+    assert game.ai_choose_play(0) == indices(game, 0, expected)
@@ -0,0 +1,92 @@
+import pytest
+
+import benchmark
+import doudizhu_plays
+from doudizhu_plays import (AIRPLANE, AIRPLANE_PAIR, AIRPLANE_SINGLE, BOMB, FOUR_TWO_PAIR, FOUR_TWO_SINGLE, PAIR,
+                            PAIR_STRAIGHT, ROCKET, SINGLE, STRAIGHT, TRIPLE, TRIPLE_PAIR, TRIPLE_SINGLE, beats, classify)
+
+
+# 生成的出法必须与逐一检查编码表的结果相同
+def test_generate_plays_matches_table():
+    for counts in benchmark.make_doudizhu_hands(2024, 20) + benchmark.DOUDIZHU_WORST_HANDS:
+        expected = {
+            (play, key) for key, play in doudizhu_plays.PLAY_TABLE.items()
+            if all(a <= b for a, b in zip(doudizhu_plays.decode_key(key), counts))
+        }
+        plays = doudizhu_plays.generate_plays(counts)
+        assert len(plays) == len(expected)
+        assert set(plays) == expected
+
+
+# 点数：0-7 为 3-10，8 J、9 Q、10 K、11 A、12 为 2，13 小王、14 大王
+@pytest.mark.parametrize("ranks, expected", [
+    ([0], (SINGLE, 0, 1)),
+    ([14], (SINGLE, 14, 1)),
+    ([12, 12], (PAIR, 12, 1)),
+    ([3, 3, 3], (TRIPLE, 3, 1)),
+    ([3, 3, 3, 13], (TRIPLE_SINGLE, 3, 1)),
+    ([3, 3, 3, 5, 5], (TRIPLE_PAIR, 3, 1)),
+    ([0, 1, 2, 3, 4], (STRAIGHT, 0, 5)),
+    (list(range(12)), (STRAIGHT, 0, 12)),
+    ([0, 0, 1, 1, 2, 2], (PAIR_STRAIGHT, 0, 3)),
+    ([r for r in range(2, 12) for _ in range(2)], (PAIR_STRAIGHT, 2, 10)),
+    ([0, 0, 0, 1, 1, 1], (AIRPLANE, 0, 2)),
+    ([0, 0, 0, 1, 1, 1, 5, 14], (AIRPLANE_SINGLE, 0, 2)),
+    ([6, 6, 6, 7, 7, 7, 8, 8, 8, 0, 1, 12], (AIRPLANE_SINGLE, 6, 3)),
+    ([0, 0, 0, 1, 1, 1, 5, 5, 12, 12], (AIRPLANE_PAIR, 0, 2)),
+    ([4, 4, 4, 4, 0, 1], (FOUR_TWO_SINGLE, 4, 1)),
+    ([4, 4, 4, 4, 0, 0], (FOUR_TWO_SINGLE, 4, 1)),
+    ([4, 4, 4, 4, 0, 0, 1, 1], (FOUR_TWO_PAIR, 4, 1)),
+    ([5, 5, 5, 5], (BOMB, 5, 1)),
+    ([13, 14], (ROCKET, 13, 1)),
+])
+def test_classify(ranks, expected):
+    assert classify(ranks) == expected
+    assert classify(reversed(ranks)) == expected
+
+
+@pytest.mark.parametrize("ranks", [
+    [],
+    [0, 1],
+    [0, 0, 1],
+    [0, 1, 2, 3],  # 顺子至少5张
+    [8, 9, 10, 11, 12],  # 顺子不能带 2
+    [9, 10, 11, 12, 13],  # 也不能带王
+    [0, 0, 1, 1],  # 连对至少3对
+    [10, 10, 11, 11, 12, 12],
+    [11, 11, 11, 12, 12, 12],  # 飞机不能带 2
+    [0, 0, 0, 1, 1, 1, 5],  # 翅膀数与三张的组数不同
+    [0, 0, 0, 1, 1, 1, 13, 14],  # 不能同时带两个王
+    [0, 0, 0, 1, 1, 1, 5, 5, 7],
+    [0, 0, 0, 0, 1],
+    [4, 4, 4, 4, 13, 14],
+    [4, 4, 4, 4, 0, 0, 1],
+    [3, 3, 3, 13, 14],
+    [0, 0, 0, 2, 2, 2],  # 三张不连续
+])
+def test_classify_rejects(ranks):
+    assert classify(ranks) is None
+
+
+@pytest.mark.parametrize("play, prev, expected", [
+    ((SINGLE, 0, 1), None, True),
+    ((SINGLE, 5, 1), (SINGLE, 4, 1), True),
+    ((SINGLE, 4, 1), (SINGLE, 4, 1), False),
+    ((SINGLE, 3, 1), (SINGLE, 4, 1), False),
+    ((PAIR, 9, 1), (SINGLE, 4, 1), False),
+    ((STRAIGHT, 1, 5), (STRAIGHT, 0, 5), True),
+    ((STRAIGHT, 1, 6), (STRAIGHT, 0, 5), False),  # 张数必须相同
+    ((AIRPLANE_PAIR, 2, 2), (AIRPLANE_PAIR, 1, 2), True),
+    ((AIRPLANE_PAIR, 2, 2), (AIRPLANE_SINGLE, 1, 2), False),
+    ((BOMB, 0, 1), (STRAIGHT, 7, 5), True),
+    ((BOMB, 0, 1), (FOUR_TWO_PAIR, 12, 1), True),
+    ((BOMB, 1, 1), (BOMB, 0, 1), True),
+    ((BOMB, 0, 1), (BOMB, 1, 1), False),
+    ((FOUR_TWO_SINGLE, 12, 1), (BOMB, 0, 1), False),
+    ((ROCKET, 13, 1), (BOMB, 12, 1), True),
+    ((ROCKET, 13, 1), (SINGLE, 14, 1), True),
+    ((BOMB, 12, 1), (ROCKET, 13, 1), False),
+    ((SINGLE, 14, 1), (ROCKET, 13, 1), False),
+])
+def test_beats(play, prev, expected):
+    assert beats(play, prev) == expected
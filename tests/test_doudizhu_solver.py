@@ -0,0 +1,30 @@
+import pytest
+
+from doudizhu_plays import encode_ranks
+from doudizhu_solver import NO_PLAYER, EndgameSolver, SearchAborted
+
+# 点数：0 为 3，12 为 2
+# 地主（0号位）剩一张 2 和一张 3，两家农民各剩一张小牌：先出 2 没人管得上，再出 3 就赢了；先出 3 会被农民管上走完
+FORCED_WIN = [encode_ranks([0, 12]), encode_ranks([3]), encode_ranks([4])]
+
+
+def test_finds_forced_win():
+    solver = EndgameSolver(0)
+    assert solver.best_move(FORCED_WIN, 0) == encode_ranks([12])
+    # 置换表在之后的搜索中复用
+    assert solver.table
+    assert solver.best_move(FORCED_WIN, 0) == encode_ranks([12])
+
+
+def test_no_winning_move():
+    hands = [encode_ranks([0, 1]), encode_ranks([12]), encode_ranks([12])]
+    assert EndgameSolver(0).best_move(hands, 0) is None
+    # 对农民来说，管上地主的 3 就赢了
+    assert EndgameSolver(0).best_move(hands, 1, 0, encode_ranks([0])) == encode_ranks([12])
+
+
+def test_node_limit_aborts():
+    solver = EndgameSolver(0, node_limit=0)
+    with pytest.raises(SearchAborted):
+        solver.best_move(FORCED_WIN, 0, NO_PLAYER, 0)
+
@@ -0,0 +1,155 @@
+import pytest
+
+import benchmark
+import hand_tables
+from hand_tables import counter_to_counts, is_winning_counter, is_winning_counts
+from mahjong import MahjongGame, Tile
+
+
+# 查表结果必须与原来的递归搜索完全一致（普通胡牌、清一色、七对子形状和随机手牌）
+@pytest.mark.parametrize("seed", [2024, 7])
+def test_win_table_matches_recursive(seed):
+    game = MahjongGame()
+    for counter, melds in benchmark.make_win_cases(seed, 2000):
+        expected = game.is_valid_hand(counter, melds)
+        assert is_winning_counter(counter, melds) == expected, (dict(counter), melds)
+        assert is_winning_counts(counter_to_counts(counter), melds) == expected, (dict(counter), melds)
+
+
+# 每局玩家0"打一张、摸一张"的所有组合；批量结果必须与 can_win 和单手牌的向听数一致
+def test_batch_matches_scalar():
+    hand_batch = pytest.importorskip("hand_batch")
+    for game, pairs, counts in benchmark.make_batch_cases(2024, 20):
+        wins, shantens = hand_batch.batch_evaluate(counts)
+        player_counts = game.players[0]["counts"]
+        for (discard, draw), row, win, value in zip(pairs, counts, wins, shantens):
+            player_counts[discard] -= 1
+            try:
+                expected = game.can_win(0, Tile(*hand_tables.TILE_KEYS[draw]))
+            finally:
+                player_counts[discard] += 1
+            assert bool(win) == expected, (discard, draw)
+            assert int(value) == hand_tables._shanten(list(row), 0), (discard, draw)
+
+
+def hand(*tile_ids):
+    counts = [0] * hand_tables.TILE_KINDS
+    for tile_id in tile_ids:
+        counts[tile_id] += 1
+    return counts
+
+
+# 听牌判定的对照：逐个试34种牌（手里已有4张的牌摸不到）
+def probe_waits(counts, existing_melds):
+    counts = list(counts)
+    waits = []
+    for tile_id in range(hand_tables.TILE_KINDS):
+        if counts[tile_id] >= 4:
+            continue
+        counts[tile_id] += 1
+        if is_winning_counts(counts, existing_melds):
+            waits.append(tile_id)
+        counts[tile_id] -= 1
+    return tuple(waits)
+
+
+# 胡牌的手牌去掉任意一张（大多听牌）以及随机手牌
+def waiting_cases(seed):
+    for counter, melds in benchmark.make_win_cases(seed, 1000):
+        counts = counter_to_counts(counter)
+        if (sum(counts) + 3 * melds) % 3 != 2:
+            continue
+        for tile_id, count in enumerate(counts):
+            if count:
+                counts[tile_id] -= 1
+                yield list(counts), melds
+                counts[tile_id] += 1
+
+
+@pytest.mark.parametrize("seed", [2024, 7])
+def test_waiting_tiles_match_probe(seed):
+    for counts, melds in waiting_cases(seed):
+        waits = hand_tables.waiting_tiles(counts, melds)
+        assert waits == probe_waits(counts, melds), (counts, melds)
+        # 向听数不考虑每种牌只有4张：为0却不听牌时，缺的牌只能是手里已有4张的牌
+        if waits:
+            assert hand_tables.shanten(counts, melds) == 0, (counts, melds)
+        elif hand_tables.shanten(counts, melds) == 0:
+            assert 4 in counts, (counts, melds)
+
+
+# 筒 0-8、条 9-17、万 18-26、风 27-30
+@pytest.mark.parametrize("tile_ids, melds, expected, waits", [
+    ((0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 9, 9, 22, 22), 0, -1, ()),
+    ((0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 9, 9, 22), 0, 0, (22,)),
+    ((0, 0, 0, 1, 2, 3, 4, 5, 6, 7, 8, 8, 8), 0, 0, tuple(range(9))),
+    ((0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 9, 22, 26), 0, 1, ()),
+    ((0, 3, 6, 9, 12, 15, 18, 21, 24, 27, 28, 29, 30), 0, 8, ()),
+    ((0, 1, 2, 22, 26, 27, 28), 2, 2, ()),
+    ((0, 1, 22, 26), 3, 1, ()),
+    ((1, 2, 22, 22), 3, 0, (0, 3)),
+    ((0, 1, 2, 22, 22), 3, -1, ()),
+    ((22,), 4, 0, (22,)),
+    ((22, 22), 4, -1, ()),
+])
+def test_known_shanten(tile_ids, melds, expected, waits):
+    counts = hand(*tile_ids)
+    assert hand_tables.shanten(counts, melds) == expected
+    if sum(counts) % 3 == 1:
+        assert hand_tables.waiting_tiles(counts, melds) == waits
+
+
+def counting(calls):
+    def compute(counts, existing_melds):
+        calls.append(bytes(counts))
+        return sum(counts)
+    return compute
+
+
+# 超过条目上限时淘汰最久未使用的结果
+def test_hand_cache_evicts_least_recently_used():
+    cache = hand_tables.HandCache(max_entries=2)
+    calls = []
+    a, b, c = hand(0), hand(1), hand(2)
+    cache.get(hand_tables.SHANTEN, a, 0, counting(calls))
+    cache.get(hand_tables.SHANTEN, b, 0, counting(calls))
+    cache.get(hand_tables.SHANTEN, a, 0, counting(calls))  # a 变成最近使用的
+    cache.get(hand_tables.SHANTEN, c, 0, counting(calls))  # 淘汰 b
+    assert len(cache) == 2
+    assert len(calls) == 3
+
+    cache.get(hand_tables.SHANTEN, a, 0, counting(calls))
+    assert len(calls) == 3
+    cache.get(hand_tables.SHANTEN, b, 0, counting(calls))
+    assert calls[-1] == bytes(b) and len(calls) == 4
+
+    cache.resize(1)
+    assert len(cache) == 1
+    cache.get(hand_tables.SHANTEN, b, 0, counting(calls))
+    assert len(calls) == 4
+
+
+# 键包含已有组合数和结果种类，命中/未命中按种类分别计数
+def test_hand_cache_stats():
+    cache = hand_tables.HandCache(max_entries=10)
+    calls = []
+    counts = hand(0, 1, 2, 3)
+    cache.get(hand_tables.SHANTEN, counts, 0, counting(calls))
+    cache.get(hand_tables.SHANTEN, counts, 0, counting(calls))
+    cache.get(hand_tables.SHANTEN, counts, 3, counting(calls))
+    cache.get(hand_tables.WAITS, counts, 0, counting(calls))
+    cache.get(hand_tables.WAITS, counts, 0, counting(calls))
+    cache.get(hand_tables.WAITS, counts, 0, counting(calls))
+
+    stats = cache.stats()
+    assert stats["entries"] == 3 and stats["max_entries"] == 10
+    assert stats["kinds"] == {
+        "shanten": {"hits": 1, "misses": 2},
+        "waits": {"hits": 2, "misses": 1},
+        "claim": {"hits": 0, "misses": 0},
+    }
+    assert len(calls) == 3
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats()["kinds"]["waits"] == {"hits": 0, "misses": 0}
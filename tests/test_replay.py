@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+import replay
+from mahjong import MahjongGame
+
+
+# 重放只关心牌面：每家的手牌、弃牌、组合和分数，以及牌墙和游戏状态
+def snapshot(game):
+    players = [
+        ([tile.tile_id for tile in player["hand"]],
+         [tile.tile_id for tile in player["discarded"]],
+         [[tile.tile_id for tile in meld["tiles"]] for meld in player["melds"]],
+         player["score"])
+        for player in game.players
+    ]
+    return players, [tile.tile_id for tile in game.tiles], game.game_state
+
+
+def test_same_seed_same_game():
+    first = MahjongGame(seed=42, seat_types=["ai"] * 4)
+    second = MahjongGame(seed=42, seat_types=["ai"] * 4)
+    first.reset(42)
+    second.reset(42)
+    assert first.action_log == second.action_log
+    assert snapshot(first) == snapshot(second)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_replay_rebuilds_ai_game(seed):
+    game = MahjongGame(seed=seed, seat_types=["ai"] * 4)
+    game.reset(seed)
+    rebuilt = replay.replay(replay.dump_log(game))
+    assert rebuilt.action_log == game.action_log
+    assert snapshot(rebuilt) == snapshot(game)
+
+
+# 人类和AI混合的牌局，每一步之后的状态都能用 upto 重建
+@pytest.mark.parametrize("seed", range(10))
+def test_replay_every_prefix(seed):
+    rng = random.Random(seed)
+    game = MahjongGame(seed=seed, seat_types=["human", "ai", "human", "ai"])
+    snapshots = {0: snapshot(MahjongGame(seed=seed, seat_types=["human", "ai", "human", "ai"]))}
+    while game.game_state == "playing":
+        seat = next((i for i in range(4) if game.legal_actions(i)), None)
+        if seat is None:
+            break
+        game.step(seat, rng.choice(game.legal_actions(seat)))
+        snapshots[len(game.action_log) // 2] = snapshot(game)
+
+    log = replay.dump_log(game)
+    for upto, expected in snapshots.items():
+        assert snapshot(replay.replay(log, upto)) == expected, upto
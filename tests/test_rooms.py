@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+import app as mahjong_app
+import rooms
+
+
+def test_seat_token_round_trip():
+    for seat in range(rooms.MAX_HUMANS):
+        token = rooms.seat_token("secret", "room", seat)
+        assert rooms.token_seat("secret", "room", token) == seat
+
+
+@pytest.mark.parametrize("token", [
+    "", "1", "1.", "x.abc", "-1.abc", f"{rooms.MAX_HUMANS}.abc", "1.000000000000000000000000",
+])
+def test_forged_token_rejected(token):
+    assert rooms.token_seat("secret", "room", token) is None
+
+
+def test_token_bound_to_room_and_secret():
+    token = rooms.seat_token("secret", "room", 1)
+    assert rooms.token_seat("secret", "other", token) is None
+    assert rooms.token_seat("other", "room", token) is None
+    # 改了座位号的邀请码不能用
+    assert rooms.token_seat("secret", "room", "2" + token[1:]) is None
+
+
+@pytest.fixture
+def client():
+    return mahjong_app.app.test_client()
+
+
+# 开始新的一局只移除会话中自己的单人游戏，请求头中的游戏ID和房间都不移除
+def test_start_game_only_removes_session_game(client):
+    victim_id = mahjong_app.app.test_client().post("/start_game", json={}).get_json()["game_id"]
+    room = mahjong_app.app.test_client().post("/rooms", json={"humans": 2}).get_json()
+    client.post("/start_game", json={}, headers={"X-Game-Id": victim_id})
+    client.post("/rooms", json={"humans": 2}, headers={"X-Game-Id": room["room_id"]})
+    assert mahjong_app.games.get(victim_id) is not None
+    assert mahjong_app.games.get(room["room_id"]) is not None
+
+    # 带着别人房间的邀请码，从会话中没有座位的客户端开始新的一局
+    invitee = mahjong_app.app.test_client()
+    headers = {"X-Game-Id": room["room_id"], "X-Seat-Token": room["invites"][0]["token"]}
+    assert invitee.get("/game_state", headers=headers).status_code == 200
+    invitee.post("/start_game", json={}, headers=headers)
+    assert mahjong_app.games.get(room["room_id"]) is not None
+
+
+def test_start_game_replaces_own_game(client):
+    first_id = client.post("/start_game", json={}).get_json()["game_id"]
+    second_id = client.post("/start_game", json={}).get_json()["game_id"]
+    assert mahjong_app.games.get(first_id) is None
+    room_id = client.post("/rooms", json={"humans": 2}).get_json()["room_id"]
+    assert mahjong_app.games.get(second_id) is None
+    # 之前的房间还有其他玩家，不移除
+    client.post("/start_game", json={})
+    assert mahjong_app.games.get(room_id) is not None
+
+
+def timer():
+    fired = []
+    done = threading.Event()
+
+    def callback(*args):
+        fired.append(args)
+        done.set()
+    return rooms.TurnTimer(callback), fired, done
+
+
+def test_timer_fires_latest_arm_only():
+    turn_timer, fired, done = timer()
+    turn_timer.arm("room", 1, 0, 0.05)
+    turn_timer.arm("room", 2, 1, 0.05)
+    assert done.wait(5)
+    time.sleep(0.1)
+    assert fired == [("room", 2, 1)]
+    assert turn_timer.fired == 1 and len(turn_timer) == 0
+
+
+def test_disarmed_timer_does_not_fire():
+    turn_timer, fired, done = timer()
+    turn_timer.arm("room", 1, 0, 0.05)
+    turn_timer.disarm("room")
+    turn_timer.arm("other", 1, 0, 0.1)
+    assert done.wait(5)
+    assert fired == [("other", 1, 0)]
+
+
+# 反复重新设置时限，堆中作废的时限不会一直累积
+def test_timer_heap_stays_bounded():
+    turn_timer, fired, _ = timer()
+    for version in range(1000):
+        for room in range(5):
+            turn_timer.arm(room, version, 0, 60)
+    assert len(turn_timer) == 5
+    assert len(turn_timer.heap) <= 2 * 5 + 1
+    for room in range(5):
+        turn_timer.disarm(room)
+    assert len(turn_timer.heap) <= 1
+    assert fired == []
@@ -0,0 +1,139 @@
+import collections
+import random
+
+from hand_tables import claim_tiles
+from mahjong import TURN_DRAW, MahjongGame, Tile
+
+# 座位3（离出牌者最远）单钓五万：1-3筒、4-6筒、1-3条、7-9条加一张五万
+WINNING_WAIT = ([Tile("筒", v) for v in range(1, 7)] + [Tile("条", v) for v in (1, 2, 3, 7, 8, 9)] +
+                [Tile("万", 5)])
+# 有一对五万可以碰，但不能胡
+PONG_ONLY = ([Tile("万", 5)] * 2 + [Tile("风", "东")] * 3 + [Tile("风", "南")] * 3 +
+             [Tile("箭", v) for v in ("中", "发", "白")] + [Tile("条", 1), Tile("万", 9)])
+# 与五万无关的手牌
+UNRELATED = ([Tile("万", 1)] * 2 + [Tile("万", 9)] * 2 + [Tile("条", 5)] * 2 + [Tile("筒", v) for v in (7, 8, 9)] +
+             [Tile("风", "西"), Tile("风", "北"), Tile("箭", "中"), Tile("箭", "白")])
+# 出牌者的手牌：最后打出五万
+DISCARDER = ([Tile("筒", 9)] * 3 + [Tile("条", 9)] * 3 + [Tile("万", 2)] * 3 + [Tile("风", "北")] * 2 +
+             [Tile("箭", "发")] * 2 + [Tile("万", 5)])
+
+
+def set_hand(game, seat, hand):
+    player = game.players[seat]
+    player["hand"] = sorted(hand, key=lambda tile: tile.tile_id)
+    player["counts"] = [0] * len(player["counts"])
+    for tile in hand:
+        player["counts"][tile.tile_id] += 1
+    if len(hand) % 3 == 1:
+        game.update_claim_index(seat)
+
+
+# 座位0摸牌后换成指定的手牌并打出五万，hands 为座位1-3的手牌
+def discard_five(seat_types, hands):
+    game = MahjongGame(seed=1, seat_types=seat_types)
+    game.step(0, ("draw", None))
+    for seat, hand in enumerate(hands, 1):
+        set_hand(game, seat, hand)
+    set_hand(game, 0, DISCARDER)
+    five = next(i for i, tile in enumerate(game.players[0]["hand"]) if tile.tile_id == Tile("万", 5).tile_id)
+    game.step(0, ("discard", five))
+    return game
+
+
+def test_win_beats_nearer_pong():
+    game = discard_five(["human"] * 4, [PONG_ONLY, UNRELATED, WINNING_WAIT])
+    # 座位1离得更近，但胡优先于碰
+    assert game.awaited_seat == 3
+    assert game.legal_actions(3) == [("win", None), ("pass", None)]
+    assert game.legal_actions(1) == []
+
+    # 胡的座位过了之后才轮到碰
+    game.step(3, ("pass", None))
+    assert game.awaited_seat == 1
+    assert game.legal_actions(1) == [("pong", None), ("pass", None)]
+
+    # 都不鸣牌时轮到出牌者的下家摸牌
+    game.step(1, ("pass", None))
+    assert game.awaited_seat == 1
+    assert game.legal_actions(1) == [("draw", None)]
+
+
+def test_win_ends_claims():
+    game = discard_five(["human"] * 4, [PONG_ONLY, UNRELATED, WINNING_WAIT])
+    game.step(3, ("win", None))
+    assert game.game_state == "win"
+    assert game.players[3]["winning_hand"]
+    assert game.players[1]["melds"] == []
+    assert all(game.legal_actions(seat) == [] for seat in range(4))
+
+
+def test_same_priority_from_next_seat():
+    game = discard_five(["human"] * 4, [UNRELATED, WINNING_WAIT, WINNING_WAIT])
+    # 两家都能胡时从出牌者的下家开始
+    assert game.awaited_seat == 2
+    game.step(2, ("pass", None))
+    assert game.awaited_seat == 3
+    assert ("win", None) in game.legal_actions(3)
+
+
+def test_ai_claims_follow_priority():
+    game = discard_five(["human", "ai", "ai", "ai"], [PONG_ONLY, UNRELATED, WINNING_WAIT])
+    # AI之间同样是胡优先：座位3胡牌，座位1没有机会碰
+    assert game.game_state == "win"
+    assert game.players[3]["winning_hand"]
+    assert game.players[1]["melds"] == []
+
+
+def test_advance_caps_work_per_call():
+    game = MahjongGame(seed=5, seat_types=["ai"] * 4)
+    game.schedule(TURN_DRAW, game.current_player)
+    steps = 0
+    while game.pending_turn and game.game_state == "playing":
+        before = len(game.action_log)
+        game.advance(max_actions=1)
+        # 每次只执行一个任务，最多产生一条操作记录（2字节，AI不鸣牌时没有记录）
+        assert len(game.action_log) - before <= 2
+        steps += 1
+    assert game.game_state != "playing"
+    assert steps > 10
+
+
+# 每次出牌后，按索引提前返回的结果必须与逐一检查碰、杠、胡的结果相同
+def test_claim_index_hides_nothing():
+    seen = collections.Counter()
+
+    def check_claims(game):
+        tile = game.last_discarded
+        for seat in range(4):
+            if seat == game.current_player:
+                continue
+            player = game.players[seat]
+            assert player["claim_tiles"] == claim_tiles(player["counts"], len(player["melds"]))
+            expected = {name for name, allowed in (("pong", game.can_pong(seat, tile)),
+                                                   ("kong", game.can_kong(seat, tile)),
+                                                   ("win", game.can_win(seat, tile))) if allowed}
+            actions = game.check_player_actions(seat)
+            assert {name for name in actions if name in ("pong", "kong", "win")} == expected
+            seen.update(expected)
+
+    rng = random.Random(8)
+    for seed in range(60):
+        game = MahjongGame(seed=seed, seat_types=["human"] * 4)
+        discard = game.discard_tile
+
+        def checked_discard(player_idx, tile_idx, game=game, discard=discard):
+            tile = discard(player_idx, tile_idx)
+            check_claims(game)
+            return tile
+        game.discard_tile = checked_discard
+
+        while game.game_state == "playing":
+            seats = [seat for seat in range(4) if game.legal_actions(seat)]
+            if not seats:
+                break
+            seat = rng.choice(seats)
+            # 优先鸣牌，让手牌中有更多的碰、杠
+            actions = game.legal_actions(seat)
+            claims = [action for action in actions if action[0] in ("win", "kong", "pong")]
+            game.step(seat, claims[0] if claims and rng.random() < 0.7 else rng.choice(actions))
+    assert seen["pong"] and seen["kong"] and seen["win"]
@@ -0,0 +1,106 @@
+import base64
+import random
+
+import pytest
+
+import app as mahjong_app
+from mahjong import MahjongGame, tile_id_to_dict
+
+TILE_LISTS = ("player_hand", "player_discarded", "player_waiting_tiles")
+
+
+# 把 compact 格式还原成 verbose 格式
+def unpack(text):
+    return [tile_id_to_dict(tile_id) for tile_id in base64.b64decode(text)]
+
+
+def decode_tile(tile_id):
+    return None if tile_id is None else tile_id_to_dict(tile_id)
+
+
+def decode_meld(meld):
+    return dict(meld, tiles=unpack(meld["tiles"]))
+
+
+def decode_state(state):
+    state = dict(state)
+    for name in TILE_LISTS:
+        if name in state:
+            state[name] = unpack(state[name])
+    if "player_melds" in state:
+        state["player_melds"] = [decode_meld(meld) for meld in state["player_melds"]]
+    if "opponents" in state:
+        state["opponents"] = [dict(opponent, discarded=unpack(opponent["discarded"]),
+                                   melds=[decode_meld(meld) for meld in opponent["melds"]])
+                              for opponent in state["opponents"]]
+    state["last_discarded"] = decode_tile(state["last_discarded"])
+    return state
+
+
+def decode_events(events):
+    return [dict(event, tile=decode_tile(event["tile"])) for event in events]
+
+
+def decode_delta(delta):
+    return dict(delta, events=decode_events(delta["events"]), patch=decode_state(delta["patch"]))
+
+
+# 四个人类座位随机（优先鸣牌）打到结束，每一步之后的局面
+def play_through(seed):
+    rng = random.Random(seed)
+    game = MahjongGame(seed=seed, seat_types=["human"] * 4)
+    while game.game_state == "playing":
+        seats = [seat for seat in range(4) if game.legal_actions(seat)]
+        if not seats:
+            break
+        seat = rng.choice(seats)
+        actions = game.legal_actions(seat)
+        claims = [action for action in actions if action[0] in ("kong", "pong")]
+        game.step(seat, claims[0] if claims and rng.random() < 0.8 else rng.choice(actions))
+        yield game
+
+
+def assert_round_trip(game):
+    for seat in range(4):
+        verbose = game.get_game_state(seat)
+        compact = game.get_game_state(seat, "compact")
+        assert decode_state(compact) == verbose
+        for since in (0, max(game.version - 3, 0), game.version):
+            verbose = game.get_state_delta(since, seat)
+            compact = game.get_state_delta(since, seat, "compact")
+            assert decode_delta(compact) == verbose
+
+
+def test_compact_round_trip_without_melds():
+    game = MahjongGame(seed=3, seat_types=["human"] * 4)
+    assert_round_trip(game)
+    game.step(0, ("draw", None))
+    assert_round_trip(game)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_compact_round_trip_with_melds_and_claims(seed):
+    seen = set()
+    for game in play_through(seed):
+        assert_round_trip(game)
+        if any(player["melds"] for player in game.players):
+            seen.add("melds")
+        if game.waiting_for_action:
+            seen.add("claim")
+    assert seen == {"melds", "claim"}
+
+
+# 接口按 ?wire=compact 或 Accept 请求头返回 compact 格式，内容与 verbose 相同
+def test_compact_responses():
+    client = mahjong_app.app.test_client()
+    client.post("/start_game", json={})
+    verbose = client.get("/game_state").get_json()
+    for response in (client.get("/game_state?wire=compact"),
+                     client.get("/game_state", headers={"Accept": mahjong_app.COMPACT_MIMETYPE})):
+        compact = response.get_json()
+        assert dict(compact, game_state=decode_state(compact["game_state"])) == verbose
+
+    verbose = client.get("/game_state?since_version=0").get_json()
+    compact = client.get("/game_state?since_version=0&wire=compact").get_json()
+    assert dict(compact, events=decode_events(compact["events"]),
+                state_patch=decode_state(compact["state_patch"])) == verbose
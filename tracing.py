@@ -0,0 +1,94 @@
+import collections
+import contextlib
+import os
+import threading
+import time
+
+# 单局游戏的调试时间线：记录一次请求内各个引擎阶段（metrics.timed 装饰的方法）的开始和结束时间，
+# 保存在每局游戏自己的环形缓冲区中，导出为 Chrome trace 格式（chrome://tracing、Perfetto 可以直接打开）
+# 只有开启了时间线的游戏才记录；没有线程在记录时 metrics.timed 只多一次判断
+
+# 每局游戏最多保留的阶段数，超过后丢弃最早的
+DEFAULT_CAPACITY = 4096
+
+# 时间线的时间戳用 perf_counter，导出时换算成 Unix 时间（微秒），便于和日志对照
+_CLOCK_OFFSET = time.time() - time.perf_counter()
+
+_local = threading.local()
+_lock = threading.Lock()
+active = 0  # 正在记录时间线的线程数
+
+
+class Trace:
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.spans = collections.deque(maxlen=capacity)  # (名称, 开始, 结束, 线程, 参数)
+        self.threads = {}  # 线程ID -> 线程名
+        self.recorded = 0  # 记录过的总数，减去保留的数量就是被丢弃的数量
+
+    def __len__(self):
+        return len(self.spans)
+
+    def add(self, name, start, end, args=None):
+        tid = threading.get_ident()
+        if tid not in self.threads:
+            self.threads[tid] = threading.current_thread().name
+        self.spans.append((name, start, end, tid, args))
+        self.recorded += 1
+
+    def clear(self):
+        self.spans.clear()
+        self.recorded = 0
+
+    # Chrome trace 格式：每个阶段是一个完整事件（ph 为 X），同一线程内按时间嵌套显示
+    def to_chrome(self):
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in self.threads.items()
+        ]
+        for name, start, end, tid, args in list(self.spans):
+            event = {
+                "name": name,
+                "cat": "engine",
+                "ph": "X",
+                "ts": round((start + _CLOCK_OFFSET) * 1e6, 1),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": pid,
+                "tid": tid
+            }
+            if args:
+                event["args"] = args
+            events.append(event)
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"spans": len(self.spans), "dropped": self.recorded - len(self.spans)}
+        }
+
+
+# 当前线程正在记录的时间线，没有时为 None
+def current():
+    return getattr(_local, "trace", None)
+
+
+# 在当前线程中记录 trace（为 None 时什么都不做），整段作为一个名为 name 的阶段，args 为附加信息
+# 可以在 with 块中修改 args（例如加上结束时的版本号）
+@contextlib.contextmanager
+def recording(trace, name, args=None):
+    global active
+    if trace is None:
+        yield args
+        return
+
+    previous = current()
+    _local.trace = trace
+    with _lock:
+        active += 1
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        trace.add(name, start, time.perf_counter(), args)
+        _local.trace = previous
+        with _lock:
+            active -= 1